@@ -0,0 +1,103 @@
+#Chess Assets
+
+'''Piece images, fonts and rendered text for the GUI, each loaded the first time it is needed and then kept'''
+'''The 12 piece images of a set are scaled to the square size once and saved together as one atlas PNG per size,'''
+'''so later launches decode a single file instead of loading and scaling twelve'''
+
+import collections
+import os
+
+import pygame as pg
+
+from chess_bitboard import PIECES
+
+ASSET_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIRECTORY = os.path.join(ASSET_DIRECTORY, ".asset_cache")
+# file of each piece in each image set, chess_images_fen names the black pieces by their FEN letter
+IMAGE_SETS = {
+    "chess_images": {piece: piece + ".png" for piece in PIECES},
+    "chess_images_fen": {piece: (piece if piece[0] == 'w' else piece[1].lower()) + ".png" for piece in PIECES},
+}
+TEXT_CACHE_SIZE = 64 # rendered text Surfaces kept
+
+_fonts = {} # (name, size, bold, italic) -> Font
+_texts = collections.OrderedDict() # (text, font, colour) -> Surface, least recently used first
+
+
+class PieceImages():
+    # piece code -> size*size Surface, used like a dict; the atlas is read on the first lookup
+    def __init__(self, size, imageSet="chess_images", cacheDirectory=CACHE_DIRECTORY):
+        if imageSet not in IMAGE_SETS:
+            raise ValueError("unknown image set %s, expected one of %s" % (imageSet, ", ".join(IMAGE_SETS)))
+        self.size = size
+        self.imageSet = imageSet
+        self.cacheDirectory = cacheDirectory
+        self.images = None
+
+    def __getitem__(self, piece):
+        if self.images is None:
+            self.load()
+        return self.images[piece]
+
+    def load(self):
+        atlas = self.loadAtlas()
+        if atlas is None:
+            atlas = self.buildAtlas()
+        if pg.display.get_surface() is not None: # pixel format of the window, for fast blits
+            atlas = atlas.convert_alpha()
+        size = self.size
+        # subsurfaces share the atlas pixels, nothing is copied
+        self.images = {piece: atlas.subsurface((i*size, 0, size, size)) for i, piece in enumerate(PIECES)}
+
+    def atlasPath(self):
+        return os.path.join(self.cacheDirectory, "%s_%d.png" % (self.imageSet, self.size))
+
+    def sourcePaths(self):
+        return [os.path.join(ASSET_DIRECTORY, self.imageSet, name) for name in IMAGE_SETS[self.imageSet].values()]
+
+    # the saved atlas, None if there is none or one of the source images is newer
+    def loadAtlas(self):
+        path = self.atlasPath()
+        try:
+            if os.path.getmtime(path) < max(os.path.getmtime(source) for source in self.sourcePaths()):
+                return None
+            return pg.image.load(path)
+        except (OSError, pg.error):
+            return None
+
+    # scales every piece into one strip in PIECES order and saves it, an unwritable cache only costs the saving
+    def buildAtlas(self):
+        size = self.size
+        atlas = pg.Surface((len(PIECES)*size, size), pg.SRCALPHA)
+        for i, source in enumerate(self.sourcePaths()):
+            atlas.blit(pg.transform.scale(pg.image.load(source), (size, size)), (i*size, 0))
+        try:
+            os.makedirs(self.cacheDirectory, exist_ok=True)
+            pg.image.save(atlas, self.atlasPath())
+        except (OSError, pg.error):
+            pass
+        return atlas
+
+
+# system font lookups are slow, each font is looked up once
+def font(name, size, bold=False, italic=False):
+    key = (name, size, bold, italic)
+    if key not in _fonts:
+        if not pg.font.get_init():
+            pg.font.init()
+        _fonts[key] = pg.font.SysFont(name, size, bold, italic)
+    return _fonts[key]
+
+
+# text rendered with font in colour, the same text is only rendered once while it stays in the cache
+def renderText(text, textFont, colour):
+    key = (text, textFont, colour)
+    surface = _texts.get(key)
+    if surface is None:
+        surface = textFont.render(text, 0, pg.Color(colour))
+        _texts[key] = surface
+        if len(_texts) > TEXT_CACHE_SIZE:
+            _texts.popitem(last=False)
+    else:
+        _texts.move_to_end(key)
+    return surface
@@ -0,0 +1,142 @@
+#Chess Bitboards
+
+'''Bitboard tables and helpers used by chess_engine'''
+'''A bitboard is a 64-bit int with one bit per square. Square index is row*8 + col,'''
+'''so bit 0 is a8 (board[0][0]) and bit 63 is h1 (board[7][7])'''
+
+FULL = 0xFFFFFFFFFFFFFFFF
+
+COL_MASKS = [0x0101010101010101 << c for c in range(8)]
+
+# piece codes in bitboard order, white pieces first
+PIECES = ('wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK')
+PIECE_INDEX = {p: i for i, p in enumerate(PIECES)}
+WHITE, BLACK = 0, 1
+
+# (row, col) steps: rook directions first, then bishop directions
+# same order checkPinsandChecks has always used
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+ROOK_DIRS = (0, 1, 2, 3)
+BISHOP_DIRS = (4, 5, 6, 7)
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+
+
+def _stepAttacks(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                bb |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(bb)
+    return table
+
+
+def _raySquares(direction):
+    dr, dc = direction
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        squares = []
+        r, c = r + dr, c + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            squares.append(r * 8 + c)
+            r, c = r + dr, c + dc
+        table.append(tuple(squares))
+    return table
+
+
+KNIGHT_ATTACKS = _stepAttacks(KNIGHT_OFFSETS)
+KING_ATTACKS = _stepAttacks(DIRECTIONS)
+# PAWN_ATTACKS[colour][sq] = squares a pawn of that colour standing on sq captures on
+PAWN_ATTACKS = [_stepAttacks(((-1, -1), (-1, 1))), _stepAttacks(((1, -1), (1, 1)))]
+
+# RAY_SQUARES[d][sq] = squares walked from sq in DIRECTIONS[d], nearest first
+RAY_SQUARES = [_raySquares(d) for d in DIRECTIONS]
+# RAY_MASKS[d][sq] = same squares as one bitboard
+RAY_MASKS = [[sum(1 << s for s in squares) for squares in table] for table in RAY_SQUARES]
+# rays that walk towards higher square indexes find their nearest piece at the lowest set bit
+POSITIVE_DIRS = tuple(dr * 8 + dc > 0 for dr, dc in DIRECTIONS)
+
+
+def _betweenAndLines():
+    between = [[0] * 64 for _ in range(64)]
+    lines = [[0] * 64 for _ in range(64)]
+    for d in range(8):
+        opposite = DIRECTIONS.index((-DIRECTIONS[d][0], -DIRECTIONS[d][1]))
+        for a in range(64):
+            passed = 0
+            for b in RAY_SQUARES[d][a]:
+                between[a][b] = passed
+                lines[a][b] = RAY_MASKS[d][a] | RAY_MASKS[opposite][a] | (1 << a)
+                passed |= 1 << b
+    return between, lines
+
+# BETWEEN[a][b] = squares strictly between a and b, LINE[a][b] = whole board line through both
+# both are 0 when a and b do not share a rank, file or diagonal
+BETWEEN, LINE = _betweenAndLines()
+
+
+def _rayDirections():
+    directions = [[-1] * 64 for _ in range(64)]
+    for d in range(8):
+        for a in range(64):
+            for b in RAY_SQUARES[d][a]:
+                directions[a][b] = d
+    return directions
+
+# RAY_DIRECTION[a][b] = index of the direction leading from a to b, -1 when no ray from a passes b
+RAY_DIRECTION = _rayDirections()
+
+
+# square of the first piece of bb met when walking from the ray's origin in DIRECTIONS[d]
+def nearestSquare(d, bb):
+    if POSITIVE_DIRS[d]:
+        return (bb & -bb).bit_length() - 1
+    return bb.bit_length() - 1
+
+
+# attacks along one ray, up to and including the first occupied square
+def rayAttacks(d, sq, occupied):
+    ray = RAY_MASKS[d][sq]
+    blockers = ray & occupied
+    if blockers:
+        ray ^= RAY_MASKS[d][nearestSquare(d, blockers)]
+    return ray
+
+
+# the squares of the rays from sq whose occupancy matters: the last square of a ray has nothing behind it to block
+def _relevantMask(sq, dirs):
+    mask = 0
+    for d in dirs:
+        for s in RAY_SQUARES[d][sq][:-1]:
+            mask |= 1 << s
+    return mask
+
+ROOK_MASKS = [_relevantMask(sq, ROOK_DIRS) for sq in range(64)]
+BISHOP_MASKS = [_relevantMask(sq, BISHOP_DIRS) for sq in range(64)]
+# slider attacks by square and relevant occupancy, filled in the first time a position needs them so importing
+# stays cheap; they cannot grow past every occupancy of the masks (102400 rook and 5248 bishop entries)
+ROOK_TABLE = [{} for sq in range(64)]
+BISHOP_TABLE = [{} for sq in range(64)]
+
+
+def rookAttacks(sq, occupied):
+    occupied &= ROOK_MASKS[sq]
+    try:
+        return ROOK_TABLE[sq][occupied]
+    except KeyError:
+        attacks = ROOK_TABLE[sq][occupied] = (rayAttacks(0, sq, occupied) | rayAttacks(1, sq, occupied) |
+                                              rayAttacks(2, sq, occupied) | rayAttacks(3, sq, occupied))
+        return attacks
+
+
+def bishopAttacks(sq, occupied):
+    occupied &= BISHOP_MASKS[sq]
+    try:
+        return BISHOP_TABLE[sq][occupied]
+    except KeyError:
+        attacks = BISHOP_TABLE[sq][occupied] = (rayAttacks(4, sq, occupied) | rayAttacks(5, sq, occupied) |
+                                                rayAttacks(6, sq, occupied) | rayAttacks(7, sq, occupied))
+        return attacks
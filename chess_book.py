@@ -0,0 +1,192 @@
+#Chess Opening Book
+
+'''Polyglot-style opening books: a file of 16-byte big-endian entries (key, move, weight, learn) sorted by key'''
+'''Lookups binary-search the file through mmap, so only the pages a search touches are read, and every process'''
+'''that opens the same book shares those pages in the page cache instead of holding its own copy'''
+'''The key is GameState.zobristKey, so the layout and move encoding follow Polyglot but the keys are this engine's'''
+'''usage: python -m chess_book build GAMES.pgn [...] --out book.bin [--max-ply N] [--min-weight N]'''
+'''       python -m chess_book probe book.bin [--fen FEN]'''
+
+import argparse
+import collections
+import mmap
+import os
+import random
+import struct
+import sys
+
+import chess_engine
+import chess_pgn
+
+ENTRY = struct.Struct(">QHHI") # key, move, weight, learn
+KEY = struct.Struct(">Q")
+MAX_WEIGHT = 0xFFFF
+PROMOTION_CODES = {'N': 1, 'B': 2, 'R': 3, 'Q': 4}
+# weight a game adds to the moves of each side: two for a win, one for a draw or an unknown result
+RESULT_WEIGHTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+
+
+# 16-bit Polyglot move: to file, to rank, from file, from rank (rank 0 is the 1st rank), promotion piece
+# castling is written as the king taking its own rook, e1h1 / e1a1
+def encodeMove(move):
+    toCol = move.endCol
+    if move.isCastleMove:
+        toCol = 7 if move.endCol == 6 else 0
+    promotion = PROMOTION_CODES[move.promotionChoice] if move.isPawnPromotion else 0
+    return toCol | (7 - move.endRow) << 3 | move.startCol << 6 | (7 - move.startRow) << 9 | promotion << 12
+
+
+# the legal move of gs with this encoding, None if there is none (a hash collision or a corrupt entry)
+def decodeMove(gs, code):
+    for move in gs.legal_moves():
+        if encodeMove(move) == code:
+            return move
+    return None
+
+
+class OpeningBook():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % ENTRY.size:
+            self.file.close()
+            raise ValueError("%s is not a book, %d bytes is not a whole number of entries" % (path, size))
+        self.count = size // ENTRY.size
+        # an empty file cannot be mapped, it is simply a book without entries
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    # index of the first entry with a key not below key
+    def lowerBound(self, key):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if KEY.unpack_from(self.data, mid * ENTRY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # [(move code, weight, learn)] stored for key, in file order
+    def entries(self, key):
+        found = []
+        i = self.lowerBound(key)
+        while i < self.count:
+            entryKey, move, weight, learn = ENTRY.unpack_from(self.data, i * ENTRY.size)
+            if entryKey != key:
+                break
+            found.append((move, weight, learn))
+            i += 1
+        return found
+
+    # [(move, weight)] for the position of gs, heaviest first, moves that are not legal here are dropped
+    def moves(self, gs):
+        found = []
+        for code, weight, learn in self.entries(gs.zobristKey):
+            move = decodeMove(gs, code)
+            if move is not None:
+                found.append((move, weight))
+        found.sort(key=lambda pair: pair[1], reverse=True)
+        return found
+
+    # a book move for gs picked at random in proportion to the weights, or the heaviest with best; None out of book
+    def chooseMove(self, gs, best=False, rng=random):
+        found = [(move, weight) for move, weight in self.moves(gs) if weight > 0]
+        if not found:
+            return None
+        if best:
+            return found[0][0]
+        return rng.choices([move for move, weight in found], [weight for move, weight in found])[0]
+
+
+# counts (key, move) -> weight over the first maxPly plies of every game in sources (PGN files or line iterables)
+def collectMoves(sources, maxPly=20, out=None):
+    weights = collections.defaultdict(int)
+    games = errors = 0
+    for source in sources:
+        for headers, movetext in chess_pgn.readGames(source):
+            games += 1
+            white, black = RESULT_WEIGHTS.get(headers.get("Result"), (1, 1))
+            try:
+                for gs, move in chess_pgn.replayGame(headers, movetext):
+                    if len(gs.moveLog) >= maxPly:
+                        break
+                    weight = white if gs.whiteToMove else black
+                    if weight:
+                        weights[(gs.zobristKey, encodeMove(move))] += weight
+            except ValueError:
+                errors += 1
+            if out is not None and games % 10000 == 0:
+                out.write("%d games, %d positions and moves\n" % (games, len(weights)))
+    return weights, games, errors
+
+
+# writes a book from collectMoves counts; moves seen with less than minWeight are left out, and the weights of
+# a position are scaled down together when its heaviest move would not fit in 16 bits
+def writeBook(weights, path, minWeight=1):
+    byKey = collections.defaultdict(list)
+    for (key, move), weight in weights.items():
+        if weight >= minWeight:
+            byKey[key].append((weight, move))
+    count = 0
+    with open(path, "wb") as out:
+        for key in sorted(byKey):
+            moves = sorted(byKey[key], reverse=True)
+            scale = min(1.0, MAX_WEIGHT / moves[0][0])
+            for weight, move in moves:
+                out.write(ENTRY.pack(key, move, max(int(weight * scale), 1), 0))
+                count += 1
+    return count
+
+
+def buildBook(sources, path, maxPly=20, minWeight=1, out=sys.stderr):
+    weights, games, errors = collectMoves(sources, maxPly, out)
+    count = writeBook(weights, path, minWeight)
+    out.write("%d games (%d stopped early on a bad move), %d entries written to %s\n" % (games, errors, count, path))
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="chess_book", description="build and probe opening books")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    build = sub.add_parser("build", help="build a book from PGN files")
+    build.add_argument("files", nargs="+", help="PGN files, may be gzipped")
+    build.add_argument("--out", required=True, help="book file to write")
+    build.add_argument("--max-ply", dest="maxPly", type=int, default=20, help="plies of each game that go in the book")
+    build.add_argument("--min-weight", dest="minWeight", type=int, default=1,
+                       help="leave out moves with less weight (2 per win, 1 per draw)")
+    probe = sub.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", default=None, help="position to look up (default: the start position)")
+    args = parser.parse_args(argv)
+
+    if args.mode == "build":
+        buildBook(args.files, args.out, args.maxPly, args.minWeight)
+        return 0
+    gs = chess_engine.GameState.from_fen(args.fen) if args.fen else chess_engine.GameState()
+    with OpeningBook(args.book) as book:
+        found = book.moves(gs)
+        total = sum(weight for move, weight in found)
+        for move, weight in found:
+            print("%-7s %6d %5.1f%%" % (chess_pgn.toSAN(gs, move), weight, 100.0 * weight / total if total else 0))
+        if not found:
+            print("out of book")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+#Chess Cache
+
+'''Search results kept on disk between runs, in an SQLite file keyed by the position's Zobrist key'''
+'''Each position keeps its deepest search: best move, depth, score, nodes and when it was stored, so a batch job'''
+'''skips every position already searched deep enough, whichever process or run searched it'''
+'''The file is in WAL mode: any number of worker processes read it while one of them writes'''
+'''usage: python -m chess_cache stats|prune|clear [--path FILE] [--max-age DAYS] [--min-depth N] [--max-entries N]'''
+
+import argparse
+import collections
+import os
+import sqlite3
+import sys
+import time
+
+import chess_search
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis_cache.sqlite")
+BUSY_TIMEOUT = 30.0 # seconds a process waits for another one's write to finish
+
+CacheEntry = collections.namedtuple("CacheEntry", "move depth score nodes stored")
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS analysis (
+    key INTEGER PRIMARY KEY, move TEXT, depth INTEGER NOT NULL, score INTEGER NOT NULL,
+    nodes INTEGER NOT NULL, stored REAL NOT NULL)"""
+# a new result only replaces one at least as deep
+_UPSERT = """INSERT INTO analysis VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET
+    move = excluded.move, depth = excluded.depth, score = excluded.score, nodes = excluded.nodes,
+    stored = excluded.stored WHERE excluded.depth >= analysis.depth"""
+
+
+# SQLite integers are signed 64-bit, Zobrist keys unsigned
+def sqlKey(key):
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class AnalysisCache():
+    # one connection per process, opened on first use, so a cache made before forking workers still works in them
+    def __init__(self, path=DEFAULT_PATH, timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._connection = None
+        self._pid = None
+        self.hits = self.misses = 0
+
+    @property
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL") # a crash can lose the last writes, never corrupt
+            connection.execute(_SCHEMA)
+            connection.execute("CREATE INDEX IF NOT EXISTS analysis_depth ON analysis (depth, stored)")
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+
+    # the stored search of gs if it went at least minDepth deep, else None
+    # the move has to be legal in gs, so the rare position sharing another's key is a miss and not a wrong move
+    def lookup(self, gs, minDepth=0):
+        row = self.connection.execute("SELECT move, depth, score, nodes, stored FROM analysis WHERE key = ?",
+                                      (sqlKey(gs.zobristKey),)).fetchone()
+        if row is None or row[1] < minDepth or (row[0] is not None and gs.moveFromNotation(row[0]) is None):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CacheEntry(*row)
+
+    # keeps a SearchResult of gs, unless a deeper one is already stored
+    def store(self, gs, result):
+        self.storeMany([(gs, result)])
+
+    # stores [(gs or zobrist key, SearchResult)] in one transaction
+    def storeMany(self, results):
+        now = time.time()
+        rows = [(sqlKey(gs if isinstance(gs, int) else gs.zobristKey),
+                 result.bestMove.getChessNotation() if result.bestMove else None,
+                 result.depth, result.score, result.nodes, now) for gs, result in results]
+        with self.connection as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(_UPSERT, rows)
+
+    # removes entries stored more than maxAge seconds ago, shallower than minDepth, and then the shallowest and
+    # oldest ones until at most maxEntries are left; returns how many went
+    def evict(self, maxAge=None, minDepth=None, maxEntries=None):
+        before = len(self)
+        with self.connection as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if maxAge is not None:
+                connection.execute("DELETE FROM analysis WHERE stored < ?", (time.time() - maxAge,))
+            if minDepth is not None:
+                connection.execute("DELETE FROM analysis WHERE depth < ?", (minDepth,))
+            if maxEntries is not None:
+                connection.execute("DELETE FROM analysis WHERE key IN (SELECT key FROM analysis "
+                                   "ORDER BY depth, stored LIMIT max((SELECT COUNT(*) FROM analysis) - ?, 0))",
+                                   (maxEntries,))
+        return before - len(self)
+
+    def clear(self):
+        with self.connection as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM analysis")
+
+    # {depth: entries}
+    def depths(self):
+        return dict(self.connection.execute("SELECT depth, COUNT(*) FROM analysis GROUP BY depth ORDER BY depth"))
+
+
+# searcher.search(gs, depth, timeLimit) unless cache already has gs searched to depth; a cached answer comes
+# back as a SearchResult whose move belongs to gs and whose pv is just that move
+def analyse(gs, depth, searcher, cache, timeLimit=None):
+    entry = cache.lookup(gs, depth)
+    if entry is not None:
+        move = gs.moveFromNotation(entry.move) if entry.move else None
+        return chess_search.SearchResult(move, entry.score, entry.depth, entry.nodes, 0.0, [move] if move else [])
+    result = searcher.search(gs, depth, timeLimit)
+    cache.store(gs, result)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="chess_cache", description="inspect or prune the analysis cache")
+    parser.add_argument("command", choices=("stats", "prune", "clear"))
+    parser.add_argument("--path", default=DEFAULT_PATH, help="cache file (default: %(default)s)")
+    parser.add_argument("--max-age", dest="maxAge", type=float, default=None, help="prune entries older than DAYS")
+    parser.add_argument("--min-depth", dest="minDepth", type=int, default=None, help="prune entries shallower")
+    parser.add_argument("--max-entries", dest="maxEntries", type=int, default=None,
+                        help="then prune the shallowest, oldest entries down to this many")
+    args = parser.parse_args(argv)
+
+    with AnalysisCache(args.path) as cache:
+        if args.command == "prune":
+            removed = cache.evict(args.maxAge * 86400 if args.maxAge is not None else None, args.minDepth,
+                                  args.maxEntries)
+            print("removed %d entries" % removed)
+        elif args.command == "clear":
+            cache.clear()
+        print("%d entries in %s" % (len(cache), cache.path))
+        for depth, count in cache.depths().items():
+            print("depth %2d: %d" % (depth, count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,13 +4,123 @@
 '''Determines valid moves at the current state'''
 '''Keep a move log to undo and redo moves'''
 
+import struct
+from array import array
+
+from chess_bitboard import (FULL, COL_MASKS, PIECES, PIECE_INDEX, WHITE, BLACK, DIRECTIONS, KNIGHT_ATTACKS,
+                            KING_ATTACKS, PAWN_ATTACKS, RAY_MASKS, RAY_DIRECTION, BETWEEN, LINE, nearestSquare,
+                            rookAttacks, bishopAttacks)
+from chess_evaluation import PIECE_VALUES
+from chess_zobrist import PIECE_KEYS, SIDE_KEY, CASTLE_KEYS, ENPASSANT_KEYS, TranspositionTable
+
+# castling rights, stored together as one 4-bit number
+WKS, WQS, BKS, BQS = 1, 2, 4, 8
+# rights still kept after a move starts or ends on each square (king and rook home squares clear theirs)
+CASTLE_RIGHTS_MASK = [15] * 64
+CASTLE_RIGHTS_MASK[60], CASTLE_RIGHTS_MASK[63], CASTLE_RIGHTS_MASK[56] = 15 ^ (WKS | WQS), 15 ^ WKS, 15 ^ WQS
+CASTLE_RIGHTS_MASK[4], CASTLE_RIGHTS_MASK[7], CASTLE_RIGHTS_MASK[0] = 15 ^ (BKS | BQS), 15 ^ BKS, 15 ^ BQS
+# king's end square -> (rook start square, rook end square)
+CASTLE_ROOK_SQUARES = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+# (king click, rook click) -> (right needed, king end square, squares that must be empty)
+CASTLES = {((7,4),(7,7)): (WKS, (7,6), ((7,5),(7,6))),
+           ((7,4),(7,0)): (WQS, (7,2), ((7,3),(7,2),(7,1))),
+           ((0,4),(0,7)): (BKS, (0,6), ((0,5),(0,6))),
+           ((0,4),(0,0)): (BQS, (0,2), ((0,3),(0,2),(0,1)))}
+PROMOTION_CHOICES = ('Q', 'R', 'B', 'N')
+# piece codes of a packed move by 4-bit index, the 12 pieces in chess_bitboard order and then an empty square
+PACKED_PIECES = PIECES + ("--",)
+PACKED_PIECE_INDEX = {piece: i for i, piece in enumerate(PACKED_PIECES)}
+# the fields of a Move besides code and moveID, worked out from code the first time one is read
+MOVE_FIELDS = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'isPawnPromotion',
+               'promotionChoice', 'isEnpassantMove', 'isCastleMove')
+# flag bits of a packed move (see Move.pack), and the test for a quiet one: nothing captured, no promotion
+MOVE_ENPASSANT, MOVE_CASTLE, MOVE_PROMOTION = 1 << 22, 1 << 23, 1 << 24
+MOVE_QUIET_MASK = 15 << 18 | MOVE_PROMOTION
+MOVE_QUIET = 12 << 18
+# piece index a promoting pawn's index turns into, by promotion choice
+PROMOTION_OFFSETS = (4, 3, 2, 1)
+# makeMove pushes one fixed-layout record per move onto the undo stack, undoMove pops it:
+# captured piece (packed index), castling rights, en passant square (64 for none), halfmove clock, Zobrist key
+UNDO_CAPTURED, UNDO_RIGHTS, UNDO_ENPASSANT, UNDO_HALFMOVE, UNDO_KEY = range(5)
+UNDO_RECORD_SIZE = 5
+UNDO_STACK_PLIES = 256 # plies preallocated when the stack has no cap, it doubles when a game runs longer
+SQUARE_COORDS = [(sq >> 3, sq & 7) for sq in range(64)] # square index -> (row, col)
+ENPASSANT_SQUARES = SQUARE_COORDS + [()] # undo stack value -> enpassantPossible
+RAY_CHECK = 64 # a king ray's entry is RAY_CHECK + the square of the slider checking along it
+MOVE_CACHE_SIZE = 1 << 12 # positions whose legal moves a GameState remembers
+PROMOTION_SQUARES = 0xFF | 0xFF << 56 # rows 8 and 1, a pawn move ending there is a promotion
+NOT_PROMOTION_SQUARES = FULL ^ PROMOTION_SQUARES
+# pawns that can capture towards the first column, towards the last column
+NOT_FIRST_COL, NOT_LAST_COL = FULL ^ COL_MASKS[0], FULL ^ COL_MASKS[7]
+# snapshot() layout: the 64 squares as 4-bit packed piece indexes (two to a byte, lower square in the low nibble),
+# white to move, castling rights, en passant square (64 for none), halfmove clock, plies before the position,
+# number of history keys, Zobrist key; then that many Zobrist keys of the positions since the last capture or
+# pawn move, oldest first, for repetition detection
+SNAPSHOT_HEADER = struct.Struct("<32sBBBHHHQ")
+
+
+def _castleMoves():
+    castles = ([], [])
+    for (kingClick, rookClick), (right, kingEnd, emptySquares) in CASTLES.items():
+        color = WHITE if kingClick[0] == 7 else BLACK
+        start, end = kingClick[0] * 8 + 4, kingEnd[0] * 8 + kingEnd[1]
+        between = sum(1 << (r * 8 + c) for r, c in emptySquares)
+        code = start | end << 6 | (6 * color + 5) << 14 | MOVE_QUIET | MOVE_CASTLE
+        castles[color].append((right, rookClick[0] * 8 + rookClick[1], between, ((start + end) >> 1, end), code))
+    return castles
+
+# the castles of each colour for getCastleMoves: (right, rook square, bitboard of the squares that must be empty,
+# the squares the king crosses and lands on, packed move)
+CASTLE_MOVES = _castleMoves()
+
+
+# raises ValueError unless fen is a position GameState.loadFEN can load: 8 ranks of 8 files, one king a side,
+# no pawn on the first or last rank, and well formed side, castling, en passant and move number fields
+def checkFEN(fen):
+    if not isinstance(fen, str) or not fen.split():
+        raise ValueError("fen must be a non-empty string")
+    fields = fen.split()
+    ranks = fields[0].split("/")
+    if len(ranks) != 8:
+        raise ValueError("fen needs 8 ranks, not %d" % len(ranks))
+    for rank in ranks:
+        files = 0
+        for ch in rank:
+            if ch in "12345678":
+                files += int(ch)
+            elif ch in "pnbrqkPNBRQK":
+                files += 1
+            else:
+                raise ValueError("bad character %r in fen" % ch)
+        if files != 8:
+            raise ValueError("fen rank %s does not have 8 files" % rank)
+    if fields[0].count('K') != 1 or fields[0].count('k') != 1:
+        raise ValueError("fen needs one king a side")
+    if any(ch in "pP" for ch in ranks[0] + ranks[7]):
+        raise ValueError("fen has a pawn on the first or last rank")
+    if len(fields) > 1 and fields[1] not in ('w', 'b'):
+        raise ValueError("fen side to move must be 'w' or 'b', not %s" % fields[1])
+    if len(fields) > 2 and (fields[2] != '-' and not set(fields[2]) <= set("KQkq")):
+        raise ValueError("bad fen castling field %s" % fields[2])
+    # the square behind a pawn that just moved 2 squares, on row 6 for white to move and row 3 for black
+    if len(fields) > 3 and fields[3] != '-' and (len(fields[3]) != 2 or fields[3][0] not in "abcdefgh"
+                                                 or fields[3][1] != ('3' if fields[1] == 'b' else '6')):
+        raise ValueError("bad fen en passant field %s" % fields[3])
+    for field in fields[4:6]:
+        if not field.isdigit():
+            raise ValueError("bad fen move number %s" % field)
+
+
 class GameState():
-    def __init__(self):  
-        # chess board representation 
-        # 8*8 2-D list
-        # "--" represents blank board
-        self.startFEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"
-        self.board = [
+    # maxPlies caps how many moves can be made (a search only needs its maximum depth), None for no cap
+    # moveCacheSize is the number of positions whose move lists are kept, small for many light-weight games
+    def __init__(self, maxPlies=None, moveCacheSize=MOVE_CACHE_SIZE):
+        # chess board representation
+        # one 64-bit bitboard per piece type and colour (see chess_bitboard) plus occupancy masks,
+        # and a 64 entry mailbox of piece codes so "what is on this square" is a single lookup
+        # "--" represents blank square
+        self.startFEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1" # position the game began from
+        startBoard = [
                 ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
                 ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
                 ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -20,9 +130,16 @@ class GameState():
                 ["wP", "wP", "wP", "wP", "wP", "wP", "wP", "wP"],
                 ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
                 ]
-                #maps each piece to the possible moves function for that piece
-        self.moveFunctions = {'P': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves,
-                              'B':self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
+        self.pieceBoards = [0] * 12 # indexed by chess_bitboard.PIECE_INDEX
+        self.colorBoards = [0, 0] # all white pieces, all black pieces
+        self.occupied = 0
+        self.squares = ["--"] * 64 # square index = row*8 + col
+        self.boardView = None
+        for r in range(8):
+            for c in range(8):
+                if startBoard[r][c] != "--":
+                    self.putPiece(startBoard[r][c], r * 8 + c)
+        self.bindMoveFunctions()
         self.whiteToMove = True
         self.moveLog = []
         self.whiteKingLocation = (7,4)
@@ -32,423 +149,1218 @@ class GameState():
         self.stalemate = False
         self.pins = [] #pinned pieces
         self.checks = []
-     
+        self.pinMasks = {} # pinned square -> bitboard of squares it can still move to
+        self.checkMask = FULL # squares that capture or block a single check
+        self.castleRights = WKS | WQS | BKS | BQS
+        self.enpassantPossible = () # square a pawn can capture en passant on, right after a 2 sq pawn move
+        self.halfmoveClock = 0 # moves since the last capture or pawn move
+        self.startPly = 0 # plies played before the starting position, for the FEN fullmove number
+        # 64-bit Zobrist key of the position, updated move by move
+        self.zobristKey = self.computeZobristKey()
+        # state makeMove cannot work out backwards, UNDO_RECORD_SIZE entries per move made
+        self.maxPlies = maxPlies
+        self.undoStack = array('Q', bytes(8 * UNDO_RECORD_SIZE * (maxPlies or UNDO_STACK_PLIES)))
+        self.repetitionCounts = {self.zobristKey: 1} # times each key occurred in this game
+        self.moveCache = TranspositionTable(moveCacheSize) # key -> checks, pins and valid moves already found
+        # per king, what each of its 8 rays (DIRECTIONS order) meets: the square of an own piece pinned along it,
+        # RAY_CHECK + the square of a slider checking along it, or -1; makeMove rescans only the rays through
+        # the squares it changes, and undoMove takes the previous ones back off kingRayStack
+        self.resetKingRays()
+
+    # position from a FEN string: piece placement, side to move, castling rights, en passant square and move clocks
+    @classmethod
+    def from_fen(cls, fen, maxPlies=None, moveCacheSize=MOVE_CACHE_SIZE):
+        gs = cls(maxPlies, moveCacheSize)
+        gs.loadFEN(fen)
+        return gs
+
+    # raises ValueError, before anything is changed, when fen is not a valid position (see checkFEN)
+    def loadFEN(self, fen):
+        checkFEN(fen)
+        fields = fen.split()
+        self.startFEN = fen
+        for sq in range(64):
+            if self.squares[sq] != "--":
+                self.removePiece(sq)
+        r = c = 0
+        for ch in fields[0]:
+            # "/" means skip to the new row, a number is that many blank squares
+            if ch == "/":
+                r, c = r + 1, 0
+            elif ch.isdigit():
+                c += int(ch)
+            else:
+                #uppercase denotes white piece
+                piece = ('w' if ch.isupper() else 'b') + ch.upper()
+                self.putPiece(piece, r * 8 + c)
+                if piece == "wK":
+                    self.whiteKingLocation = (r, c)
+                elif piece == "bK":
+                    self.blackKingLocation = (r, c)
+                c += 1
+        self.whiteToMove = len(fields) < 2 or fields[1] == 'w'
+        self.castleRights = 0
+        if len(fields) > 2:
+            for ch, right in (('K', WKS), ('Q', WQS), ('k', BKS), ('q', BQS)):
+                if ch in fields[2]:
+                    self.castleRights |= right
+        # a right whose king or rook is not on its home square could never be used
+        for ((kingRow, kingCol), (rookRow, rookCol)), (right, kingEnd, emptySquares) in CASTLES.items():
+            ally = 'w' if kingRow == 7 else 'b'
+            if self.squares[kingRow * 8 + kingCol] != ally + 'K' or self.squares[rookRow * 8 + rookCol] != ally + 'R':
+                self.castleRights &= ~right
+        self.enpassantPossible = ()
+        if len(fields) > 3 and fields[3] != '-':
+            epRow, epCol = Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]]
+            # only a square an enemy pawn just passed over counts: that pawn in front of it, the square
+            # and the pawn's start square behind it empty
+            step = 1 if self.whiteToMove else -1
+            enemyPawn = ('b' if self.whiteToMove else 'w') + 'P'
+            if (self.squares[(epRow + step) * 8 + epCol] == enemyPawn and self.squares[epRow * 8 + epCol] == "--"
+                    and self.squares[(epRow - step) * 8 + epCol] == "--"):
+                self.enpassantPossible = (epRow, epCol)
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        self.startPly = 2 * (fullmoveNumber - 1) + (not self.whiteToMove)
+        self.moveLog = []
+        self.inCheck = self.checkmate = self.stalemate = False
+        self.zobristKey = self.computeZobristKey()
+        self.repetitionCounts = {self.zobristKey: 1}
+        self.resetKingRays()
+        self.inCheck = self.kingInCheck()
+
+    # the position as SNAPSHOT_HEADER.size bytes plus 8 per history key, cheap to send to another process or
+    # thread and to place in multiprocessing.shared_memory; the move log itself stays behind
+    def snapshot(self):
+        squares = self.squares
+        index = PACKED_PIECE_INDEX
+        mailbox = bytes([index[squares[sq]] | index[squares[sq + 1]] << 4 for sq in range(0, 64, 2)])
+        plies = len(self.moveLog)
+        count = min(self.halfmoveClock, plies) # positions before the game's start FEN are not known
+        stack = self.undoStack
+        history = array('Q', [stack[ply * UNDO_RECORD_SIZE + UNDO_KEY] for ply in range(plies - count, plies)])
+        epSq = self.enpassantPossible[0] * 8 + self.enpassantPossible[1] if self.enpassantPossible else 64
+        return SNAPSHOT_HEADER.pack(mailbox, self.whiteToMove, self.castleRights, epSq, self.halfmoveClock,
+                                    self.startPly + plies, count, self.zobristKey) + history.tobytes()
+
+    # position from snapshot() bytes, or from any buffer holding them at offset (a shared_memory block's buf)
+    @classmethod
+    def fromSnapshot(cls, data, offset=0, maxPlies=None, moveCacheSize=MOVE_CACHE_SIZE):
+        gs = cls(maxPlies, moveCacheSize)
+        gs.loadSnapshot(data, offset)
+        return gs
+
+    def loadSnapshot(self, data, offset=0):
+        mailbox, white, rights, epSq, halfmove, ply, count, key = SNAPSHOT_HEADER.unpack_from(data, offset)
+        squares = [PACKED_PIECES[byte >> shift & 15] for byte in mailbox for shift in (0, 4)]
+        pieceBoards = [0] * 12
+        for sq, piece in enumerate(squares):
+            if piece != "--":
+                pieceBoards[PIECE_INDEX[piece]] |= 1 << sq
+        # filled in place, like loadFEN, for anyone holding on to the lists
+        self.squares[:] = squares
+        self.pieceBoards[:] = pieceBoards
+        self.colorBoards[:] = [pieceBoards[0] | pieceBoards[1] | pieceBoards[2] | pieceBoards[3] | pieceBoards[4] |
+                               pieceBoards[5], pieceBoards[6] | pieceBoards[7] | pieceBoards[8] | pieceBoards[9] |
+                               pieceBoards[10] | pieceBoards[11]]
+        self.occupied = self.colorBoards[WHITE] | self.colorBoards[BLACK]
+        self.boardView = None
+        whiteKing, blackKing = pieceBoards[5].bit_length() - 1, pieceBoards[11].bit_length() - 1
+        self.whiteKingLocation = (whiteKing >> 3, whiteKing & 7)
+        self.blackKingLocation = (blackKing >> 3, blackKing & 7)
+        self.whiteToMove = bool(white)
+        self.castleRights = rights
+        self.enpassantPossible = ENPASSANT_SQUARES[epSq]
+        self.halfmoveClock = halfmove
+        self.startPly = ply
+        self.moveLog = []
+        self.inCheck = self.checkmate = self.stalemate = False
+        self.zobristKey = key
+        history = array('Q')
+        start = offset + SNAPSHOT_HEADER.size
+        history.frombytes(bytes(data[start:start + 8 * count]))
+        counts = {key: 1}
+        for historyKey in history:
+            counts[historyKey] = counts.get(historyKey, 0) + 1
+        self.repetitionCounts = counts
+        self.resetKingRays()
+        self.inCheck = self.kingInCheck()
+        self.startFEN = self.to_fen()
+
+    # maps each piece to the possible moves function for that piece
+    def bindMoveFunctions(self):
+        self.moveFunctions = {'P': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves,
+                              'B':self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
+
+    # a pickle leaves out the bound move functions and the move cache, the copy binds its own and starts
+    # with an empty cache of the same size
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["moveFunctions"]
+        state["moveCache"] = self.moveCache.size
+        state["boardView"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.moveCache = TranspositionTable(state["moveCache"])
+        self.bindMoveFunctions()
+
+    # FEN string of the current position, the inverse of loadFEN
+    def to_fen(self):
+        rows = []
+        for r in range(8):
+            row = ""
+            empty = 0
+            for piece in self.squares[r * 8:r * 8 + 8]:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += piece[1] if piece[0] == 'w' else piece[1].lower()
+            rows.append(row + (str(empty) if empty else ""))
+        castling = "".join(ch for ch, right in (('K', WKS), ('Q', WQS), ('k', BKS), ('q', BQS))
+                           if self.castleRights & right) or "-"
+        if self.enpassantPossible == ():
+            enpassant = "-"
+        else:
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        fullmoveNumber = (self.startPly + len(self.moveLog)) // 2 + 1
+        return "%s %s %s %s %d %d" % ("/".join(rows), 'w' if self.whiteToMove else 'b', castling, enpassant,
+                                      self.halfmoveClock, fullmoveNumber)
+
+    # 8*8 2-D list view of the board, kept for the GUI and Move(startSq, endSq, board)
+    # it is rebuilt from the mailbox only after the position changed
+    @property
+    def board(self):
+        if self.boardView is None:
+            s = self.squares
+            self.boardView = [s[0:8], s[8:16], s[16:24], s[24:32], s[32:40], s[40:48], s[48:56], s[56:64]]
+        return self.boardView
+
+    def putPiece(self, piece, sq):
+        bit = 1 << sq
+        self.pieceBoards[PIECE_INDEX[piece]] |= bit
+        self.colorBoards[BLACK if piece[0] == 'b' else WHITE] |= bit
+        self.occupied |= bit
+        self.squares[sq] = piece
+        self.boardView = None
+
+    def removePiece(self, sq):
+        piece = self.squares[sq]
+        bit = 1 << sq
+        self.pieceBoards[PIECE_INDEX[piece]] ^= bit
+        self.colorBoards[BLACK if piece[0] == 'b' else WHITE] ^= bit
+        self.occupied ^= bit
+        self.squares[sq] = "--"
+        self.boardView = None
+
+    # hashes the whole position from scratch, makeMove and undoMove keep it up to date after that
+    def computeZobristKey(self):
+        key = CASTLE_KEYS[self.castleRights] ^ self.enpassantKey()
+        if not self.whiteToMove:
+            key ^= SIDE_KEY
+        for sq in range(64):
+            if self.squares[sq] != "--":
+                key ^= PIECE_KEYS[PIECE_INDEX[self.squares[sq]]][sq]
+        return key
+
+    # the en passant file only counts towards the key when a pawn could really capture there,
+    # so repetitions are not missed after a harmless 2 sq pawn move
+    def enpassantKey(self):
+        if self.enpassantPossible == ():
+            return 0
+        r, c = self.enpassantPossible
+        ally = WHITE if self.whiteToMove else BLACK
+        if PAWN_ATTACKS[1 - ally][r * 8 + c] & self.pieceBoards[6 * ally]:
+            return ENPASSANT_KEYS[c]
+        return 0
+
+    # true once the current position has occurred three times
+    def isThreefoldRepetition(self):
+        return self.repetitionCounts.get(self.zobristKey, 0) >= 3
+
+    # the king and rook for this castle are unmoved, the squares between are empty,
+    # and the king is not castling out of, through or into check
+    def canCastle(self, right, kingEnd, emptySquares):
+        row = kingEnd[0]
+        ally = 'w' if self.whiteToMove else 'b'
+        if not self.castleRights & right or self.squares[row * 8 + 4] != ally + 'K':
+            return False
+        if self.squares[CASTLE_ROOK_SQUARES[row * 8 + kingEnd[1]][0]] != ally + 'R':
+            return False
+        for r, c in emptySquares:
+            if self.squares[r * 8 + c] != "--":
+                return False
+        enemy = BLACK if self.whiteToMove else WHITE
+        for col in (4, (4 + kingEnd[1]) // 2, kingEnd[1]):
+            if self.isSquareAttacked(row * 8 + col, enemy, self.occupied):
+                return False
+        return True
+
+    # castling is asked for by clicking the king and then the rook it castles with
+    # returns True if the castle was made
     def handleCastling(self,playerClicks):
-        #white king side castling
-        if playerClicks[0] == (7,4) and playerClicks[1] == (7,7) and not self.inCheck:
-            if(self.board[7][5] == "--" and self.board[7][6] == "--" and not self.squareUnderAttack(7,6)):
-                kingMove = Move(playerClicks[0],(7,6),self.board)
-                rookMove = Move(playerClicks[1],(7,5), self.board)
-                self.makeMove(kingMove)
-                self.makeMove(rookMove)
-        
-        # white queen side castling
-        if playerClicks[0] == (7,4) and playerClicks[1] == (7,0) and not self.inCheck:
-            if(self.board[7][3] == "--" and self.board[7][2] == "--" and self.board[7][1] == "--" and not self.squareUnderAttack(7,2)):
-                kingMove = Move(playerClicks[0],(7,2),self.board)
-                rookMove = Move(playerClicks[1],(7,3), self.board)
-                self.makeMove(kingMove)
-                self.makeMove(rookMove) 
-                
-        #black king side castling
-        if playerClicks[0] == (0,4) and playerClicks[1] == (0,7) and not self.inCheck:
-            if(self.board[0][5] == "--" and self.board[0][6] == "--" and not self.squareUnderAttack(0,6)):
-                kingMove = Move(playerClicks[0],(0,6),self.board)
-                rookMove = Move(playerClicks[1],(0,5), self.board)
-                self.makeMove(kingMove)
-                self.makeMove(rookMove)
-                
-        # black queen side castling
-        if playerClicks[0] == (0,4) and playerClicks[1] == (0,0) and not self.inCheck:
-            if(self.board[0][3] == "--" and self.board[0][2] == "--" and self.board[0][1] == "--" and not self.squareUnderAttack(0,2)):
-                kingMove = Move(playerClicks[0],(0,2),self.board)
-                rookMove = Move(playerClicks[1],(0,3), self.board)
-                self.makeMove(kingMove)
-                self.makeMove(rookMove) 
-        
+        castle = CASTLES.get((playerClicks[0], playerClicks[1]))
+        if castle is None or not self.canCastle(*castle):
+            return False
+        self.makeMove(Move(playerClicks[0], castle[1], self.board, isCastleMove=True))
+        return True
+
+    # the legal move written as getChessNotation() writes it ("e2e4", "e7e8n"), None if there is none
+    def moveFromNotation(self, notation):
+        for move in self.legal_moves():
+            if move.getChessNotation() == notation:
+                return move
+        return None
+
     #takes a move as parameter, and executes the move by changing the board state
+    # everything is read off the packed move, so a generated move is never decoded
     def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = "--" # blank at piece moved
-        self.board[move.endRow][move.endCol] = move.pieceMoved # move piece at this location
+        base = len(self.moveLog) * UNDO_RECORD_SIZE
+        stack = self.undoStack
+        if base == len(stack):
+            if self.maxPlies is not None:
+                raise IndexError("undo stack full, %d plies made" % self.maxPlies)
+            stack.extend(array('Q', bytes(8 * len(stack))))
+        code = move.code
+        start = code & 63
+        end = (code >> 6) & 63
+        moved = (code >> 14) & 15
+        startBit = 1 << start
+        endBit = 1 << end
+        pieceBoards = self.pieceBoards
+        squares = self.squares
+        color = BLACK if moved >= 6 else WHITE
+        #pawn promotion
+        placed = moved + PROMOTION_OFFSETS[(code >> 12) & 3] if code & MOVE_PROMOTION else moved
+        key = self.zobristKey ^ self.enpassantKey() ^ SIDE_KEY
+        key ^= PIECE_KEYS[moved][start] ^ PIECE_KEYS[placed][end]
+        # record what really gets captured so undoMove can put it back
+        # an en passant capture takes the pawn beside the start square, not on the end square
+        captureSq = (start & 56) | (end & 7) if code & MOVE_ENPASSANT else end
+        captured = squares[captureSq]
+        stack[base + UNDO_CAPTURED] = PACKED_PIECE_INDEX[captured]
+        stack[base + UNDO_RIGHTS] = self.castleRights
+        stack[base + UNDO_ENPASSANT] = self.enpassantPossible[0] * 8 + self.enpassantPossible[1] if self.enpassantPossible else 64
+        stack[base + UNDO_HALFMOVE] = self.halfmoveClock
+        stack[base + UNDO_KEY] = self.zobristKey
+        if captured != "--":
+            captureBit = 1 << captureSq
+            pieceBoards[PIECE_INDEX[captured]] ^= captureBit
+            self.colorBoards[1 - color] ^= captureBit
+            self.occupied ^= captureBit
+            squares[captureSq] = "--"
+            key ^= PIECE_KEYS[PIECE_INDEX[captured]][captureSq]
+            self.halfmoveClock = 0
+        elif moved == 0 or moved == 6:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        pieceBoards[moved] ^= startBit # blank at piece moved
+        pieceBoards[placed] ^= endBit # move piece at this location
+        self.colorBoards[color] ^= startBit | endBit
+        self.occupied ^= startBit | endBit
+        squares[start] = "--"
+        squares[end] = PIECES[placed]
+        #castling also moves the rook next to the king
+        if code & MOVE_CASTLE:
+            rookStart, rookEnd = CASTLE_ROOK_SQUARES[end]
+            rook = squares[rookStart]
+            rookBits = (1 << rookStart) | (1 << rookEnd)
+            pieceBoards[PIECE_INDEX[rook]] ^= rookBits
+            self.colorBoards[color] ^= rookBits
+            self.occupied ^= rookBits
+            squares[rookStart] = "--"
+            squares[rookEnd] = rook
+            key ^= PIECE_KEYS[PIECE_INDEX[rook]][rookStart] ^ PIECE_KEYS[PIECE_INDEX[rook]][rookEnd]
+        #a king or rook leaving home, or a rook captured at home, loses those castling rights
+        rights = self.castleRights & CASTLE_RIGHTS_MASK[start] & CASTLE_RIGHTS_MASK[end]
+        if rights != self.castleRights:
+            key ^= CASTLE_KEYS[self.castleRights] ^ CASTLE_KEYS[rights]
+            self.castleRights = rights
+        #a 2 sq pawn move can be captured en passant on the square it skipped, for one move only
+        if (moved == 0 or moved == 6) and (end - start == 16 or start - end == 16):
+            self.enpassantPossible = SQUARE_COORDS[(start + end) >> 1]
+        else:
+            self.enpassantPossible = ()
+        self.boardView = None
         self.moveLog.append(move) #log the move
-        self.whiteToMove = not self.whiteToMove # swap player turn 
-        
+        self.whiteToMove = not self.whiteToMove # swap player turn
+        key ^= self.enpassantKey()
+        self.zobristKey = key
+        self.repetitionCounts[key] = self.repetitionCounts.get(key, 0) + 1
+
         #update location of king piece
-        if(move.pieceMoved == "wK"):
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        if(move.pieceMoved == "bK"):
-            self.blackKingLocation = (move.endRow, move.endCol)
-            
-        #pawn promotion
-        if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
-        
+        if moved == 5:
+            self.whiteKingLocation = SQUARE_COORDS[end]
+        elif moved == 11:
+            self.blackKingLocation = SQUARE_COORDS[end]
+        # only king rays through a square whose contents changed can gain or lose a pin or a check
+        self.kingRayStack.append(self.kingRays)
+        if code & MOVE_ENPASSANT:
+            changed = (start, end, captureSq)
+        elif code & MOVE_CASTLE:
+            changed = (start, end) + CASTLE_ROOK_SQUARES[end]
+        else:
+            changed = (start, end)
+        if moved == 5:
+            self.kingRays = (self.scanKingRays(WHITE), self.updateKingRays(BLACK, changed))
+        elif moved == 11:
+            self.kingRays = (self.updateKingRays(WHITE, changed), self.scanKingRays(BLACK))
+        else:
+            self.kingRays = (self.updateKingRays(WHITE, changed), self.updateKingRays(BLACK, changed))
+        self.loadDerivedState()
+
     #undo a move
     def undoMove(self):
         if len(self.moveLog) != 0:
-            move = self.moveLog.pop() 
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            move = self.moveLog.pop()
+            base = len(self.moveLog) * UNDO_RECORD_SIZE
+            stack = self.undoStack
+            captured = PACKED_PIECES[stack[base + UNDO_CAPTURED]]
+            code = move.code
+            start = code & 63
+            end = (code >> 6) & 63
+            moved = (code >> 14) & 15
+            startBit = 1 << start
+            endBit = 1 << end
+            pieceBoards = self.pieceBoards
+            squares = self.squares
+            color = BLACK if moved >= 6 else WHITE
+            pieceBoards[PIECE_INDEX[squares[end]]] ^= endBit # also takes back a promoted piece
+            pieceBoards[moved] ^= startBit
+            self.colorBoards[color] ^= startBit | endBit
+            self.occupied ^= startBit | endBit
+            squares[start] = PIECES[moved]
+            squares[end] = "--"
+            if captured != "--":
+                captureSq = (start & 56) | (end & 7) if code & MOVE_ENPASSANT else end
+                captureBit = 1 << captureSq
+                pieceBoards[PIECE_INDEX[captured]] ^= captureBit
+                self.colorBoards[1 - color] ^= captureBit
+                self.occupied |= captureBit
+                squares[captureSq] = captured
+            #put the castled rook back in its corner
+            if code & MOVE_CASTLE:
+                rookStart, rookEnd = CASTLE_ROOK_SQUARES[end]
+                rook = squares[rookEnd]
+                rookBits = (1 << rookStart) | (1 << rookEnd)
+                pieceBoards[PIECE_INDEX[rook]] ^= rookBits
+                self.colorBoards[color] ^= rookBits
+                self.occupied ^= rookBits
+                squares[rookEnd] = "--"
+                squares[rookStart] = rook
+            # rights, en passant square, clock and key of the previous position come straight off the undo stack
+            self.repetitionCounts[self.zobristKey] -= 1
+            self.castleRights = stack[base + UNDO_RIGHTS]
+            self.enpassantPossible = ENPASSANT_SQUARES[stack[base + UNDO_ENPASSANT]]
+            self.halfmoveClock = stack[base + UNDO_HALFMOVE]
+            self.zobristKey = stack[base + UNDO_KEY]
+            self.boardView = None
             self.whiteToMove = not self.whiteToMove #swith turns
-            
-        #update location of king piece
-        if(move.pieceMoved == "wK"):
-            self.whiteKingLocation = (move.startRow, move.startCol)
-        elif(move.pieceMoved == "bK"):
-            self.blackKingLocation = (move.startRow, move.startCol)
-   
-    # checks for check-mates
-    def getValidMoves(self, r, c):
-        moves = []
+
+            #update location of king piece
+            if moved == 5:
+                self.whiteKingLocation = SQUARE_COORDS[start]
+            elif moved == 11:
+                self.blackKingLocation = SQUARE_COORDS[start]
+            self.kingRays = self.kingRayStack.pop()
+            self.loadDerivedState()
+
+    # check flags, pins and checks belong to one position, after a move or an undo they are taken from
+    # the move cache when it already knows the position
+    # otherwise inCheck comes straight from kingRays, and pins and checks stay empty until legal_moves() or
+    # orderedMoves() needs them (a search that cuts off early never does); a position a move was undone back
+    # to had that move, and checkmate or stalemate after a move is only known once its moves are generated
+    def loadDerivedState(self):
+        cached = self.moveCache.probe(self.zobristKey)
+        if cached is None:
+            self.inCheck = self.kingInCheck()
+            self.checkmate = self.stalemate = False
+            self.pins, self.checks, self.pinMasks, self.checkMask = [], [], {}, FULL
+        else:
+            moves, self.inCheck, self.pins, self.checks, self.pinMasks, self.checkMask = cached
+            self.checkmate = len(moves) == 0 and self.inCheck
+            self.stalemate = len(moves) == 0 and not self.inCheck
+
+    # the legal moves generated from scratch, without the move cache, as packed codes (see Move.pack)
+    # also sets inCheck, pins, checks and the pin and check masks for the side to move
+    def generateMoves(self):
         self.inCheck, self.pins, self.checks = self.checkPinsandChecks()
-        if self.whiteToMove:
-            kingRow = self.whiteKingLocation[0]
-            kingCol = self.whiteKingLocation[1]
+        self.setPinAndCheckMasks()
+        moves = array('I')
+        if len(self.checks) < 2: # in double check only the king can move
+            # checkMask already limits pieces to squares that block or capture a single check
+            self.generateTo(FULL, FULL, moves)
+            if self.enpassantPossible:
+                self.getEnpassantMoves(moves)
+            if not self.inCheck and self.castleRights & (WKS | WQS if self.whiteToMove else BKS | BQS):
+                self.getCastleMoves(moves)
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        self.getKingMoves(kingRow, kingCol, moves)
+        return moves
+
+    # every legal move for the side to move as packed codes, castling, en passant and under-promotions included
+    # checks and pins are worked out once for the whole position, and the codes are cached by
+    # Zobrist key so the GUI and any search share one move list per ply
+    def legalMoveCodes(self):
+        cached = self.moveCache.probe(self.zobristKey)
+        if cached is None:
+            moves = self.generateMoves()
+            cached = (moves, self.inCheck, self.pins, self.checks, self.pinMasks, self.checkMask)
+            self.moveCache.store(self.zobristKey, cached)
         else:
-            kingRow = self.blackKingLocation[0]
-            kingCol = self.blackKingLocation[1]
-            
-        if self.inCheck: # if king is in check
-            if (len(self.checks) == 1): # if only 1 check, block check or move king
-                moves = self.getallPossiblemoves(r,c)
-                check = self.checks[0]
-                checkRow = check[0]
-                checkCol = check[1]
-                checkingPiece = self.board[checkRow][checkCol] # enemy piece causing check
-                validSquares = [] # squares that pieces can move to block check
-                if(checkingPiece == 'N'):
-                    validSquares = [(checkRow,checkCol)]
-                else:
-                    
-                    for i in range(1,8):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i) # check[2], check[3] gives the direction of the check,
-                        validSquares.append(validSquare) #  keep checking in the directions, add valid squares
-                        if(validSquare[0] == checkRow and validSquare[1] == checkCol):
-                            break
-                        
-                #moves that does not block check or move king are invalid
-                for i in range(len(moves) -1, -1, -1): # go through the list backwards
-                    if moves[i].pieceMoved[1] != 'K': # if piecemoves is not king, then move that piece to a valid square
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
-            else: # double check, king must move   
-                self.getKingMoves(kingRow, kingCol, moves)
-        else:# every move is valid if king is not in check
-            moves = self.getallPossiblemoves(r,c)
-        
+            moves, self.inCheck, self.pins, self.checks, self.pinMasks, self.checkMask = cached
+
         # checks for checkmate or stalemate
-        if len(moves) == 0:
-            if(self.inCheck): 
-                self.checkmate = True
-                print("checkmate")
-            else:
-                 self.stalemate = True
-                 
+        self.checkmate = len(moves) == 0 and self.inCheck
+        self.stalemate = len(moves) == 0 and not self.inCheck
         return moves
-    
-    
+
+    # the legal moves as Move objects, only built here from the packed codes
+    def legal_moves(self):
+        return unpackMoves(self.legalMoveCodes())
+
+    # whether the side to move has any legal move, without building the whole list: the king is tried first,
+    # it usually has a safe square, and the other pieces only when it has none (castling needs a safe square
+    # next to the king, so it never decides)
+    def hasLegalMove(self):
+        cached = self.moveCache.probe(self.zobristKey)
+        if cached is not None:
+            return len(cached[0]) > 0
+        self.inCheck, self.pins, self.checks = self.checkPinsandChecks()
+        self.setPinAndCheckMasks()
+        moves = array('I')
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        self.getKingMoves(kingRow, kingCol, moves)
+        if not moves and len(self.checks) < 2:
+            self.generateTo(FULL, FULL, moves)
+            self.getEnpassantMoves(moves)
+        return len(moves) > 0
+
+    # the legal moves in stages for a search, the ones most likely to cut off first: the hash move, captures and
+    # promotions by MVV-LVA, the killer moves, then the quiet moves by history score (historyKey -> score)
+    # a stage is only generated once the one before it is used up, so a cutoff on the hash move or a capture
+    # never builds a quiet move; quiets=False stops after the captures, for quiescence search
+    # a position already in the move cache is ordered from there, and a run to the end puts its moves there
+    # the stages are sorted as packed codes, a Move is only built for a move that is handed out
+    def orderedMoves(self, hashID=None, killers=(), history=None, quiets=True):
+        unpack = Move.unpack
+        cached = self.moveCache.probe(self.zobristKey)
+        if cached is not None:
+            moves, self.inCheck, self.pins, self.checks, self.pinMasks, self.checkMask = cached
+            hashMoves = [code for code in moves if code & 0x3FFF == hashID]
+            noisy = [code for code in moves if code & MOVE_QUIET_MASK != MOVE_QUIET and code & 0x3FFF != hashID]
+            noisy.sort(key=captureScore, reverse=True)
+            for code in hashMoves + noisy:
+                yield unpack(code)
+            if not quiets:
+                return
+            killerMoves = [code for i, killer in enumerate(killers) if killer not in killers[:i] for code in moves
+                           if code & 0x3FFF == killer != hashID and code & MOVE_QUIET_MASK == MOVE_QUIET]
+            skip = [hashID] + [code & 0x3FFF for code in killerMoves]
+            quietMoves = [code for code in moves if code & MOVE_QUIET_MASK == MOVE_QUIET
+                          and code & 0x3FFF not in skip]
+            if history:
+                quietMoves.sort(key=lambda code: history.get((code >> 6) & 0xFFF, 0), reverse=True)
+            for code in killerMoves + quietMoves:
+                yield unpack(code)
+            return
+
+        self.inCheck, self.pins, self.checks = self.checkPinsandChecks()
+        self.setPinAndCheckMasks()
+        # the consumer makes and undoes moves between stages, each stage starts from this position's masks again
+        derived = (self.inCheck, self.pins, self.checks, self.pinMasks, self.checkMask)
+        doubleCheck = len(self.checks) > 1
+        allMoves = array('I')
+
+        if hashID is not None:
+            for code in self.movesFrom(hashID & 63):
+                if code & 0x3FFF == hashID:
+                    allMoves.append(code)
+                    yield unpack(code)
+                    break
+
+        self.inCheck, self.pins, self.checks, self.pinMasks, self.checkMask = derived
+        enemies = self.colorBoards[BLACK if self.whiteToMove else WHITE]
+        noisy = array('I')
+        if not doubleCheck:
+            self.generateTo(enemies | PROMOTION_SQUARES, enemies, noisy)
+            self.getEnpassantMoves(noisy)
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        kingMoves = array('I')
+        self.getKingMoves(kingRow, kingCol, kingMoves)
+        noisy.extend(code for code in kingMoves if code & MOVE_QUIET_MASK != MOVE_QUIET)
+        for code in sorted(noisy, key=captureScore, reverse=True):
+            if code & 0x3FFF != hashID:
+                allMoves.append(code)
+                yield unpack(code)
+        if not quiets:
+            return
+
+        killerMoves = []
+        for i, killer in enumerate(killers):
+            if killer is None or killer == hashID or killer in killers[:i]:
+                continue
+            self.inCheck, self.pins, self.checks, self.pinMasks, self.checkMask = derived
+            for code in self.movesFrom(killer & 63):
+                if code & 0x3FFF == killer and code & MOVE_QUIET_MASK == MOVE_QUIET:
+                    killerMoves.append(code)
+                    allMoves.append(code)
+                    yield unpack(code)
+                    break
+
+        self.inCheck, self.pins, self.checks, self.pinMasks, self.checkMask = derived
+        empty = ~self.occupied
+        quietMoves = array('I')
+        if not doubleCheck:
+            self.generateTo(empty & ~PROMOTION_SQUARES, empty, quietMoves)
+            if not self.inCheck:
+                self.getCastleMoves(quietMoves)
+        quietMoves.extend(code for code in kingMoves if code & MOVE_QUIET_MASK == MOVE_QUIET)
+        skip = [hashID] + [code & 0x3FFF for code in killerMoves]
+        quietMoves = [code for code in quietMoves if code & 0x3FFF not in skip]
+        if history:
+            quietMoves.sort(key=lambda code: history.get((code >> 6) & 0xFFF, 0), reverse=True)
+        for code in quietMoves:
+            allMoves.append(code)
+            yield unpack(code)
+
+        # every stage ran, so this is the whole list: cache it as legal_moves() would have
+        self.inCheck, self.pins, self.checks, self.pinMasks, self.checkMask = derived
+        self.moveCache.store(self.zobristKey, (allMoves,) + derived)
+        self.checkmate = len(allMoves) == 0 and self.inCheck
+        self.stalemate = len(allMoves) == 0 and not self.inCheck
+
+    # the legal moves of the side to move's piece on sq as packed codes, castling and en passant included
+    def movesFrom(self, sq):
+        moves = array('I')
+        piece = self.squares[sq]
+        if piece == "--" or (piece[0] == 'w') != self.whiteToMove:
+            return moves
+        if piece[1] == 'K':
+            self.getKingMoves(sq >> 3, sq & 7, moves)
+            if not self.inCheck:
+                self.getCastleMoves(moves)
+        elif len(self.checks) < 2:
+            self.moveFunctions[piece[1]](sq >> 3, sq & 7, moves)
+            if piece[1] == 'P':
+                self.getEnpassantMoves(moves)
+        return moves
+
+    # moves of every piece but the king that end on a square of pawnTargets (pawns) or pieceTargets (the rest)
+    # the pawns go set-wise through getPawnSetMoves, with the check mask narrowed; the other pieces are walked
+    # here rather than through their move functions: one PIECE_MOVES lookup gives a piece's attacks and its
+    # quiet moves ready packed, so only its captures are packed one by one
+    def generateTo(self, pawnTargets, pieceTargets, moves):
+        checkMask = self.checkMask
+        if checkMask & pawnTargets != checkMask:
+            self.checkMask = checkMask & pawnTargets
+            try:
+                self.getPawnSetMoves(moves)
+            finally:
+                self.checkMask = checkMask
+        else:
+            self.getPawnSetMoves(moves)
+        if self.whiteToMove:
+            first, enemies = 0, self.colorBoards[BLACK]
+        else:
+            first, enemies = 6, self.colorBoards[WHITE]
+        pieceBoards = self.pieceBoards
+        occupied = self.occupied
+        empty = ~occupied & FULL
+        quietTargets = empty & checkMask & pieceTargets
+        captureTargets = enemies & checkMask & pieceTargets
+        if not quietTargets | captureTargets:
+            return
+        allQuiet = quietTargets == empty # every quiet move is wanted, as PIECE_MOVES packs them
+        squares = self.squares
+        pinMasks = self.pinMasks
+        extend, append = moves.extend, moves.append
+        getQuiet = QUIET_MOVES.get
+        for i in range(first + 1, first + 5):
+            bb = pieceBoards[i]
+            if not bb:
+                continue
+            reach = PIECE_REACH[i - first]
+            tables = PIECE_MOVES[i]
+            moved = i << 14
+            while bb:
+                lsb = bb & -bb
+                bb ^= lsb
+                sq = lsb.bit_length() - 1
+                seen = occupied & reach[sq]
+                attacks, quiet = tables[sq].get(seen) or pieceMoves(i, sq, seen)
+                pinned = pinMasks and sq in pinMasks
+                if pinned: # a pinned knight has no square on the line, so it never moves
+                    attacks &= pinMasks[sq]
+                if allQuiet and not pinned:
+                    extend(quiet)
+                elif attacks & quietTargets:
+                    key = (sq | moved | MOVE_QUIET) << 64 | attacks & quietTargets
+                    extend(getQuiet(key) or quietMoves(key))
+                captures = attacks & captureTargets
+                while captures:
+                    lsb = captures & -captures
+                    captures ^= lsb
+                    end = lsb.bit_length() - 1
+                    append(sq | end << 6 | moved | PACKED_PIECE_INDEX[squares[end]] << 18)
+
+    # valid moves of the piece on r,c, taken from the legal move list of the position
+    def getValidMoves(self, r, c):
+        return [move for move in self.legal_moves() if move.startRow == r and move.startCol == c]
+
+    # turns self.pins and self.checks into bitboard masks for the move generators
+    def setPinAndCheckMasks(self):
+        if self.whiteToMove:
+            kingSq = self.whiteKingLocation[0] * 8 + self.whiteKingLocation[1]
+        else:
+            kingSq = self.blackKingLocation[0] * 8 + self.blackKingLocation[1]
+        self.pinMasks = {}
+        for pin in self.pins:
+            # a pinned piece can only slide along the line through king and pinner
+            pinSq = pin[0] * 8 + pin[1]
+            self.pinMasks[pinSq] = LINE[kingSq][pinSq]
+        self.checkMask = FULL
+        if len(self.checks) == 1:
+            # capture the checker, or block anywhere between it and the king (nothing between for knights and pawns)
+            checkSq = self.checks[0][0] * 8 + self.checks[0][1]
+            self.checkMask = BETWEEN[kingSq][checkSq] | (1 << checkSq)
+
+
     # all possible moves w/o considering checks
     def getallPossiblemoves(self, r, c):
-        moves = []
-        piece = self.board[r][c][1]  
+        moves = array('I')
+        piece = self.squares[r * 8 + c][1]
        # print(self.moveFunctions[piece])
-        self.moveFunctions[piece](r, c, moves) # calls all the move functions for the selected piece                   
-        return moves
-    
+        self.moveFunctions[piece](r, c, moves) # calls all the move functions for the selected piece
+        return unpackMoves(moves)
+
+    # packed codes of the moves of every piece, castling and en passant left out
     def getalltheMoves(self):
-        moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]
-                if(turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r,c,moves)
+        moves = array('I')
+        self.generateTo(FULL, FULL, moves)
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        self.getKingMoves(kingRow, kingCol, moves)
         return moves
-                
+
+    # the castles canCastle would allow, for a side to move that is not in check, so the king's own square is
+    # not looked at again
+    def getCastleMoves(self, moves):
+        color, enemy = (WHITE, BLACK) if self.whiteToMove else (BLACK, WHITE)
+        rights = self.castleRights
+        pb = self.pieceBoards
+        occupied = self.occupied
+        for right, rookSq, between, kingPath, code in CASTLE_MOVES[color]:
+            if (rights & right and not occupied & between and (pb[6 * color + 3] >> rookSq) & 1
+                    and (pb[6 * color + 5] >> (code & 63)) & 1):
+                if not (self.isSquareAttacked(kingPath[0], enemy, occupied) or
+                        self.isSquareAttacked(kingPath[1], enemy, occupied)):
+                    moves.append(code)
+
+    def getEnpassantMoves(self, moves):
+        if self.enpassantPossible == ():
+            return
+        ally, enemy = (WHITE, BLACK) if self.whiteToMove else (BLACK, WHITE)
+        epSq = self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+        captureSq = epSq + 8 if self.whiteToMove else epSq - 8
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        enemyPawns = self.pieceBoards[6 * enemy]
+        # our pawns standing where an enemy pawn on the en passant square would attack
+        pawns = PAWN_ATTACKS[enemy][epSq] & self.pieceBoards[6 * ally]
+        while pawns:
+            lsb = pawns & -pawns
+            sq = lsb.bit_length() - 1
+            pawns ^= lsb
+            # two pawns leave the same row at once, so play the capture out on the bitboards and look at the king
+            occupied = (self.occupied ^ lsb ^ (1 << captureSq)) | (1 << epSq)
+            self.pieceBoards[6 * enemy] = enemyPawns ^ (1 << captureSq)
+            if not self.isSquareAttacked(kingRow * 8 + kingCol, enemy, occupied):
+                moves.append(sq | epSq << 6 | 6 * ally << 14 | 6 * enemy << 18 | MOVE_ENPASSANT)
+            self.pieceBoards[6 * enemy] = enemyPawns
+
     # determine if the enemy can attack square r,c
     def squareUnderAttack(self,r,c):
-        self.whiteToMove = not self.whiteToMove # switch turn to opposition POV
-        oppMoves = self.getalltheMoves() # generate opponent's move
-        self.whiteToMove = not self.whiteToMove # switch back to ourselves
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:
-                return True
-        return False
-    
+        return self.isSquareAttacked(r * 8 + c, BLACK if self.whiteToMove else WHITE, self.occupied)
+
+    # bitboard of the pieces of byColor attacking sq, looked up from the attack tables
+    # (a pawn of byColor attacks sq exactly when a pawn of the other colour on sq would attack it)
+    def attackersTo(self, sq, byColor, occupied):
+        pb = self.pieceBoards
+        base = 6 * byColor
+        queens = pb[base + 4]
+        return ((PAWN_ATTACKS[1 - byColor][sq] & pb[base]) | (KNIGHT_ATTACKS[sq] & pb[base + 1]) |
+                (KING_ATTACKS[sq] & pb[base + 5]) | (bishopAttacks(sq, occupied) & (pb[base + 2] | queens)) |
+                (rookAttacks(sq, occupied) & (pb[base + 3] | queens)))
+
+    # same question as attackersTo, answered with the cheapest probes first
+    # the slider attacks are only looked up when a slider stands on a line through sq
+    def isSquareAttacked(self, sq, byColor, occupied):
+        pb = self.pieceBoards
+        base = 6 * byColor
+        if KNIGHT_ATTACKS[sq] & pb[base + 1] or PAWN_ATTACKS[1 - byColor][sq] & pb[base] or KING_ATTACKS[sq] & pb[base + 5]:
+            return True
+        queens = pb[base + 4]
+        diagonal = (pb[base + 2] | queens) & BISHOP_REACH[sq]
+        if diagonal and bishopAttacks(sq, occupied) & diagonal:
+            return True
+        straight = (pb[base + 3] | queens) & ROOK_REACH[sq]
+        return bool(straight and rookAttacks(sq, occupied) & straight)
+
     #generates list of all the pieces causing checks and pinned pieces, and checks if the king is in check or not
+    # the slider checks and the pins are read off kingRays, only pawns and knights are looked up
     def checkPinsandChecks(self):
         pins = []  # squares pinned and the direction its pinned from
         checks = []  # squares where enemy is applying a check
-        inCheck = False
         if self.whiteToMove:
-            enemyColor = "b"
-            allyColor = "w"
-            startRow = self.whiteKingLocation[0]
-            startCol = self.whiteKingLocation[1]
+            ally, enemy = WHITE, BLACK
+            startRow, startCol = self.whiteKingLocation
         else:
-            enemyColor = "w"
-            allyColor = "b"
-            startRow = self.blackKingLocation[0]
-            startCol = self.blackKingLocation[1]
-        # check outwards from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            direction = directions[j]
-            possible_pin = ()  # reset possible pins
-            for i in range(1, 8):
-                endRow = startRow + direction[0] * i
-                endCol = startCol + direction[1] * i
-                if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                    end_piece = self.board[endRow][endCol]
-                    if end_piece[0] == allyColor and end_piece[1] != "K":
-                        if possible_pin == ():  # first allied piece could be pinned
-                            possible_pin = (endRow, endCol, direction[0], direction[1])
-                        else:  # 2nd allied piece - no check or pin from this direction
-                            break
-                    elif end_piece[0] == enemyColor:
-                        enemy_type = end_piece[1]
-                        # 5 possibilities in this complex conditional
-                        # 1.) orthogonally away from king and piece is a rook
-                        # 2.) diagonally away from king and piece is a bishop
-                        # 3.) 1 square away diagonally from king and piece is a pawn
-                        # 4.) any direction and piece is a queen
-                        # 5.) any direction 1 square away and piece is a king
-                        if (0 <= j <= 3 and enemy_type == "R") or (4 <= j <= 7 and enemy_type == "B") or (
-                                i == 1 and enemy_type == "p" and (
-                                (enemyColor == "w" and 6 <= j <= 7) or (enemyColor == "b" and 4 <= j <= 5))) or (
-                                enemy_type == "Q") or (i == 1 and enemy_type == "K"):
-                            if possible_pin == ():  # no piece blocking, so check
-                                inCheck = True
-                                checks.append((endRow, endCol, direction[0], direction[1]))
-                                break
-                            else:  # piece blocking so pin
-                                pins.append(possible_pin)
-                                break
-                        else:  # enemy piece not applying checks
-                            break
+            ally, enemy = BLACK, WHITE
+            startRow, startCol = self.blackKingLocation
+        kingSq = startRow * 8 + startCol
+        rays = self.kingRays[ally]
+        if max(rays) >= 0: # most positions have no pin and no slider check
+            for j, found in enumerate(rays):
+                if found < 0:
+                    continue
+                direction = DIRECTIONS[j]
+                if found >= RAY_CHECK:
+                    found -= RAY_CHECK
+                    checks.append((found >> 3, found & 7, direction[0], direction[1]))
                 else:
-                    break  # off board
-                
-        #check for knight checks
-        knightMoves = ((-2,-1),(-2,1),(-1,-2), (-1,2),(1,-2),(1,2),(2,-1),(2,1))
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow <= 7 and 0 <=endCol <= 7:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == 'N':
-                    inCheck = True
-                    checks.append((endRow,endCol,m[0],m[1]))
-        return inCheck, pins, checks
-                    
-                                
-                            
-     
+                    pins.append((found >> 3, found & 7, direction[0], direction[1]))
+
+        #check for pawn and knight checks
+        pb = self.pieceBoards
+        base = 6 * enemy
+        attackers = PAWN_ATTACKS[ally][kingSq] & pb[base] | KNIGHT_ATTACKS[kingSq] & pb[base + 1]
+        while attackers:
+            lsb = attackers & -attackers
+            sq = lsb.bit_length() - 1
+            checks.append((sq >> 3, sq & 7, (sq >> 3) - startRow, (sq & 7) - startCol))
+            attackers ^= lsb
+        return len(checks) > 0, pins, checks
+
+    # whether the side to move is in check, from kingRays and two lookups, without building any lists
+    def kingInCheck(self):
+        if self.whiteToMove:
+            ally, enemy = WHITE, BLACK
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            ally, enemy = BLACK, WHITE
+            kingRow, kingCol = self.blackKingLocation
+        if max(self.kingRays[ally]) >= RAY_CHECK:
+            return True
+        kingSq = kingRow * 8 + kingCol
+        pb = self.pieceBoards
+        return bool(KNIGHT_ATTACKS[kingSq] & pb[6 * enemy + 1] or PAWN_ATTACKS[ally][kingSq] & pb[6 * enemy])
+
+    def resetKingRays(self):
+        self.kingRays = (self.scanKingRays(WHITE), self.scanKingRays(BLACK))
+        self.kingRayStack = []
+
+    def scanKingRays(self, color):
+        kingRow, kingCol = self.whiteKingLocation if color == WHITE else self.blackKingLocation
+        kingSq = kingRow * 8 + kingCol
+        return tuple(self.scanKingRay(color, kingSq, d) for d in range(8))
+
+    # kingRays of color after a move (not of that king) that changed the squares in changed:
+    # only the rays running through a changed square are scanned again
+    def updateKingRays(self, color, changed):
+        kingRow, kingCol = self.whiteKingLocation if color == WHITE else self.blackKingLocation
+        kingSq = kingRow * 8 + kingCol
+        directions = RAY_DIRECTION[kingSq]
+        rays = self.kingRays[color]
+        updated = None
+        for sq in changed:
+            d = directions[sq]
+            if d >= 0:
+                if updated is None:
+                    updated = list(rays)
+                updated[d] = self.scanKingRay(color, kingSq, d)
+        return rays if updated is None else tuple(updated)
+
+    # what ray d from color's king on kingSq meets, as stored in kingRays
+    def scanKingRay(self, color, kingSq, d):
+        ray = RAY_MASKS[d][kingSq]
+        pb = self.pieceBoards
+        base = 6 * (1 - color)
+        sliders = ((pb[base + 3] if d < 4 else pb[base + 2]) | pb[base + 4]) & ray
+        if not sliders:
+            return -1
+        blockers = ray & self.occupied
+        first = nearestSquare(d, blockers)
+        if (sliders >> first) & 1: # no piece blocking, so check
+            return RAY_CHECK + first
+        if (self.colorBoards[color] >> first) & 1: # first allied piece could be pinned
+            second = nearestSquare(d, blockers ^ (1 << first))
+            if second >= 0 and (sliders >> second) & 1:
+                return first
+        return -1
+
+    # adds the packed code of a move from (r,c) to every square set in targets
+    # the quiet ones are copied from QUIET_MOVES, only captures are packed one by one
+    def addMoves(self, r, c, targets, moves):
+        squares = self.squares
+        start = r * 8 + c
+        moved = PACKED_PIECE_INDEX[squares[start]] << 14
+        quiet = targets & ~self.occupied
+        if quiet:
+            key = (start | moved | MOVE_QUIET) << 64 | quiet
+            moves.extend(QUIET_MOVES.get(key) or quietMoves(key))
+            targets ^= quiet
+        while targets:
+            lsb = targets & -targets
+            end = lsb.bit_length() - 1
+            targets ^= lsb
+            moves.append(start | end << 6 | moved | PACKED_PIECE_INDEX[squares[end]] << 18)
+
     #get all valid  moves for a pawn
     def getPawnMoves(self, r, c, moves):
-        # note: black pawns are on row 1, white pawns on row 6  
-        
-        # handle pinned pieces so that they cannot move when pinned
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        
-        # logic for white pawn moves
-        if(self.whiteToMove): 
-            if(self.board[r-1][c] == "--"): #row above the pawn is empty
-                if not piecePinned or pinDirection == (-1,0):
-                    moves.append(Move((r,c), (r-1,c), self.board)) # 1 sq move
-                    if((r == 6) and (self.board[r-2][c] == "--")): # checks if white pawn has not moved previously for 2 sq moves
-                        moves.append(Move((r,c),(r-2,c), self.board)) # 2 sq pawn move
-
-            #pawn capture logic to its left
-            if(c-1 >= 0):
-                if(self.board[r-1][c-1][0] == 'b'): #black piece to be captured 
-                    if not piecePinned or pinDirection == (-1,-1):
-                        moves.append(Move((r,c), (r-1,c-1), self.board))
-            
-            #pawn capture logic to its right
-            if(c+1 <= 7):
-                if(self.board[r-1][c+1][0] == 'b'):
-                    if not piecePinned or pinDirection == (-1,1):
-                        moves.append(Move((r,c), (r-1,c+1), self.board))
-                    
-        #logic for black pawn moves          
+        # note: black pawns are on row 1, white pawns on row 6
+        sq = r * 8 + c
+        if self.whiteToMove:
+            ally, enemy, step, startRow = WHITE, BLACK, -8, 6
         else:
-            if(self.board[r+1][c] == "--"): # 1 sq move
-                if not piecePinned or pinDirection == (1,0):
-                    moves.append(Move((r,c),(r+1,c), self.board))
-                    if((r == 1) and self.board[r+2][c] == "--"): # 2 sq move
-                        moves.append(Move((r,c),(r+2,c), self.board))
-                    
-            #pawn capture logic to its left
-            if(c+1 <= 7):
-                if(self.board[r+1][c+1][0] == 'w'): #white piece to be captured
-                    if not piecePinned or pinDirection == (1,1):
-                        moves.append(Move((r,c), (r+1, c+1), self.board))
-            
-            #pawn capture logic to its right
-            if(c -1 >=0):
-                if(self.board[r+1][c-1][0] == 'w'):
-                    if not piecePinned or pinDirection == (1,-1):
-                        moves.append(Move((r,c), (r+1, c-1), self.board))
-                    
-                    
-    def getKnightMoves(self, r, c, moves): 
-        # handle pinned pieces so that they cannot move when pinned
-        piecePinned = False
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                self.pins.remove(self.pins[i])
-                break
-            
-        #check if the places Knight can move are empty and not out of bounds
-        validMoves = ((-2,-1), (-2,1), (-1,2), (1,-2), (2,1), (2,-1), (1,2),(-1,-2))
-        oppositeColor = 'b' if self.whiteToMove else 'w'
-        for v in validMoves:
-            row = r + v[0]
-            col = c + v[1]
-            if ((0 <= row < 8) and (0 <= col < 8)):
-                if not piecePinned:
-                    endPiece = self.board[row][col]
-                    if((endPiece[0] == oppositeColor) or (endPiece == "--")):
-                        moves.append(Move((r,c), (row,col), self.board))
-                
-     
-    def getBishopMoves(self, r, c, moves): 
-        #handle pinned pieces so that they cannot move when pinned
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        direction = ((-1,-1), (-1,1), (1,-1), (1,1))
-        oppositeColor = 'b' if self.whiteToMove else 'w'
-        for d in direction:
-            for i in range(1,8):
-                row = r + d[0] * i
-                col = c + d[1] * i
-                if ((0 <= row < 8) and (0 <= col < 8)): # checking bounds
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[row][col]
-                        if(endPiece == "--"): # empty cell
-                            moves.append(Move((r,c), (row, col), self.board))
-                        elif(endPiece[0] == oppositeColor): #grab enemy piece
-                            moves.append(Move((r,c), (row,col), self.board))
-                            break
-                        else:
-                            break
+            ally, enemy, step, startRow = BLACK, WHITE, 8, 1
+        occupied = self.occupied
+        #captures on either diagonal
+        targets = PAWN_ATTACKS[ally][sq] & self.colorBoards[enemy]
+        if not (occupied >> (sq + step)) & 1: # 1 sq move
+            targets |= 1 << (sq + step)
+            if r == startRow and not (occupied >> (sq + 2 * step)) & 1: # pawn has not moved yet, 2 sq move
+                targets |= 1 << (sq + 2 * step)
+        # pinned pawns can only move along the pin, and every move has to answer a check
+        targets &= self.checkMask & self.pinMasks.get(sq, FULL)
+        squares = self.squares
+        moved = 6 * ally << 14
+        while targets:
+            lsb = targets & -targets
+            end = lsb.bit_length() - 1
+            targets ^= lsb
+            code = sq | end << 6 | moved | PACKED_PIECE_INDEX[squares[end]] << 18
+            if end < 8 or end >= 56: # last row, one move for each piece the pawn can promote to
+                for choice in range(4):
+                    moves.append(code | choice << 12 | MOVE_PROMOTION)
+            else:
+                moves.append(code)
+
+    # the moves of every pawn of the side to move at once: the pawns are shifted as one bitboard per direction,
+    # so the work is per target set rather than per pawn, and the pushes short of the last row are copied
+    # from QUIET_MOVES as one run per push length
+    # pinned pawns go through getPawnMoves, which keeps them on the pin
+    def getPawnSetMoves(self, moves):
+        if self.whiteToMove:
+            pawns, enemies = self.pieceBoards[0], self.colorBoards[BLACK]
+        else:
+            pawns, enemies = self.pieceBoards[6], self.colorBoards[WHITE]
+        if self.pinMasks:
+            for sq in self.pinMasks:
+                if (pawns >> sq) & 1:
+                    pawns ^= 1 << sq
+                    self.getPawnMoves(sq >> 3, sq & 7, moves)
+        empty = FULL ^ self.occupied
+        allowed = self.checkMask
+        captures = enemies & allowed
+        # start - end of each set of targets, a pawn that reached row 5 (white) or row 2 (black) in one step may
+        # take a second
+        if self.whiteToMove: # white pawns move up the board, to lower squares
+            step, moved = 8, 0
+            single = pawns >> 8 & empty
+            double = (single & 0xFF << 40) >> 8 & empty & allowed
+            left, right = (pawns & NOT_FIRST_COL) >> 9 & captures, (pawns & NOT_LAST_COL) >> 7 & captures
+            leftStep, rightStep = 9, 7
+        else:
+            step, moved = -8, 6 << 14
+            single = pawns << 8 & empty
+            double = (single & 0xFF << 16) << 8 & empty & allowed
+            left, right = (pawns & NOT_FIRST_COL) << 7 & captures, (pawns & NOT_LAST_COL) << 9 & captures
+            leftStep, rightStep = -7, -9
+        single &= allowed
+        # the pushes short of the last row are quiet, both lengths are copied from QUIET_MOVES as one run each
+        quiet = single & NOT_PROMOTION_SQUARES
+        if quiet:
+            key = (64 + step) << 64 | quiet
+            moves.extend(QUIET_MOVES.get(key) or quietMoves(key))
+        if double:
+            key = (64 + 2 * step) << 64 | double
+            moves.extend(QUIET_MOVES.get(key) or quietMoves(key))
+        if not (left or right or single ^ quiet):
+            return
+        squares = self.squares
+        append = moves.append
+        for delta, targets in ((leftStep, left), (rightStep, right), (step, single ^ quiet)):
+            while targets:
+                lsb = targets & -targets
+                end = lsb.bit_length() - 1
+                targets ^= lsb
+                start = end + delta
+                code = start | end << 6 | moved | PACKED_PIECE_INDEX[squares[end]] << 18
+                if end < 8 or end >= 56: # last row, one move for each piece the pawn can promote to
+                    for choice in range(4):
+                        append(code | choice << 12 | MOVE_PROMOTION)
                 else:
-                    break
-                
-    
-    def getQueenMoves(self, r, c, moves):  
+                    append(code)
+
+    def getKnightMoves(self, r, c, moves):
+        sq = r * 8 + c
+        # pinned knights can never move
+        if sq in self.pinMasks:
+            return
+        #squares the knight attacks that are not our own pieces
+        own = self.colorBoards[WHITE if self.whiteToMove else BLACK]
+        self.addMoves(r, c, KNIGHT_ATTACKS[sq] & ~own & self.checkMask, moves)
+
+
+    def getBishopMoves(self, r, c, moves):
+        sq = r * 8 + c
+        own = self.colorBoards[WHITE if self.whiteToMove else BLACK]
+        allowed = self.checkMask & self.pinMasks.get(sq, FULL)
+        #every ray stops at the first piece, enemy pieces can be captured
+        self.addMoves(r, c, bishopAttacks(sq, self.occupied) & ~own & allowed, moves)
+
+
+    def getQueenMoves(self, r, c, moves):
         self.getBishopMoves(r,c,moves)
         self.getRookMoves(r,c,moves)
-    
-    def getKingMoves(self, r, c, moves):  
-        rowMoves = (-1, -1 , -1, 0, 0, 1, 1, 1)
-        colMoves = (-1, 0, 1, -1, 1, -1, 0, 1)
-        allyColor = 'w' if self.whiteToMove else 'b'
-        for i in range(8):
-            endRow = r + rowMoves[i]
-            endCol = c + colMoves[i]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:
-                    if allyColor == 'w':
-                        self.whiteKingLocation = (endRow, endCol) # change king's location temporarily
-                    else:
-                        self.blackKingLocation = (endRow, endCol)
-                        
-                    #check for checks/pins
-                    inCheck, pins, checks = self.checkPinsandChecks()
-                    
-                    #if not in check after we have checked for pins and checks
-                    if not inCheck:
-                        moves.append(Move((r,c),(endRow,endCol), self.board)) # valid move
-                        
-                    # reset king  to the original location
-                    if allyColor == 'w':
-                        self.whiteKingLocation = (r,c)
-                    else:
-                        self.blackKingLocation = (r,c)
-                
-    
+
+    def getKingMoves(self, r, c, moves):
+        sq = r * 8 + c
+        ally, enemy = (WHITE, BLACK) if self.whiteToMove else (BLACK, WHITE)
+        targets = KING_ATTACKS[sq] & ~self.colorBoards[ally]
+        if not targets:
+            return
+        # the king itself must not block a slider attacking the squares behind it
+        occupied = self.occupied ^ (1 << sq)
+        # isSquareAttacked for every target, with the enemy pieces looked up once
+        pb = self.pieceBoards
+        base = 6 * enemy
+        pawns, knights, king = pb[base], pb[base + 1], pb[base + 5]
+        diagonal, straight = pb[base + 2] | pb[base + 4], pb[base + 3] | pb[base + 4]
+        pawnAttacks = PAWN_ATTACKS[ally]
+        safe = 0
+        while targets:
+            lsb = targets & -targets
+            targets ^= lsb
+            end = lsb.bit_length() - 1
+            if KNIGHT_ATTACKS[end] & knights or pawnAttacks[end] & pawns or KING_ATTACKS[end] & king:
+                continue
+            if diagonal & BISHOP_REACH[end] and bishopAttacks(end, occupied) & diagonal:
+                continue
+            if straight & ROOK_REACH[end] and rookAttacks(end, occupied) & straight:
+                continue
+            safe |= lsb # valid move
+        if safe:
+            self.addMoves(r, c, safe, moves)
+
+
     def getRookMoves(self, r, c, moves):
-        # handle pinned pieces so that they cannot move when pinned
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != 'Q': # cant remove queen as pinned queen can also capture rook
-                    self.pins.remove(self.pins[i])
-                break
-        direction = ((-1,0), (0,-1), (1,0), (0,1)) # up left down right 
-        oppositeColor = 'b' if self.whiteToMove else 'w'
-        for d in direction:
-           for i in range(1,8):
-               row = r + d[0] * i
-               col = c + d[1] * i
-               if((0 <= row < 8) and (0 <= col < 8)):
-                   if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                       endPiece = self.board[row][col]
-                       if(endPiece == "--"):
-                           moves.append(Move((r,c),(row,col), self.board))
-                       elif(endPiece[0] == oppositeColor):
-                           moves.append((Move((r,c), (row,col), self.board)))
-                           break
-                       else:
-                           break
-               else:
-                    break
-        
+        sq = r * 8 + c
+        own = self.colorBoards[WHITE if self.whiteToMove else BLACK]
+        allowed = self.checkMask & self.pinMasks.get(sq, FULL)
+        # up left down right, every ray stops at the first piece
+        self.addMoves(r, c, rookAttacks(sq, self.occupied) & ~own & allowed, moves)
+
 class Move():
     # co-ordinates(row, col) mapping to chess(row, col) notations
     ranksToRows = {"1":7, "2":6, "3":5, "4":4, "5":3, "6":2, "7":1, "8":0 }
     rowsToRanks = {v: k for k, v in ranksToRows.items()} #reverse above dictionary
     filesToCols = {"a":0, "b":1, "c":2, "d":3, "e":4, "f":5, "g":6, "h":7 }
     colsToFiles = {v: k for k, v in filesToCols.items()}
-    
+    # fixed attributes instead of a per-move __dict__, move generation creates thousands of these
+    __slots__ = ('code', 'moveID') + MOVE_FIELDS
+
     #constructor
-    def __init__(self, startSq, endSq, board):
-       #gs = GameState()
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
+    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False, promotionChoice='Q'):
+        self.startRow, self.startCol = startSq
+        self.endRow, self.endCol = endSq
         self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endRow]
-        #self.pieceMoved = gs.startFEN[self.startCol + gs.startFEN.find("/", self.startRow -1)]
-        #self.pieceCaptured = gs.startFEN[self.endRow + gs.startFEN.find("/", self.endRow -1)]
-        
-        self.isPawnPromotion = (self.pieceMoved == 'wP' and self.endRow == 0) or (self.pieceMoved == 'bP' and self.endRow == 7) # pawn promotion logic                      
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol #unique ID given to each move
-        
+        self.pieceCaptured = board[self.endRow][self.endCol]
+
+        self.isPawnPromotion = (self.pieceMoved == 'wP' and self.endRow == 0) or (self.pieceMoved == 'bP' and self.endRow == 7) # pawn promotion logic
+        self.promotionChoice = promotionChoice # piece type the pawn turns into
+        self.isEnpassantMove = isEnpassantMove # pawn captures the pawn beside it, landing behind it
+        if self.isEnpassantMove:
+            self.pieceCaptured = 'bP' if self.pieceMoved == 'wP' else 'wP'
+        self.isCastleMove = isCastleMove # king move that also brings the rook across
+        # unique ID given to each move, packed into 14 bits: start square, end square << 6, promotion << 12
+        self.moveID = self.startRow * 8 + self.startCol | (self.endRow * 8 + self.endCol) << 6
+        if self.isPawnPromotion: # under-promotions to the same square get their own IDs
+            self.moveID |= PROMOTION_CHOICES.index(promotionChoice) << 12
+        self.code = (self.moveID | PACKED_PIECE_INDEX[self.pieceMoved] << 14
+                     | PACKED_PIECE_INDEX[self.pieceCaptured] << 18 | self.isEnpassantMove << 22
+                     | self.isCastleMove << 23 | self.isPawnPromotion << 24)
+
+    # the move generators only set code and moveID; the first read of any other field decodes them all from code
+    def __getattr__(self, name):
+        if name not in MOVE_FIELDS:
+            raise AttributeError(name)
+        self.decode()
+        return object.__getattribute__(self, name)
+
+    def decode(self):
+        code = self.code
+        start, end = code & 63, (code >> 6) & 63
+        self.startRow, self.startCol = start >> 3, start & 7
+        self.endRow, self.endCol = end >> 3, end & 7
+        self.pieceMoved = PACKED_PIECES[(code >> 14) & 15]
+        self.pieceCaptured = PACKED_PIECES[(code >> 18) & 15]
+        self.isPawnPromotion = bool(code & MOVE_PROMOTION)
+        self.promotionChoice = PROMOTION_CHOICES[(code >> 12) & 3]
+        self.isEnpassantMove = bool(code & MOVE_ENPASSANT)
+        self.isCastleMove = bool(code & MOVE_CASTLE)
+
     #comparing obj to another obj
     def __eq__(self, other):
         if(isinstance(other, Move)):
-            #if starting row, col and ending row, col are same for both moves, they are equal
+            #if starting row, col, ending row, col and promotion are same for both moves, they are equal
             return(self.moveID == other.moveID)
         return False
-    
+
+    # moves can be dict keys and set members, equal moves hash the same
+    def __hash__(self):
+        return self.moveID
+
+    # the whole move in 32 bits: moveID in bits 0-13, moved piece in 14-17, captured piece in 18-21
+    # (piece index as in chess_bitboard, 12 for an empty square), en passant flag bit 22, castle flag bit 23,
+    # promotion flag bit 24
+    def pack(self):
+        return self.code
+
+    # rebuilds a move from pack() without touching a board
+    @classmethod
+    def unpack(cls, code):
+        move = newMove(cls)
+        move.code = code
+        move.moveID = code & 0x3FFF
+        return move
+
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
-    
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion: # e7e8q, e7e8n ...
+            notation += self.promotionChoice.lower()
+        return notation
+
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
-   
-        
-        
-            
\ No newline at end of file
+
+newMove = object.__new__ # a Move with no fields set, for building one from its code without calling __init__
+
+# packed quiet moves by key, base << 64 | targets: base is start | moved << 14 | MOVE_QUIET for a piece, each move
+# going from start to a square of targets, or 64 + (start - end) for a set of pawn pushes of one length
+# filled in the first time a position needs them, like the slider attack tables, and emptied once it holds
+# QUIET_MOVES_LIMIT keys, so the generators copy a run of codes instead of building every quiet move
+QUIET_MOVES = {}
+QUIET_MOVES_LIMIT = 1 << 16
+
+
+def quietMoves(key):
+    if len(QUIET_MOVES) >= QUIET_MOVES_LIMIT:
+        QUIET_MOVES.clear()
+    base, targets = key >> 64, key & FULL
+    ends = []
+    while targets:
+        lsb = targets & -targets
+        ends.append(lsb.bit_length() - 1)
+        targets ^= lsb
+    if base < 128: # pawn pushes, white pawns move to lower squares
+        delta = base - 64
+        moved = (0 if delta > 0 else 6) << 14 | MOVE_QUIET
+        codes = QUIET_MOVES[key] = array('I', [end + delta | end << 6 | moved for end in ends])
+    else:
+        codes = QUIET_MOVES[key] = array('I', [base | end << 6 for end in ends])
+    return codes
+
+
+# squares whose occupancy decides the attacks of a knight, bishop, rook and queen (index 1-4, as in PIECES) on sq:
+# every square it could reach on an empty board
+BISHOP_REACH = [RAY_MASKS[4][sq] | RAY_MASKS[5][sq] | RAY_MASKS[6][sq] | RAY_MASKS[7][sq] for sq in range(64)]
+ROOK_REACH = [RAY_MASKS[0][sq] | RAY_MASKS[1][sq] | RAY_MASKS[2][sq] | RAY_MASKS[3][sq] for sq in range(64)]
+PIECE_REACH = (None, KNIGHT_ATTACKS, BISHOP_REACH, ROOK_REACH,
+               [BISHOP_REACH[sq] | ROOK_REACH[sq] for sq in range(64)])
+# PIECE_MOVES[i][sq][occupied & PIECE_REACH[i % 6][sq]] = (attacks, packed quiet moves to every empty square
+# attacked) of piece i on sq; filled in like QUIET_MOVES, and a square's table is emptied once it holds
+# PIECE_MOVES_LIMIT occupancies
+PIECE_MOVES = [[{} for sq in range(64)] for piece in PIECES]
+PIECE_MOVES_LIMIT = 1 << 9
+
+
+def pieceMoves(piece, sq, occupied):
+    table = PIECE_MOVES[piece][sq]
+    if len(table) >= PIECE_MOVES_LIMIT:
+        table.clear()
+    kind = piece % 6
+    if kind == 1:
+        attacks = KNIGHT_ATTACKS[sq]
+    elif kind == 2:
+        attacks = bishopAttacks(sq, occupied)
+    elif kind == 3:
+        attacks = rookAttacks(sq, occupied)
+    else:
+        attacks = bishopAttacks(sq, occupied) | rookAttacks(sq, occupied)
+    targets = attacks & ~occupied
+    base = sq | piece << 14 | MOVE_QUIET
+    codes = array('I')
+    while targets:
+        lsb = targets & -targets
+        codes.append(base | (lsb.bit_length() - 1) << 6)
+        targets ^= lsb
+    entry = table[occupied] = (attacks, codes)
+    return entry
+
+
+def _captureScores():
+    scores = [0] * 1024
+    for choice in range(4):
+        for moved in range(12):
+            for captured in range(13):
+                if captured < 12:
+                    score = 1000000 + 10 * PIECE_VALUES[PIECES[captured][1]] - PIECE_VALUES[PIECES[moved][1]]
+                else:
+                    score = 900000 + PIECE_VALUES[PROMOTION_CHOICES[choice]]
+                scores[choice | moved << 2 | captured << 6] = score
+    return scores
+
+# captureScore by bits 12-21 of the packed move (promotion choice, moved piece, captured piece)
+CAPTURE_SCORES = _captureScores()
+
+
+# MVV-LVA order of captures (most valuable victim, then least valuable attacker), non-capturing promotions after,
+# by packed move
+def captureScore(code):
+    return CAPTURE_SCORES[(code >> 12) & 0x3FF]
+
+
+# key of a quiet move in a history heuristic table: bits 6-17 of the packed move, its end square and piece moved
+def historyKey(move):
+    return (move.code >> 6) & 0xFFF
+
+
+# a move list as a flat buffer of packed moves, 4 bytes a move
+def packMoves(moves):
+    return array('I', [move.pack() for move in moves])
+
+
+# the Move objects of packed moves, as legal_moves() hands them out
+def unpackMoves(codes):
+    moves = []
+    append = moves.append
+    for code in codes:
+        move = newMove(Move)
+        move.code = code
+        move.moveID = code & 0x3FFF
+        append(move)
+    return moves
+
+
+# python -m chess_engine uci runs the engine headless over the UCI protocol
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ["uci"]:
+        import chess_uci
+        sys.exit(chess_uci.main())
+    sys.exit("usage: python -m chess_engine uci")
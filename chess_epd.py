@@ -0,0 +1,154 @@
+#Chess EPD
+
+'''Reads FEN and EPD position files as a stream, one line at a time, so suites of any size use constant memory'''
+'''Lines are either a full FEN, or an EPD record: the first four FEN fields and then "opcode operand;" operations'''
+'''usage: python -m chess_epd FILE [--depth N] [--time SECONDS] [--perft] [--limit N] [--cache FILE]'''
+
+import argparse
+import gzip
+import itertools
+import re
+import sys
+import time
+
+import chess_cache
+import chess_engine
+import chess_perft
+import chess_search
+
+# an operand in double quotes (it may hold spaces and semicolons), a bare word, or the ";" ending an operation
+_TOKEN = re.compile(r'"[^"]*"|;|[^\s;]+')
+
+
+# text lines of a file, .gz files are decompressed on the fly
+def openLines(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+# 'bm Nf3 Ne5; id "WAC.001";' -> {'bm': ['Nf3', 'Ne5'], 'id': ['WAC.001']}
+def parseOperations(text):
+    operations = {}
+    opcode = None
+    for token in _TOKEN.findall(text):
+        if token == ";":
+            opcode = None
+        elif opcode is None:
+            opcode = token
+            operations[opcode] = []
+        else:
+            operations[opcode].append(token[1:-1] if token[0] == '"' else token)
+    return operations
+
+
+# one line -> (fen, operations), None for a blank line or a # comment
+# an EPD record's move clocks come from its hmvc and fmvn operations, as the EPD standard has them
+def parseLine(line):
+    line = line.strip()
+    if not line or line[0] == "#":
+        return None
+    fields = line.split(None, 6)
+    if len(fields) < 4:
+        raise ValueError("not a FEN or EPD record: %r" % line)
+    if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit(): # FEN with its move clocks
+        return " ".join(fields[:6]), parseOperations(fields[6] if len(fields) > 6 else "")
+    operations = parseOperations(line.split(None, 4)[4] if len(fields) > 4 else "")
+    halfmove = operations.get("hmvc", ["0"])[0]
+    fullmove = operations.get("fmvn", ["1"])[0]
+    return " ".join(fields[:4] + [halfmove, fullmove]), operations
+
+
+# generator over (fen, operations) for every record of source, a file name or any iterable of lines
+def readPositions(source):
+    lines = openLines(source) if isinstance(source, str) else source
+    try:
+        for line in lines:
+            record = parseLine(line)
+            if record is not None:
+                yield record
+    finally:
+        if isinstance(source, str):
+            lines.close()
+
+
+# generator over (GameState, operations), one fresh GameState per record
+def readGameStates(source):
+    for fen, operations in readPositions(source):
+        yield chess_engine.GameState.from_fen(fen), operations
+
+
+# EPD record of a GameState or FEN string: four FEN fields, then the operations, with the move clocks as hmvc and fmvn
+def formatEPD(position, operations=None):
+    fields = (position if isinstance(position, str) else position.to_fen()).split()
+    operations = dict(operations or {})
+    operations.setdefault("hmvc", [fields[4]])
+    operations.setdefault("fmvn", [fields[5]])
+    text = []
+    for opcode, operands in operations.items():
+        words = ['"%s"' % operand if " " in operand or ";" in operand or not operand else operand
+                 for operand in operands]
+        text.append(" ".join([opcode] + words) + ";")
+    return " ".join(fields[:4] + text)
+
+
+# writes (GameState, operations) pairs as EPD lines, streaming like readGameStates
+def writeEPD(records, out):
+    count = 0
+    for gs, operations in records:
+        out.write(formatEPD(gs, operations) + "\n")
+        count += 1
+    return count
+
+
+# searches every position in the file and prints the move found for it, with the file's "id" when it has one
+# with perft, checks the "D1 20; D2 400;" node counts of a perft suite file instead
+# with a chess_cache.AnalysisCache, positions it has searched to depth are not searched again
+def analyse(path, depth=4, timeLimit=None, perft=False, limit=None, out=sys.stdout, cache=None):
+    start = time.perf_counter()
+    count = failures = 0
+    searcher = chess_search.Searcher()
+    for gs, operations in itertools.islice(readGameStates(path), limit):
+        count += 1
+        name = operations.get("id", [str(count)])[0]
+        if perft:
+            for n in range(1, depth + 1):
+                if "D%d" % n in operations:
+                    nodes = chess_perft.perft(gs, n)
+                    expected = int(operations["D%d" % n][0])
+                    failures += nodes != expected
+                    out.write("%s D%d %d %s\n" % (name, n, nodes, "ok" if nodes == expected else
+                                                   "FAIL (expected %d)" % expected))
+        else:
+            if cache is not None:
+                result = chess_cache.analyse(gs, depth, searcher, cache, timeLimit)
+            else:
+                result = searcher.search(gs, depth, timeLimit)
+            move = result.bestMove.getChessNotation() if result.bestMove else "-"
+            out.write("%s %s %d depth %d\n" % (name, move, result.score, result.depth))
+    seconds = time.perf_counter() - start
+    out.write("%d positions in %.3fs, %.1f positions/s%s%s\n" % (
+        count, seconds, count / seconds if seconds else 0, ", %d failed" % failures if perft else "",
+        ", %d from the cache" % cache.hits if cache is not None else ""))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="chess_epd", description="batch analysis of FEN/EPD files")
+    parser.add_argument("file", help="FEN or EPD file, may be gzipped")
+    parser.add_argument("--depth", type=int, default=4, help="search depth, or deepest perft count checked")
+    parser.add_argument("--time", type=float, default=None, help="time limit per position in seconds")
+    parser.add_argument("--perft", action="store_true", help="check the D1, D2 ... perft counts in the file")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many positions")
+    parser.add_argument("--cache", default=None, help="analysis cache file, positions already in it are skipped")
+    args = parser.parse_args(argv)
+    cache = chess_cache.AnalysisCache(args.cache) if args.cache else None
+    try:
+        return 1 if analyse(args.file, args.depth, args.time, args.perft, args.limit, cache=cache) else 0
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
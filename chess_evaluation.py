@@ -0,0 +1,83 @@
+#Chess Evaluation
+
+'''Static evaluation of a GameState: material plus piece-square tables'''
+'''Scores are in centipawns from the side to move's point of view, as negamax wants them'''
+
+from chess_bitboard import PIECES
+
+PIECE_VALUES = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+
+# piece-square tables from white's side, laid out like GameState.board (row 0 is the 8th rank)
+# black pieces read them with the rows mirrored
+PIECE_SQUARE_TABLES = {
+    'P': [  0,   0,   0,   0,   0,   0,   0,   0,
+           50,  50,  50,  50,  50,  50,  50,  50,
+           10,  10,  20,  30,  30,  20,  10,  10,
+            5,   5,  10,  25,  25,  10,   5,   5,
+            0,   0,   0,  20,  20,   0,   0,   0,
+            5,  -5, -10,   0,   0, -10,  -5,   5,
+            5,  10,  10, -20, -20,  10,  10,   5,
+            0,   0,   0,   0,   0,   0,   0,   0],
+    'N': [-50, -40, -30, -30, -30, -30, -40, -50,
+          -40, -20,   0,   0,   0,   0, -20, -40,
+          -30,   0,  10,  15,  15,  10,   0, -30,
+          -30,   5,  15,  20,  20,  15,   5, -30,
+          -30,   0,  15,  20,  20,  15,   0, -30,
+          -30,   5,  10,  15,  15,  10,   5, -30,
+          -40, -20,   0,   5,   5,   0, -20, -40,
+          -50, -40, -30, -30, -30, -30, -40, -50],
+    'B': [-20, -10, -10, -10, -10, -10, -10, -20,
+          -10,   0,   0,   0,   0,   0,   0, -10,
+          -10,   0,   5,  10,  10,   5,   0, -10,
+          -10,   5,   5,  10,  10,   5,   5, -10,
+          -10,   0,  10,  10,  10,  10,   0, -10,
+          -10,  10,  10,  10,  10,  10,  10, -10,
+          -10,   5,   0,   0,   0,   0,   5, -10,
+          -20, -10, -10, -10, -10, -10, -10, -20],
+    'R': [  0,   0,   0,   0,   0,   0,   0,   0,
+            5,  10,  10,  10,  10,  10,  10,   5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+            0,   0,   0,   5,   5,   0,   0,   0],
+    'Q': [-20, -10, -10,  -5,  -5, -10, -10, -20,
+          -10,   0,   0,   0,   0,   0,   0, -10,
+          -10,   0,   5,   5,   5,   5,   0, -10,
+           -5,   0,   5,   5,   5,   5,   0,  -5,
+            0,   0,   5,   5,   5,   5,   0,  -5,
+          -10,   5,   5,   5,   5,   5,   0, -10,
+          -10,   0,   5,   0,   0,   0,   0, -10,
+          -20, -10, -10,  -5,  -5, -10, -10, -20],
+    'K': [-30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -20, -30, -30, -40, -40, -30, -30, -20,
+          -10, -20, -20, -20, -20, -20, -20, -10,
+           20,  20,   0,   0,   0,   0,  20,  20,
+           20,  30,  10,   0,   0,  10,  30,  20],
+}
+
+# PIECE_SQUARE_SCORES[piece index][sq] = material + table value, positive for white, negative for black
+PIECE_SQUARE_SCORES = []
+for _piece in PIECES:
+    _table = PIECE_SQUARE_TABLES[_piece[1]]
+    if _piece[0] == 'w':
+        PIECE_SQUARE_SCORES.append([PIECE_VALUES[_piece[1]] + _table[sq] for sq in range(64)])
+    else:
+        PIECE_SQUARE_SCORES.append([-(PIECE_VALUES[_piece[1]] + _table[sq ^ 56]) for sq in range(64)])
+
+
+# score of the position for the side to move
+def evaluate(gs):
+    score = 0
+    for i in range(12):
+        table = PIECE_SQUARE_SCORES[i]
+        bb = gs.pieceBoards[i]
+        while bb:
+            lsb = bb & -bb
+            score += table[lsb.bit_length() - 1]
+            bb ^= lsb
+    return score if gs.whiteToMove else -score
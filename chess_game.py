@@ -2,49 +2,95 @@
 #Mohit Tamang
 
 ''' Main file, responsible for handling user input and render current GameState object'''
+''' usage: python chess_game.py [--images chess_images_fen] [--profile-startup]'''
+import time
+STARTED = time.perf_counter() # for the startup profile, taken before the heavy imports
+
+import argparse
+import threading
+
 import pygame as pg
+import chess_assets
 import chess_engine
+import chess_search
 
 #Global vars
 WIDTH = HEIGHT = 512
 DIMENSION = 8 # 8*8 board
 SQ_SIZE = WIDTH // DIMENSION
-MAX_FPS = 15 #for animation
-IMAGES = {} #dict for storing images
+MAX_FPS = 15 # frame rate while waiting for the engine
+ANIMATION_FPS = 60 # frame rate while pieces are moving
+SECONDS_PER_SQ = 0.08 # lower the number, faster the move animation
+IMAGE_SET = "chess_images" # or "chess_images_fen"
+IMAGES = {} # piece code -> Surface, a chess_assets.PieceImages once loadPieceImages has run
+AI_THINK_TIME = 0.5 # seconds the engine may spend on each move
+DIRTY_RECT_RENDERING = True # False redraws and flips the whole window every frame
+colors = [pg.Color("white"), pg.Color("gray")]
+HIGHLIGHTS = {} # colour name -> translucent square Surface, made once
+BACKGROUND = [] # the empty board, rendered once
 
 #load chess piece images. note: do this only once
-def loadPieceImages():
-    pieces = ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']
-    for piece in pieces:
-        IMAGES[piece] = pg.transform.scale(pg.image.load("chess_images/" + piece + ".png"), (SQ_SIZE,SQ_SIZE))
+# the images come from the atlas of this SQ_SIZE, read when the first piece is drawn
+def loadPieceImages(imageSet=IMAGE_SET):
+    global IMAGES
+    IMAGES = chess_assets.PieceImages(SQ_SIZE, imageSet)
+
+# the endgame tables, opened when the engine first has to move so they cost nothing at startup
+def openTablebase():
+    import chess_tablebase
+    return chess_tablebase.openDefault() # perfect play in KQK, KRK and KPK once the tables are generated
         
-def main():
+def main(imageSet=IMAGE_SET, profileStartup=False):
+    mainStarted = time.perf_counter()
     pg.init()
     screen = pg.display.set_mode((WIDTH, HEIGHT))
+    windowReady = time.perf_counter()
     clock = pg.time.Clock()
     screen.fill(pg.Color("white"))
     #create game state object
     gs = chess_engine.GameState()
-    validMoves = [] 
+    validMoves = gs.legal_moves() # one legal move list per ply, highlighting picks the selected piece's moves
     moveMade = False #flag for when a valid move is made
     animate = False # flag var for when animation should be done
     gameOver = False
     running = True
     whiteKingmoved = blackKingmoved = False
-    loadPieceImages()    
+    playerOne = True # True if a human plays white, False if the engine does
+    playerTwo = False # same for black
+    searcher = None
+    tablebase = None # opened with the first searcher, every searcher after a reset shares it
+    loadPieceImages(imageSet)    
     sqSelected = () #keep track of last user click(row, col)
     playerClicks = [] #keeps track of player clicks (current click and destination click) eg: [(6,5), (4,4)]
+    renderer = BoardRenderer(screen) if DIRTY_RECT_RENDERING else None
+    pg.event.set_blocked(pg.MOUSEMOTION) # nothing follows the mouse, don't wake up for it
+    text = None
+    animations = [] # PieceAnimation of every piece still sliding to its square
+    thinker = None # EngineThinker searching the engine's move in the background
+    engineText = None # shown when the engine finished without a move, until an undo or reset
+    firstFrame = True
     while(running):
+        humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
+        if renderer is not None and (humanTurn or gameOver) and renderer.isCurrent and not animations:
+            # nothing will change until the user does something, sleep until then
+            events = [pg.event.wait()] + pg.event.get()
+        else:
+            events = pg.event.get()
         #to quit game
-        for e in pg.event.get():            
+        for e in events:            
             if(e.type == pg.QUIT):
                 running = False
+                if thinker is not None:
+                    thinker.cancel()
+                    thinker = None
+                if tablebase is not None:
+                    tablebase.close()
                 pg.quit()
                 
             #get locaton of clicks on the board
             elif(e.type == pg.MOUSEBUTTONDOWN): 
-                if not gameOver:
-                    location = pg.mouse.get_pos() # gets (x,y) location opf the mouse
+                if not gameOver and humanTurn:
+                    location = e.pos # (x,y) of this click, the mouse may have moved on since
                     col = location[0]//SQ_SIZE
                     row = location[1]//SQ_SIZE
                     
@@ -58,16 +104,13 @@ def main():
                         sqSelected = (row,col)
                         playerClicks.append(sqSelected) #append 1st and 2nd clicks
                         
-                    if(len(playerClicks) == 1):
-                        if(gs.board[row][col] != "--"):
-                            validMoves = gs.getValidMoves(row,col)
-                            
                     #after the second click, move the piece selected
                     if (len(playerClicks) == 2):
                         move = chess_engine.Move(playerClicks[0], playerClicks[1], gs.board) #user generates a move here
                         print(playerClicks)
                         if move in validMoves:
-                            gs.makeMove(move)
+                            # make the engine's own move, it knows about castling, en passant and promotion
+                            gs.makeMove(validMoves[validMoves.index(move)])
                             moveMade = True
                             animate = True
                             sqSelected = () # reset clicks
@@ -76,56 +119,285 @@ def main():
                         # handles castling    
                         elif((playerClicks[0] == (7,4) and playerClicks[1] == (7,7)) or (playerClicks[0] == (7,4) and playerClicks[1] == (7,0)) or
                              (playerClicks[0] == (0,4) and playerClicks[1] == (0,7)) or (playerClicks[0] == (0,4) and playerClicks[1] == (0,0))):
-                            gs.handleCastling(playerClicks)
-                            gs.whiteToMove = not gs.whiteToMove # swap player turn 
-                            moveMade = True
+                            moveMade = gs.handleCastling(playerClicks)
                             sqSelected = () # reset clicks
                             playerClicks = []
                             
                        
                         else:
                             playerClicks = [sqSelected]
-                            if(gs.board[row][col] != "--"):
-                                validMoves = gs.getValidMoves(row,col)
              
             #******** KEY HANDLERS *************#
             #undo the move when 'z' is pressed      
             elif(e.type == pg.KEYDOWN):
                 if(e.key == pg.K_z):
+                    if thinker is not None: # the position it is searching is going away
+                        thinker.cancel()
+                        thinker = None
+                    animations = []
                     gs.undoMove()
+                    # back on the engine's turn: take back its move too, or it would play the same move again
+                    engineTurn = not ((gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo))
+                    if engineTurn and (playerOne or playerTwo) and gs.moveLog:
+                        gs.undoMove()
                     moveMade = True
                     animate = False
+                    gameOver = False
+                    engineText = None
                     
             # reset the board when 'r' pressed
                 if(e.key == pg.K_r): 
+                    if thinker is not None:
+                        thinker.cancel()
+                        thinker = None
+                    animations = []
                     gs = chess_engine.GameState()
+                    searcher = None
+                    validMoves = gs.legal_moves()
+                    gameOver = False
+                    engineText = None
                     sqSelected = ()
                     playerClicks = []
                     moveMade = False
                     animate = False
+
+            # the window was uncovered or restored, its contents are gone
+            elif(e.type in (pg.VIDEOEXPOSE, pg.WINDOWEXPOSED) and renderer is not None):
+                renderer.invalidate()
         
+        #engine plays its side: the search runs on its own thread and is checked once a frame
+        if running and not gameOver and not humanTurn and not moveMade:
+            if thinker is None:
+                if searcher is None:
+                    if tablebase is None:
+                        tablebase = openTablebase()
+                    searcher = chess_search.Searcher(tablebase=tablebase)
+                thinker = EngineThinker(searcher, gs, AI_THINK_TIME)
+            elif thinker.done and not animations: # the move appears once the last one has landed
+                move = thinker.move(gs)
+                thinker = None
+                if move is not None:
+                    gs.makeMove(move)
+                    moveMade = True
+                    animate = True
+                else: # the search failed, starting another would most likely fail the same way
+                    gameOver = True
+                    engineText = "ENGINE FOUND NO MOVE"
+
         #add animation when a move is made
+        now = time.perf_counter()
         if moveMade:
             if animate:
-                moveAnimation(gs.moveLog[-1], screen, gs.board, clock)
-            #validMoves = gs.getValidMoves(row,col)
+                animations += moveAnimations(gs.moveLog[-1], now)
+            validMoves = gs.legal_moves()
             moveMade = False
             animate = False
-                    
-        drawGameState(screen, gs, validMoves, sqSelected) 
         
+        text = None
         if gs.checkmate:
             gameOver = True
             if gs.whiteToMove:
-                showText(screen, "CHECKMATE: Black wins")
+                text = "CHECKMATE: Black wins"
             else:
-                showText(screen, "CHECKMATE: White wins")
+                text = "CHECKMATE: White wins"
         elif gs.stalemate:
             gameOver = True
-            showText(screen, "STALEMATE")
-            
-        clock.tick(MAX_FPS)
-        pg.display.flip()
+            text = "STALEMATE"
+        elif engineText is not None:
+            text = engineText
+
+        if renderer is not None:
+            renderer.render(gs, validMoves, sqSelected, text, animations, now)
+        else:
+            drawGameState(screen, gs, validMoves, sqSelected)
+            drawAnimations(screen, animations, now)
+            if text is not None:
+                showText(screen, text)
+            pg.display.flip()
+        if firstFrame:
+            firstFrame = False
+            if profileStartup:
+                shown = time.perf_counter()
+                print("startup: imports %.1fms, window %.1fms, first frame %.1fms, total %.1fms" % (
+                    1000*(mainStarted - STARTED), 1000*(windowReady - mainStarted), 1000*(shown - windowReady),
+                    1000*(shown - STARTED)))
+        animations = [animation for animation in animations if not animation.done(now)]
+        clock.tick(ANIMATION_FPS if animations else MAX_FPS)
+
+# searches the engine's move on a background thread, on its own copy of the position,
+# so the window keeps drawing and answering events meanwhile
+class EngineThinker():
+    def __init__(self, searcher, gs, timeLimit):
+        self.searcher = searcher
+        self.notation = None
+        self.done = False
+        self.cancelled = False
+        snapshot = gs.snapshot() # the copy keeps the game's repetition history
+        self.thread = threading.Thread(target=self.think, args=(snapshot, timeLimit), daemon=True)
+        self.thread.start()
+
+    def think(self, snapshot, timeLimit):
+        try:
+            if self.cancelled:
+                return
+            result = self.searcher.search(chess_engine.GameState.fromSnapshot(snapshot), timeLimit=timeLimit,
+                                          onIteration=self.onIteration)
+            if result.bestMove is not None:
+                self.notation = result.bestMove.getChessNotation()
+        finally: # even a search that raised is over, the game must not wait for it forever
+            self.done = True
+
+    # the move found, as a move of gs (the game's own GameState), None if there is none
+    def move(self, gs):
+        if self.cancelled or self.notation is None:
+            return None
+        return gs.moveFromNotation(self.notation)
+
+    # search() clears the searcher's stop when it starts, so a cancel that came in just before is repeated here
+    def onIteration(self, result):
+        if self.cancelled:
+            self.searcher.stop()
+
+    # stops the search and waits for the thread, so the searcher is free for the next one
+    # the wait is short: the search gives up within its next limit check, or after depth 1 if it had not started
+    def cancel(self):
+        self.cancelled = True
+        self.searcher.stop()
+        self.thread.join()
+
+# one piece sliding from its start square to its end square, by the clock rather than by frames
+class PieceAnimation():
+    def __init__(self, piece, start, end, startTime):
+        self.piece = piece
+        self.start = start # (row, col)
+        self.end = end
+        self.startTime = startTime
+        self.duration = (abs(end[0] - start[0]) + abs(end[1] - start[1])) * SECONDS_PER_SQ
+
+    def done(self, now):
+        return now >= self.startTime + self.duration
+
+    # top left pixel of the piece at time now
+    def position(self, now):
+        t = min((now - self.startTime) / self.duration, 1.0) if self.duration else 1.0
+        r = self.start[0] + (self.end[0] - self.start[0])*t
+        c = self.start[1] + (self.end[1] - self.start[1])*t
+        return (round(c*SQ_SIZE), round(r*SQ_SIZE))
+
+    def endSq(self):
+        return self.end[0]*8 + self.end[1]
+
+# the pieces a move slides: the piece moved, and the rook too when castling
+def moveAnimations(move, now):
+    animations = [PieceAnimation(move.pieceMoved, (move.startRow, move.startCol), (move.endRow, move.endCol), now)]
+    if move.isCastleMove:
+        kingSide = move.endCol == 6
+        rook = move.pieceMoved[0] + 'R'
+        animations.append(PieceAnimation(rook, (move.endRow, 7 if kingSide else 0),
+                                         (move.endRow, 5 if kingSide else 3), now))
+    return animations
+
+# full-redraw mode: clear each moving piece's end square and draw the piece where it is now
+def drawAnimations(screen, animations, now):
+    for animation in animations:
+        if not animation.done(now):
+            end = animation.endSq()
+            rect = pg.Rect((end & 7)*SQ_SIZE, (end >> 3)*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+            screen.blit(boardBackground(), rect, rect)
+    for animation in animations:
+        if not animation.done(now):
+            screen.blit(IMAGES[animation.piece], animation.position(now))
+
+# draws only the squares whose piece or highlight changed since the last frame, from a cached board background,
+# and hands just those rects to the display; a moving piece dirties the squares under it this frame and the last
+class BoardRenderer():
+    def __init__(self, screen):
+        self.screen = screen
+        self.invalidate()
+
+    # forget what is on the screen, the next render draws every square
+    def invalidate(self):
+        self.drawn = [None] * 64 # (piece, highlight colour) last drawn on each square
+        self.text = None
+        self.spriteSquares = [] # squares the moving pieces covered in the last frame
+        self.isCurrent = False
+
+    def render(self, gs, validMoves, sqSelected, text=None, animations=(), now=None):
+        wanted = [(piece, None) for piece in gs.squares]
+        for sq, colour in highlightedSquares(gs, validMoves, sqSelected):
+            wanted[sq] = (wanted[sq][0], colour)
+        sprites = [(animation.piece, animation.position(now)) for animation in animations if not animation.done(now)]
+        for animation in animations:
+            if not animation.done(now): # the piece is still on its way to this square
+                wanted[animation.endSq()] = ("--", wanted[animation.endSq()][1])
+        if text != self.text: # the text lies across the middle squares, start again from a clean board
+            self.drawn = [None] * 64
+        spriteSquares = [sq for piece, (x, y) in sprites for sq in coveredSquares(x, y)]
+        for sq in self.spriteSquares + spriteSquares:
+            self.drawn[sq] = None
+        self.spriteSquares = spriteSquares
+        rects = []
+        for sq in range(64):
+            if wanted[sq] != self.drawn[sq]:
+                rects.append(drawSquare(self.screen, sq, *wanted[sq]))
+                self.drawn[sq] = wanted[sq]
+        for piece, position in sprites:
+            self.screen.blit(IMAGES[piece], position)
+        if text is not None and rects:
+            showText(self.screen, text)
+        self.text = text
+        if rects:
+            pg.display.update(rects)
+        self.isCurrent = not sprites
+        return rects
+
+# the squares a SQ_SIZE sprite with its top left corner at (x, y) overlaps
+def coveredSquares(x, y):
+    squares = []
+    for r in {y // SQ_SIZE, (y + SQ_SIZE - 1) // SQ_SIZE}:
+        for c in {x // SQ_SIZE, (x + SQ_SIZE - 1) // SQ_SIZE}:
+            if 0 <= r < DIMENSION and 0 <= c < DIMENSION:
+                squares.append(r*8 + c)
+    return squares
+
+# the empty board as one Surface, drawn the first time it is needed
+def boardBackground():
+    if not BACKGROUND:
+        background = pg.Surface((WIDTH, HEIGHT))
+        drawBoard(background)
+        BACKGROUND.append(background)
+    return BACKGROUND[0]
+
+# one square from the background, with its highlight and piece, returns its rect
+def drawSquare(screen, sq, piece, highlight=None):
+    rect = pg.Rect((sq & 7)*SQ_SIZE, (sq >> 3)*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    screen.blit(boardBackground(), rect, rect)
+    if highlight is not None:
+        screen.blit(highlightSurface(highlight), rect)
+    if piece != "--":
+        screen.blit(IMAGES[piece], rect)
+    return rect
+
+def highlightSurface(colour):
+    if colour not in HIGHLIGHTS:
+        surface = pg.Surface((SQ_SIZE, SQ_SIZE))
+        surface.set_alpha(100)
+        surface.fill(pg.Color(colour))
+        HIGHLIGHTS[colour] = surface
+    return HIGHLIGHTS[colour]
+
+# (square, colour) of the selected piece and the squares it can move to
+def highlightedSquares(gs, validMoves, sqSelected):
+    if sqSelected == ():
+        return []
+    r,c = sqSelected
+    if gs.board[r][c][0] != ('w' if gs.whiteToMove else 'b'):
+        return []
+    squares = [(r*8 + c, 'green')]
+    for move in validMoves:
+        if move.startRow == r and move.startCol == c:
+            squares.append((move.endRow*8 + move.endCol, 'brown'))
+    return squares
 
 #draw all graphics required on the current game state
 def drawGameState(screen, gs, validMoves, sqSelected):
@@ -138,8 +410,6 @@ def drawGameState(screen, gs, validMoves, sqSelected):
 def drawBoard(screen):
     #top left sqaure is always white
     # row num + col num = even (for white squares)
-    global colors
-    colors = [pg.Color("white"), pg.Color("gray")]
     for r in range(DIMENSION):
         for c in range(DIMENSION):
             square_color = colors[( (r+c) % 2 )] #picks the color
@@ -176,54 +446,25 @@ def drawPieces(screen, board):
            
 # move highlighting
 def highlightSq(screen, gs, validMoves, sqSelected):
-    if sqSelected != ():
-        r,c = sqSelected
-       
-        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
-            # highlight sdelected sq
-            highlight_sq = pg.Surface((SQ_SIZE, SQ_SIZE))
-            highlight_sq.set_alpha(100)
-            highlight_sq.fill(pg.Color('green'))
-            screen.blit(highlight_sq, (c*SQ_SIZE, r*SQ_SIZE))
+    for sq, colour in highlightedSquares(gs, validMoves, sqSelected):
+        screen.blit(highlightSurface(colour), ((sq & 7)*SQ_SIZE, (sq >> 3)*SQ_SIZE))
             
-            # highlight moves of the selected piece
-            highlight_sq.fill(pg.Color('brown'))
-            for move in validMoves:
-               if move.startRow == r and move.startCol == c:
-                   screen.blit(highlight_sq, (move.endCol*SQ_SIZE, move.endRow*SQ_SIZE))
-            
-# move animation
-def moveAnimation(move, screen, board, clock):
-    global colors
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    framesPerSq = 5 # lower the number, faster the move animation
-    frameCount = (abs(dR) + abs(dC)) * framesPerSq
-    for frame in range(frameCount + 1):
-        r,c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        
-        #erase piece moved from the ending sq
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSq = pg.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        pg.draw.rect(screen,color, endSq)
-        
-        # draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], pg.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        pg.display.flip()
-        clock.tick(60)
-        
 # game over text
+# the font and both renderings come from chess_assets, so showing the same text again costs two blits
 def showText(screen, text):
-    font = pg.font.SysFont("chicago", 40, True, False)
-    textObj = font.render(text, 0, pg.Color('white'))
+    font = chess_assets.font("chicago", 40, True, False)
+    textObj = chess_assets.renderText(text, font, 'white')
     textLocation = pg.Rect(0,0, WIDTH, HEIGHT).move(WIDTH/2 - textObj.get_width()/2, HEIGHT/2 - textObj.get_height()/2)  
     screen.blit(textObj, textLocation)
-    textObj = font.render(text, 0, pg.Color('black'))
+    textObj = chess_assets.renderText(text, font, 'black')
     screen.blit(textObj, textLocation.move(2,2))
     
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="play chess against the engine")
+    parser.add_argument("--images", default=IMAGE_SET, choices=sorted(chess_assets.IMAGE_SETS), help="piece image set")
+    parser.add_argument("--profile-startup", dest="profileStartup", action="store_true",
+                        help="print how long the start up to the first frame took")
+    args = parser.parse_args()
+    main(args.images, args.profileStartup)
 
 
@@ -0,0 +1,168 @@
+#Chess NumPy Evaluation
+
+'''Vectorized evaluation of many positions at once with NumPy'''
+'''Positions become 12 piece-square planes of 0/1 for material, piece-square tables and pawn structure, and arrays'''
+'''of uint64 bitboards for mobility; every term is a whole-array operation over the batch, so the Python overhead'''
+'''is paid once per batch instead of once per position'''
+'''Scores are in centipawns from the side to move's point of view, like chess_evaluation.evaluate'''
+
+import numpy as np
+
+from chess_bitboard import BISHOP_DIRS, COL_MASKS, DIRECTIONS, FULL, KNIGHT_OFFSETS, PIECE_INDEX, ROOK_DIRS
+from chess_evaluation import PIECE_SQUARE_SCORES
+
+# (12, 64) material + piece-square value of every piece on every square, positive for white
+PIECE_SQUARE_ARRAY = np.array(PIECE_SQUARE_SCORES, dtype=np.int32)
+
+# centipawns per square a piece can move to
+MOBILITY_WEIGHTS = {'N': 4, 'B': 5, 'R': 2, 'Q': 1}
+DOUBLED_PAWN = -15 # for every pawn past the first on a file
+ISOLATED_PAWN = -12 # no pawn of the same colour on either neighbouring file
+# passed pawn bonus by row for white (row 0 is the 8th rank), black reads it mirrored
+PASSED_PAWN = np.array([0, 120, 80, 50, 30, 15, 10, 0], dtype=np.int32)
+
+
+# (N, 12) uint64 array from N lists of 12 bitboards (GameState.pieceBoards)
+def boardArray(pieceBoards):
+    return np.array(pieceBoards, dtype='<u8').reshape(len(pieceBoards), 12)
+
+
+# (N, 12, 64) uint8 planes from a boardArray, plane i is chess_bitboard.PIECES[i]
+# and square index as in GameState.squares
+def encodeBoards(boards):
+    # little-endian bytes, then bits lowest first, puts bit sq of a bitboard at index sq
+    return np.unpackbits(boards.view(np.uint8).reshape(len(boards), 12, 8), axis=2, bitorder='little')
+
+
+def encodeBatch(states):
+    return encodeBoards(boardArray([gs.pieceBoards for gs in states]))
+
+
+def encode(gs):
+    return encodeBatch([gs])[0]
+
+
+# moves every plane of a (N, 8, 8) array one step in direction (dr, dc), squares pushed off the board are lost
+def _shift(boards, dr, dc):
+    shifted = np.zeros_like(boards)
+    rows, cols = boards.shape[1], boards.shape[2]
+    shifted[:, max(dr, 0):rows + min(dr, 0), max(dc, 0):cols + min(dc, 0)] = \
+        boards[:, max(-dr, 0):rows - max(dr, 0), max(-dc, 0):cols - max(dc, 0)]
+    return shifted
+
+
+# squares a one-step move with column change dc may land on, the columns it would wrap round to are left out
+_LANDING = {dc: np.uint64(FULL & ~sum(COL_MASKS[c] for c in range(8) if not 0 <= c - dc < 8)) for dc in range(-2, 3)}
+# bit counts of every byte value, for NumPy versions without bitwise_count
+_BYTE_COUNTS = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def _popcount(bitboards):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bitboards).astype(np.int32)
+    return _BYTE_COUNTS[bitboards.view(np.uint8)].reshape(bitboards.shape + (8,)).sum(axis=-1, dtype=np.int32)
+
+
+def _step(bitboards, shift):
+    return bitboards << np.uint64(shift) if shift > 0 else bitboards >> np.uint64(-shift)
+
+
+# squares attacked in direction (dr, dc) by every piece in pieces, through empty squares: Kogge-Stone fill, (N,) -> (N,)
+def _slide(pieces, empty, dr, dc):
+    shift = dr * 8 + dc
+    landing = _LANDING[dc]
+    free = empty & landing
+    fill = pieces
+    fill = fill | (free & _step(fill, shift))
+    free = free & _step(free, shift)
+    fill = fill | (free & _step(fill, 2 * shift))
+    free = free & _step(free, 2 * shift)
+    fill = fill | (free & _step(fill, 4 * shift))
+    return _step(fill, shift) & landing
+
+
+# mobility score of both sides, white minus black, from (N, 12) uint64 bitboards: (N,)
+# each direction is filled for all pieces of a kind at once; a ray ends at the next piece, so rays going the same
+# way never overlap and the bit count of the filled squares is the sum of the pieces' own move counts
+def mobilityTerm(boards):
+    white = np.bitwise_or.reduce(boards[:, 0:6], axis=1)
+    black = np.bitwise_or.reduce(boards[:, 6:12], axis=1)
+    empty = ~(white | black)
+    score = np.zeros(boards.shape[0], dtype=np.int32)
+    for color, sign, notOwn in (('w', 1, ~white), ('b', -1, ~black)):
+        knights = boards[:, PIECE_INDEX[color + 'N']]
+        count = np.zeros(boards.shape[0], dtype=np.int32)
+        for dr, dc in KNIGHT_OFFSETS:
+            count += _popcount(_step(knights, dr * 8 + dc) & _LANDING[dc] & notOwn)
+        score += sign * MOBILITY_WEIGHTS['N'] * count
+        for piece, directions in (('B', BISHOP_DIRS), ('R', ROOK_DIRS), ('Q', ROOK_DIRS + BISHOP_DIRS)):
+            pieces = boards[:, PIECE_INDEX[color + piece]]
+            if not pieces.any():
+                continue
+            count = np.zeros(boards.shape[0], dtype=np.int32)
+            for d in directions:
+                count += _popcount(_slide(pieces, empty, *DIRECTIONS[d]) & notOwn)
+            score += sign * MOBILITY_WEIGHTS[piece] * count
+    return score
+
+
+# doubled, isolated and passed pawns, white minus black: (N,)
+def pawnStructureTerm(planes):
+    n = planes.shape[0]
+    whitePawns = planes[:, PIECE_INDEX['wP']].reshape(n, 8, 8).astype(np.int32)
+    blackPawns = planes[:, PIECE_INDEX['bP']].reshape(n, 8, 8).astype(np.int32)
+    score = np.zeros(n, dtype=np.int32)
+    for pawns, sign in ((whitePawns, 1), (blackPawns, -1)):
+        files = pawns.sum(axis=1) # (N, 8) pawns on each file
+        neighbours = np.zeros_like(files)
+        neighbours[:, 1:] += files[:, :-1]
+        neighbours[:, :-1] += files[:, 1:]
+        score += sign * DOUBLED_PAWN * np.maximum(files - 1, 0).sum(axis=1)
+        score += sign * ISOLATED_PAWN * (files * (neighbours == 0)).sum(axis=1)
+
+    # a white pawn is passed when no black pawn stands on a row above it on its own or a neighbouring file
+    def spread(pawns): # pawns on each file or a neighbouring one
+        return pawns + _shift(pawns, 0, 1) + _shift(pawns, 0, -1)
+    blackAhead = np.cumsum(spread(blackPawns), axis=1) - spread(blackPawns) # black pawns on rows above, per square
+    whiteAhead = np.cumsum(spread(whitePawns)[:, ::-1], axis=1)[:, ::-1] - spread(whitePawns) # white pawns on rows below
+    rowBonus = PASSED_PAWN.reshape(1, 8, 1)
+    score += (whitePawns * (blackAhead == 0) * rowBonus).sum(axis=(1, 2))
+    score -= (blackPawns * (whiteAhead == 0) * rowBonus[:, ::-1]).sum(axis=(1, 2))
+    return score
+
+
+# material and piece-square tables, white minus black: (N,), the same numbers as chess_evaluation.evaluate
+def materialTerm(planes):
+    return np.einsum('npq,pq->n', planes.astype(np.int32), PIECE_SQUARE_ARRAY)
+
+
+# scores of a boardArray of positions, whiteToMove a (N,) bool array
+def evaluateBoards(boards, whiteToMove):
+    planes = encodeBoards(boards)
+    score = materialTerm(planes) + mobilityTerm(boards) + pawnStructureTerm(planes)
+    return np.where(whiteToMove, score, -score)
+
+
+# scores of a list of GameStates for their sides to move, as a (N,) int32 array
+def evaluateBatch(states):
+    if not states:
+        return np.zeros(0, dtype=np.int32)
+    return evaluateBoards(boardArray([gs.pieceBoards for gs in states]), np.array([gs.whiteToMove for gs in states]))
+
+
+def evaluate(gs):
+    return int(evaluateBatch([gs])[0])
+
+
+# scores of the positions after each of moves, for the side that made the move, in one batch
+# a search can order or cut its moves at the frontier with a single call
+def evaluateMoves(gs, moves):
+    boards = []
+    for move in moves:
+        gs.makeMove(move)
+        boards.append(list(gs.pieceBoards))
+        gs.undoMove()
+    if not boards:
+        return np.zeros(0, dtype=np.int32)
+    # the mover's side was to move before the move, so score it as if it still were
+    return evaluateBoards(boardArray(boards), np.full(len(boards), gs.whiteToMove))
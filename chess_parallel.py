@@ -0,0 +1,265 @@
+#Chess Parallel Search
+
+'''Spreads one search over a pool of worker processes, each searching part of the root moves'''
+'''The root moves are dealt out between the workers, each searches its share with its own Searcher,'''
+'''and the best move over all shares at the deepest depth they all finished is played'''
+'''Every root move score a share finds goes into a shared array by depth, and the shares search their root'''
+'''moves against the best of them at the same depth, so a share holding none of the best moves fails low instead'''
+'''of being searched with only its own moves as the bound; all but the first share also guess, ASPIRATION below'''
+'''the best score of a shallower depth, and are searched again without guessing when the guess was too high'''
+'''stop() reaches the workers through a shared event their searches poll, so a search can be cut short'''
+'''usage: python -m chess_parallel [--workers N] [--depth N] [--fen FEN [--time SECONDS]]'''
+
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess_engine
+import chess_search
+from chess_perft import POSITIONS
+
+ASPIRATION = 50 # centipawns below the best shallower score a root move must reach to be searched exactly
+
+_searcher = None # the worker process's own Searcher, kept between searches like a single-process game keeps one
+_position = None # and its GameState, loaded with each position sent (building a new one costs more than loading)
+_cancel = None # the ParallelSearcher's cancel event, set when the parent process stops the search
+_bounds = None # and its shared array of the best root move score any share has at each depth of the search
+
+
+# a Searcher that also gives up when the parent process stops the search, and at the root only looks for
+# moves better than the ones any share has already found at the same depth, or, when aspiration is set,
+# better than ASPIRATION below the best score found at any shallower depth
+class _WorkerSearcher(chess_search.Searcher):
+    aspiration = False
+
+    def checkLimits(self):
+        if _cancel.is_set():
+            raise chess_search.SearchTimeout()
+        chess_search.Searcher.checkLimits(self)
+
+    def rootBound(self, depth):
+        bound = _bounds[depth]
+        if self.aspiration and depth > 1:
+            guess = max(_bounds[1:depth])
+            if abs(guess) < chess_search.CHECKMATE - chess_search.MAX_PLY: # no guessing once mates show up
+                bound = max(bound, guess - ASPIRATION)
+        return bound
+
+    def postRootScore(self, depth, score):
+        with _bounds.get_lock():
+            if score > _bounds[depth]:
+                _bounds[depth] = score
+
+
+def _initWorker(ttSize, cancel, bounds):
+    global _searcher, _cancel, _bounds
+    _searcher = _WorkerSearcher(ttSize)
+    _cancel = cancel
+    _bounds = bounds
+
+
+# runs in a worker: searches the root moves of share only, guessing a root bound when aspiration is set
+# returns every completed iteration as (depth, best move, score, nodes, pv, failed low), all moves as notation
+# strings; an iteration that failed low against the bound has only an upper bound as its score and no pv
+# the position arrives as a GameState.snapshot(), which carries the repetition history along
+def _searchShare(snapshot, share, maxDepth, timeLimit, nodeLimit, aspiration):
+    global _position
+    if _position is None:
+        _position = chess_engine.GameState()
+    gs = _position
+    gs.loadSnapshot(snapshot)
+    rootMoves = [gs.moveFromNotation(notation) for notation in share]
+    iterations = []
+
+    def onIteration(result):
+        iterations.append((result.depth, result.bestMove.getChessNotation(), result.score, result.nodes,
+                           [move.getChessNotation() for move in result.pv], not result.pv))
+
+    _searcher.aspiration = aspiration
+    result = _searcher.search(gs, maxDepth, timeLimit, nodeLimit, onIteration, rootMoves)
+    return iterations, result.nodes
+
+
+class ParallelSearcher():
+    # workers defaults to one per CPU, each worker process keeps a Searcher with a ttSize table
+    def __init__(self, workers=None, ttSize=1 << 18):
+        self.workers = workers or os.cpu_count() or 1
+        # spawned, not forked: a fork from a thread (the UCI search thread) copies locks other threads hold,
+        # such as the one on stdin the UCI main thread waits in, and the worker hangs on it
+        context = multiprocessing.get_context("spawn")
+        self.cancel = context.Event() # set while the running search is stopped, search() clears it as it starts
+        self.bounds = context.Array('i', chess_search.MAX_PLY + 1) # by depth, search() resets it as it starts
+        self.pool = ProcessPoolExecutor(self.workers, context, initializer=_initWorker,
+                                        initargs=(ttSize, self.cancel, self.bounds))
+        # searches are numbered so a stop can name the search it is for, even one that has not started yet
+        self.lock = threading.Lock()
+        self.lastNumber = 0 # last number handed out by nextSearch()
+        self.running = 0 # number of the search running now, or of the last one
+        self.stopNumber = 0 # highest search number stopped so far
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown()
+
+    # a number for a search that is about to start, pass it to search() and to stop()
+    def nextSearch(self):
+        with self.lock:
+            self.lastNumber += 1
+            return self.lastNumber
+
+    # asks search number (by default the running one) to return the best move of the deepest depth every
+    # share finished; a search that has not started yet stops as soon as it does, a finished one is left alone
+    def stop(self, number=None):
+        with self.lock:
+            number = self.running if number is None else number
+            self.stopNumber = max(self.stopNumber, number)
+            if number == self.running:
+                self.cancel.set()
+
+    # same arguments and SearchResult as Searcher.search; the moves in the result belong to gs
+    # number comes from nextSearch(), for a caller that may stop the search before it has started
+    def search(self, gs, maxDepth=chess_search.MAX_PLY, timeLimit=None, nodeLimit=None, number=None):
+        if number is None:
+            number = self.nextSearch()
+        with self.lock: # a stop of an earlier search must not carry over to this one
+            self.running = number
+            if self.stopNumber >= number:
+                self.cancel.set()
+            else:
+                self.cancel.clear()
+        start = time.perf_counter()
+        moves = gs.legal_moves()
+        if not moves:
+            return chess_search.Searcher(1).search(gs, 1)
+        # deal the ordered moves out in turn so every share gets some of the likely best ones
+        ordered = chess_search.Searcher(1).orderMoves(gs, moves, None, 0)
+        shareCount = min(self.workers, len(ordered))
+        shares = [[move.getChessNotation() for move in ordered[i::shareCount]] for i in range(shareCount)]
+        snapshot = gs.snapshot()
+        self.bounds[:] = [-chess_search.INFINITE] * len(self.bounds)
+        shareLimit = nodeLimit // shareCount if nodeLimit else None
+        # the first share holds the likely best move, it gets no guess so its score is exact more often
+        futures = [self.pool.submit(_searchShare, snapshot, share, maxDepth, timeLimit, shareLimit, i > 0)
+                   for i, share in enumerate(shares)]
+        outcomes = [future.result() for future in futures]
+        nodes = sum(shareNodes for iterations, shareNodes in outcomes)
+        depth, best, doubtful = self.pickIteration([iterations for iterations, shareNodes in outcomes])
+        timeLeft = timeLimit - (time.perf_counter() - start) if timeLimit else None
+        if doubtful and not self.cancel.is_set() and (timeLeft is None or timeLeft > 0):
+            # a guess was too high: those shares again to the depth they stopped at, against exact bounds only
+            futures = {i: self.pool.submit(_searchShare, snapshot, shares[i], doubtful[i], timeLeft, shareLimit,
+                                           False) for i in doubtful}
+            for i, future in futures.items():
+                outcomes[i] = future.result()
+                nodes += outcomes[i][1]
+            depth, best, doubtful = self.pickIteration([iterations for iterations, shareNodes in outcomes])
+        seconds = time.perf_counter() - start
+        if best is None: # not even depth 1 finished everywhere
+            return chess_search.SearchResult(ordered[0], 0, 0, nodes, seconds, [])
+        pv = self.pvMoves(gs, best[4])
+        return chess_search.SearchResult(gs.moveFromNotation(best[1]), best[2], depth, nodes, seconds, pv)
+
+    # (depth, iteration, doubtful) of the best move over the shares' iterations, iteration None when there is none
+    # scores are only comparable at the same depth, so compare at the deepest depth every share finished;
+    # a share that stopped deepening on a forced mate, for or against, has an exact score, so it neither
+    # holds that depth down nor drops out, its last iteration is compared as it is
+    # an iteration that failed low only has an upper bound: it is out if an exact score at its depth is at least
+    # that high; when one is not (an aspiration guess was too high) the depth before is compared instead, and
+    # doubtful maps those shares to the deepest depth, to be searched again there
+    def pickIteration(self, shareIterations):
+        decided = [bool(iterations) and abs(iterations[-1][2]) > chess_search.CHECKMATE - chess_search.MAX_PLY
+                   for iterations in shareIterations]
+        openDepths = [iterations[-1][0] if iterations else 0
+                      for iterations, done in zip(shareIterations, decided) if not done]
+        deepest = min(openDepths) if openDepths else max(iterations[-1][0] for iterations in shareIterations)
+        doubtful = {}
+        for depth in range(deepest, 0, -1):
+            best = None
+            bounded = [] # (upper bound, share) of the iterations that failed low
+            for i, (iterations, done) in enumerate(zip(shareIterations, decided)):
+                if done:
+                    candidates = iterations[-1:]
+                else:
+                    candidates = [iteration for iteration in iterations if iteration[0] == depth]
+                for iteration in candidates:
+                    if iteration[5]:
+                        bounded.append((iteration[2], i))
+                    elif best is None or iteration[2] > best[2]:
+                        best = iteration
+            unresolved = [i for bound, i in bounded if best is None or bound > best[2]]
+            if depth == deepest:
+                doubtful = {i: deepest for i in unresolved}
+            if not unresolved and best is not None:
+                return depth, best, doubtful
+        return 0, None, doubtful
+
+    # turns a principal variation of notation strings back into Move objects, playing it out on gs and back
+    def pvMoves(self, gs, pvNotations):
+        pv = []
+        for notation in pvNotations:
+            move = gs.moveFromNotation(notation)
+            if move is None:
+                break
+            gs.makeMove(move)
+            pv.append(move)
+        for move in pv:
+            gs.undoMove()
+        gs.legal_moves() # puts the check/mate flags back
+        return pv
+
+
+# searches every perft suite position to a fixed depth, single-process and then in parallel
+# returns the overall speedup (single-process time / parallel time); the node count ratio printed with it
+# is the extra work splitting the root costs
+def benchmark(workers=None, depth=4, out=sys.stdout):
+    singleTotal = parallelTotal = 0.0
+    singleNodes = parallelNodes = 0
+    with ParallelSearcher(workers) as parallel:
+        parallel.search(chess_engine.GameState(), 1) # start the worker processes before timing anything
+        out.write("%d worker processes, depth %d\n" % (parallel.workers, depth))
+        for name, fen, expected in POSITIONS:
+            single = chess_search.Searcher().search(chess_engine.GameState.from_fen(fen), depth)
+            split = parallel.search(chess_engine.GameState.from_fen(fen), depth)
+            singleTotal += single.seconds
+            parallelTotal += split.seconds
+            singleNodes += single.nodes
+            parallelNodes += split.nodes
+            out.write("%-10s single %7.3fs %8d nodes %-6s  parallel %7.3fs %8d nodes %-6s  speedup %.2fx\n" % (
+                name, single.seconds, single.nodes, single.bestMove.getChessNotation(),
+                split.seconds, split.nodes, split.bestMove.getChessNotation(),
+                single.seconds / split.seconds if split.seconds else 0))
+    speedup = singleTotal / parallelTotal if parallelTotal else 0
+    out.write("total single %.3fs %d nodes  parallel %.3fs %d nodes (%.2fx)  speedup %.2fx\n" % (
+        singleTotal, singleNodes, parallelTotal, parallelNodes, parallelNodes / singleNodes if singleNodes else 0,
+        speedup))
+    return speedup
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="chess_parallel", description="parallel search for chess_engine")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--depth", type=int, default=4, help="fixed search depth")
+    parser.add_argument("--fen", default=None, help="search this position instead of running the benchmark")
+    parser.add_argument("--time", type=float, default=None, help="time limit in seconds with --fen")
+    args = parser.parse_args(argv)
+
+    if args.fen is None:
+        benchmark(args.workers, args.depth)
+        return 0
+
+    with ParallelSearcher(args.workers) as parallel:
+        print(parallel.search(chess_engine.GameState.from_fen(args.fen), args.depth, args.time))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
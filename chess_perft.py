@@ -0,0 +1,183 @@
+#Chess Perft
+
+'''Counts the leaf nodes of the legal move tree to a fixed depth (perft)'''
+'''Checks move generation against known node counts and measures its speed'''
+'''usage: python -m chess_perft [--suite] [--fen FEN] [--depth N] [--divide] [--no-bulk]'''
+'''       python -m chess_perft --movegen [--baseline FILE] [--count N]'''
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import timeit
+import types
+
+import chess_engine
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# standard perft test positions with their published node counts, by depth
+POSITIONS = [
+    ("start", START_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+]
+
+
+# number of leaf nodes depth plies below gs
+# with bulk counting the last ply is counted from the length of the move list instead of being played
+def perft(gs, depth, bulk=True):
+    if depth == 0:
+        return 1
+    if depth == 1 and bulk:
+        return len(gs.legalMoveCodes())
+    nodes = 0
+    for move in gs.legal_moves():
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1, bulk)
+        gs.undoMove()
+    return nodes
+
+
+# perft split by root move, for tracking a wrong count down to the move that causes it
+def divide(gs, depth, bulk=True):
+    results = []
+    for move in gs.legal_moves():
+        gs.makeMove(move)
+        results.append((move.getChessNotation(), perft(gs, depth - 1, bulk)))
+        gs.undoMove()
+    return results
+
+
+# runs perft and returns (nodes, seconds)
+def timedPerft(gs, depth, bulk=True):
+    start = time.perf_counter()
+    nodes = perft(gs, depth, bulk)
+    return nodes, time.perf_counter() - start
+
+
+# every suite position up to maxDepth, returns the number of wrong counts
+def runSuite(maxDepth=3, bulk=True, out=sys.stdout):
+    failures = 0
+    totalNodes = 0
+    totalTime = 0.0
+    for name, fen, expected in POSITIONS:
+        for depth in sorted(expected):
+            if depth > maxDepth:
+                break
+            nodes, seconds = timedPerft(chess_engine.GameState.from_fen(fen), depth, bulk)
+            totalNodes += nodes
+            totalTime += seconds
+            ok = nodes == expected[depth]
+            failures += not ok
+            out.write("%-10s depth %d  %10d nodes  %8.3fs  %9.0f nps  %s\n" % (
+                name, depth, nodes, seconds, nodes / seconds if seconds else 0,
+                "ok" if ok else "FAIL (expected %d)" % expected[depth]))
+    out.write("total %d nodes in %.3fs, %.0f nps, %d failed\n" % (
+        totalNodes, totalTime, totalNodes / totalTime if totalTime else 0, failures))
+    return failures
+
+
+# the list-based chess_engine.py the bitboard generator replaced, loaded as a module of its own
+# path is a copy of that file, by default it is read from the repository's first commit with git
+def loadBaseline(path=None):
+    if path is None:
+        here = os.path.dirname(os.path.abspath(__file__))
+        root = subprocess.run(["git", "rev-list", "--max-parents=0", "HEAD"], cwd=here, check=True,
+                              capture_output=True, text=True).stdout.split()[-1]
+        source = subprocess.run(["git", "show", root + ":chess_engine.py"], cwd=here, check=True,
+                                capture_output=True, text=True).stdout
+        path = root + ":chess_engine.py"
+    else:
+        with open(path) as f:
+            source = f.read()
+    baseline = types.ModuleType("baseline_engine")
+    exec(compile(source, path, "exec"), baseline.__dict__)
+    return baseline
+
+
+# times one full move generation per suite position, the baseline's checkPinsandChecks() and getalltheMoves()
+# against generateMoves(), which skips the move cache and returns packed codes; returns the overall speedup
+# turning the codes into Move objects, which legal_moves() does on top, is timed and printed on its own
+def movegenBench(baseline, count=2000, out=sys.stdout):
+    totalBase = totalNew = totalMoves = 0.0
+    for name, fen, expected in POSITIONS:
+        gs = chess_engine.GameState.from_fen(fen)
+        old = baseline.GameState()
+        old.board = [list(row) for row in gs.board]
+        old.whiteToMove = gs.whiteToMove
+        old.whiteKingLocation, old.blackKingLocation = gs.whiteKingLocation, gs.blackKingLocation
+
+        def baseGenerate():
+            old.inCheck, old.pins, old.checks = old.checkPinsandChecks()
+            return old.getalltheMoves()
+
+        baseTime = min(timeit.repeat(baseGenerate, number=count, repeat=3)) / count
+        newTime = min(timeit.repeat(gs.generateMoves, number=count, repeat=3)) / count
+        codes = gs.generateMoves()
+        movesTime = min(timeit.repeat(lambda: chess_engine.unpackMoves(codes), number=count, repeat=3)) / count
+        totalBase += baseTime
+        totalNew += newTime
+        totalMoves += movesTime
+        out.write("%-10s baseline %7.1fus (%2d moves)  bitboard %7.1fus (%2d moves, %5.1fus of Move objects)  %5.2fx\n"
+                  % (name, baseTime * 1e6, len(baseGenerate()), newTime * 1e6, len(codes), movesTime * 1e6,
+                     baseTime / newTime))
+    out.write("total baseline %.1fus  bitboard %.1fus  %.2fx faster\n" % (
+        totalBase * 1e6, totalNew * 1e6, totalBase / totalNew))
+    out.write("building the Move objects from the codes takes %.1fus more, %.2fx faster with them\n" % (
+        totalMoves * 1e6, totalBase / (totalNew + totalMoves)))
+    return totalBase / totalNew
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="chess_perft", description="perft node counts for chess_engine")
+    parser.add_argument("--suite", action="store_true", help="check every standard test position")
+    parser.add_argument("--fen", default=START_FEN, help="position to count from (default: start position)")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print the node count below every root move")
+    parser.add_argument("--no-bulk", dest="bulk", action="store_false",
+                        help="play out the last ply instead of counting the move list")
+    parser.add_argument("--movegen", action="store_true",
+                        help="time move generation against the original list-based generator")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="the list-based chess_engine.py for --movegen (default: from the first git commit)")
+    parser.add_argument("--count", type=int, default=2000, help="generations per position for --movegen")
+    args = parser.parse_args(argv)
+
+    if args.movegen:
+        try:
+            baseline = loadBaseline(args.baseline)
+        except (OSError, subprocess.CalledProcessError) as e:
+            parser.error("cannot load the baseline engine: %s" % e)
+        movegenBench(baseline, args.count)
+        return 0
+
+    if args.suite:
+        return 1 if runSuite(args.depth, args.bulk) else 0
+
+    gs = chess_engine.GameState.from_fen(args.fen)
+    start = time.perf_counter()
+    if args.divide:
+        results = divide(gs, args.depth, args.bulk)
+        for notation, count in results:
+            print("%s: %d" % (notation, count))
+        nodes = sum(count for notation, count in results)
+    else:
+        nodes = perft(gs, args.depth, args.bulk)
+    seconds = time.perf_counter() - start
+    print("nodes %d  time %.3fs  nps %.0f" % (nodes, seconds, nodes / seconds if seconds else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
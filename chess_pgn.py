@@ -0,0 +1,316 @@
+#Chess PGN
+
+'''Reads PGN game archives as a stream and replays every game through GameState'''
+'''SAN moves ("Nbd7", "exd8=Q+", "O-O") are decoded against the legal move list of the position'''
+'''The positions can be fanned out to a pool of worker processes for evaluation, a bounded number of batches'''
+'''at a time, so millions of games go through in constant memory; each stage reports its own throughput'''
+'''usage: python -m chess_pgn FILE [--workers N] [--depth N] [--min-ply N] [--limit GAMES] [--out FILE]'''
+'''       [--cache FILE]'''
+
+import argparse
+import collections
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess_cache
+import chess_engine
+import chess_epd
+import chess_search
+
+_TAG = re.compile(r'\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+# comments, variation brackets, NAGs and everything else (move numbers, moves, results)
+_MOVETEXT_TOKEN = re.compile(r'\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|[^\s(){};]+')
+_MOVE_NUMBER = re.compile(r'^\d+\.+')
+_SAN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+# generator over (headers, movetext) for every game in source, a file name (.gz is fine) or any iterable of lines
+# only the game being read is held in memory
+def readGames(source):
+    lines = chess_epd.openLines(source) if isinstance(source, str) else source
+    headers = {}
+    movetext = []
+    try:
+        for line in lines:
+            line = line.strip()
+            if line.startswith("%"): # escaped line
+                continue
+            if line.startswith("["):
+                if movetext: # the tags of the next game
+                    yield headers, "\n".join(movetext)
+                    headers, movetext = {}, []
+                tag = _TAG.match(line)
+                if tag:
+                    headers[tag.group(1)] = tag.group(2).replace('\\"', '"').replace("\\\\", "\\")
+            elif line:
+                movetext.append(line)
+        if movetext or headers:
+            yield headers, "\n".join(movetext)
+    finally:
+        if isinstance(source, str):
+            lines.close()
+
+
+# the SAN moves of the main line, without move numbers, comments, NAGs, variations or the result
+def sanMoves(movetext):
+    depth = 0
+    for token in _MOVETEXT_TOKEN.findall(movetext):
+        first = token[0]
+        if first == "(":
+            depth += 1
+        elif first == ")":
+            depth -= 1
+        elif depth or first in "{;$":
+            continue
+        else:
+            token = _MOVE_NUMBER.sub("", token)
+            if token in RESULTS:
+                return
+            if token and token != "e.p.":
+                yield token
+
+
+# the legal move a SAN string stands for, ValueError if there is none or more than one
+def parseSAN(gs, san):
+    text = san.rstrip("+#!?")
+    moves = gs.legal_moves()
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        endCol = 6 if len(text) == 3 else 2
+        for move in moves:
+            if move.isCastleMove and move.endCol == endCol:
+                return move
+        raise ValueError("illegal castle %s" % san)
+    parts = _SAN.match(text)
+    if parts is None:
+        raise ValueError("not a SAN move: %s" % san)
+    piece, fromFile, fromRank, end, promotion = parts.groups()
+    piece = piece or 'P'
+    endRow, endCol = chess_engine.Move.ranksToRows[end[1]], chess_engine.Move.filesToCols[end[0]]
+    found = None
+    for move in moves:
+        if (move.endRow != endRow or move.endCol != endCol or move.pieceMoved[1] != piece
+                or (fromFile and move.getRankFile(move.startRow, move.startCol)[0] != fromFile)
+                or (fromRank and move.getRankFile(move.startRow, move.startCol)[1] != fromRank)
+                or (move.isPawnPromotion and move.promotionChoice != (promotion or 'Q'))):
+            continue
+        if found is not None:
+            raise ValueError("ambiguous move %s" % san)
+        found = move
+    if found is None:
+        raise ValueError("illegal move %s" % san)
+    return found
+
+
+# SAN for a legal move of gs, with the file or rank added only when another piece of the same kind could go there
+def toSAN(gs, move):
+    if move.isCastleMove:
+        san = "O-O" if move.endCol == 6 else "O-O-O"
+    else:
+        start = move.getRankFile(move.startRow, move.startCol)
+        capture = move.pieceCaptured != "--"
+        if move.pieceMoved[1] == 'P':
+            san = (start[0] + "x" if capture else "") + move.getRankFile(move.endRow, move.endCol)
+            if move.isPawnPromotion:
+                san += "=" + move.promotionChoice
+        else:
+            rivals = [other for other in gs.legal_moves() if other.pieceMoved == move.pieceMoved and
+                      other.endRow == move.endRow and other.endCol == move.endCol and other != move]
+            disambiguation = ""
+            if rivals:
+                if all(other.startCol != move.startCol for other in rivals):
+                    disambiguation = start[0]
+                elif all(other.startRow != move.startRow for other in rivals):
+                    disambiguation = start[1]
+                else:
+                    disambiguation = start
+            san = move.pieceMoved[1] + disambiguation + ("x" if capture else "") + move.getRankFile(move.endRow, move.endCol)
+    gs.makeMove(move)
+    replies = gs.legal_moves()
+    if gs.inCheck:
+        san += "#" if not replies else "+"
+    gs.undoMove()
+    return san
+
+
+# plays a game out on a GameState, generator over (gs, move) with gs still in the position before move
+# starts from the FEN tag when the game has one, ValueError on a move that cannot be played
+def replayGame(headers, movetext):
+    gs = chess_engine.GameState.from_fen(headers["FEN"]) if "FEN" in headers else chess_engine.GameState()
+    for san in sanMoves(movetext):
+        move = parseSAN(gs, san)
+        yield gs, move
+        gs.makeMove(move)
+
+
+class PipelineStats():
+    # items and seconds per stage, seconds include the stages upstream of it so report() subtracts them
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.errors = 0
+
+    # wraps the iterable of one stage, stages are registered upstream first
+    def timed(self, name, iterable):
+        stage = self.stages.setdefault(name, [0, 0.0])
+        return self.count(stage, iter(iterable))
+
+    def count(self, stage, iterator):
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                stage[1] += time.perf_counter() - start
+                return
+            stage[0] += 1
+            stage[1] += time.perf_counter() - start
+            yield item
+
+    def report(self, out=sys.stderr):
+        upstream = 0.0
+        for name, (items, seconds) in self.stages.items():
+            own = max(seconds - upstream, 0.0)
+            out.write("%-9s %9d items %9.3fs %11.1f items/s\n" % (name, items, own, items / own if own else 0))
+            upstream = seconds
+        if self.errors:
+            out.write("%d games stopped early on a move that could not be played\n" % self.errors)
+
+
+_searcher = None # each worker process's own Searcher
+_cache = None # and its connection to the analysis cache, if there is one
+
+
+def _initWorker(ttSize, cachePath=None):
+    global _searcher, _cache
+    _searcher = chess_search.Searcher(ttSize)
+    _cache = chess_cache.AnalysisCache(cachePath) if cachePath else None
+
+
+# evaluates a batch of positions: (fen, best move in SAN, score for the side to move)
+# depth 0 is the static evaluation, done for the whole batch in one vectorized call
+# searches go through the analysis cache when the worker has one: positions already searched that deep are
+# read back, and the new ones are written in one transaction at the end of the batch
+def _analyseBatch(fens, depth):
+    global _searcher
+    if _searcher is None: # running in the main process
+        _searcher = chess_search.Searcher()
+    gs = chess_engine.GameState() # loaded with each position in turn, building a GameState costs more than evaluating it
+    if depth <= 0:
+        import chess_numpy_evaluation # numpy is only needed here, the engine and book stay without it
+        boards, sides = [], []
+        for fen in fens:
+            gs.loadFEN(fen)
+            boards.append(list(gs.pieceBoards))
+            sides.append(gs.whiteToMove)
+        scores = chess_numpy_evaluation.evaluateBoards(chess_numpy_evaluation.boardArray(boards), sides)
+        return [(fen, None, int(score)) for fen, score in zip(fens, scores)]
+    results = []
+    searched = []
+    for fen in fens:
+        gs.loadFEN(fen)
+        entry = _cache.lookup(gs, depth) if _cache is not None else None
+        if entry is not None:
+            move = gs.moveFromNotation(entry.move) if entry.move else None
+            results.append((fen, toSAN(gs, move) if move else None, entry.score))
+            continue
+        result = _searcher.search(gs, depth)
+        searched.append((gs.zobristKey, result))
+        results.append((fen, toSAN(gs, result.bestMove) if result.bestMove else None, result.score))
+    if _cache is not None and searched:
+        _cache.storeMany(searched)
+    return results
+
+
+class AnalysisPipeline():
+    # read games -> replay them -> evaluate every position from minPly on -> results, in that order
+    # workers=0 evaluates in this process; otherwise at most maxPending batches of batchSize are in flight
+    # cachePath names a chess_cache file: positions searched to depth before are read from it, not searched
+    def __init__(self, workers=0, depth=2, minPly=0, batchSize=64, maxPending=None, ttSize=1 << 16,
+                 cachePath=None):
+        self.workers = workers
+        self.depth = depth
+        self.minPly = minPly
+        self.batchSize = batchSize
+        self.maxPending = maxPending or 2 * max(workers, 1)
+        self.ttSize = ttSize
+        self.cachePath = cachePath
+        self.stats = PipelineStats()
+
+    def games(self, source, limit=None):
+        for number, game in enumerate(readGames(source)):
+            if limit is not None and number >= limit:
+                return
+            yield game
+
+    def positions(self, games):
+        for headers, movetext in games:
+            try:
+                for gs, move in replayGame(headers, movetext):
+                    if len(gs.moveLog) + gs.startPly >= self.minPly:
+                        yield gs.to_fen()
+            except ValueError:
+                self.stats.errors += 1
+
+    def batches(self, positions):
+        batch = []
+        for fen in positions:
+            batch.append(fen)
+            if len(batch) == self.batchSize:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def evaluations(self, batches):
+        if not self.workers:
+            _initWorker(self.ttSize, self.cachePath)
+            for batch in batches:
+                yield from _analyseBatch(batch, self.depth)
+            return
+        with ProcessPoolExecutor(self.workers, initializer=_initWorker, initargs=(self.ttSize, self.cachePath)) as pool:
+            pending = collections.deque()
+            for batch in batches:
+                pending.append(pool.submit(_analyseBatch, batch, self.depth))
+                if len(pending) >= self.maxPending: # wait for the oldest batch before reading any further
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    # generator over (fen, best move, score) for every position of every game in source
+    def run(self, source, limit=None):
+        stats = self.stats
+        games = stats.timed("parse", self.games(source, limit))
+        positions = stats.timed("replay", self.positions(games))
+        return stats.timed("evaluate", self.evaluations(self.batches(positions)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="chess_pgn", description="evaluate every position of a PGN archive")
+    parser.add_argument("file", help="PGN file, may be gzipped")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes (default: evaluate in this process)")
+    parser.add_argument("--depth", type=int, default=2, help="search depth, 0 for the vectorized static evaluation only")
+    parser.add_argument("--min-ply", dest="minPly", type=int, default=0, help="skip the positions before this ply")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many games")
+    parser.add_argument("--out", default=None, help="write the results here as EPD (default: standard output)")
+    parser.add_argument("--cache", default=None, help="analysis cache file, positions already in it are skipped")
+    args = parser.parse_args(argv)
+
+    pipeline = AnalysisPipeline(args.workers, args.depth, args.minPly, cachePath=args.cache)
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        for fen, san, score in pipeline.run(args.file, args.limit):
+            operations = {"ce": [str(score)]}
+            if san:
+                operations["bm"] = [san]
+            out.write(chess_epd.formatEPD(fen, operations) + "\n")
+    finally:
+        if args.out:
+            out.close()
+    pipeline.stats.report()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
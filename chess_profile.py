@@ -0,0 +1,216 @@
+#Chess Profile
+
+'''Opt-in instrumentation of the move generators and the search: call counts, time and memory per function'''
+'''Profiler.enable() swaps the listed methods for timing wrappers and disable() puts the originals back,'''
+'''so a GameState or Searcher that is not being profiled runs exactly the code it always did'''
+'''Results export as JSON, for keeping per release, or as collapsed stacks for flamegraph.pl and speedscope'''
+'''usage: python -m chess_profile [--fen FEN] [--depth N | --perft N] [--allocations] [--json FILE] [--collapsed FILE]'''
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import chess_engine
+import chess_perft
+import chess_search
+from chess_zobrist import TranspositionTable
+
+# (owner, attribute) of everything instrumented by default, methods the class does not have are skipped
+MOVE_GENERATION = [(chess_engine.GameState, name) for name in (
+    "makeMove", "undoMove", "loadDerivedState", "legal_moves", "generateMoves", "getValidMoves",
+    "setPinAndCheckMasks", "getalltheMoves", "movesFrom", "generateTo", "checkPinsandChecks", "kingInCheck",
+    "updateKingRays", "squareUnderAttack", "attackersTo", "isSquareAttacked",
+    "getPawnSetMoves", "getPawnMoves", "getKnightMoves", "getBishopMoves", "getRookMoves", "getQueenMoves",
+    "getKingMoves", "getCastleMoves", "getEnpassantMoves", "addMoves")]
+SEARCH = [(chess_search.Searcher, name) for name in ("search", "negamax", "quiescence", "orderMoves")] + [
+    (chess_search, "evaluate"), (TranspositionTable, "probe"), (TranspositionTable, "store")]
+TARGETS = MOVE_GENERATION + SEARCH
+
+
+def targetName(owner, attribute):
+    return "%s.%s" % (getattr(owner, "__name__", owner), attribute)
+
+
+class Profiler():
+    # not thread safe: profile one search or one perft at a time
+    # allocations traces memory with tracemalloc, which makes everything several times slower
+    def __init__(self, targets=TARGETS, allocations=False):
+        self.targets = [(owner, attribute) for owner, attribute in targets if attribute in vars(owner)]
+        self.allocations = allocations
+        self.originals = []
+        self.attached = []
+        self.reset()
+
+    def reset(self):
+        self.stats = {} # name -> [calls, inclusive seconds, own seconds, net bytes allocated]
+        self.stacks = {} # collapsed stack "a;b;c" -> own seconds
+        self.frames = [] # [name, collapsed stack, seconds spent in children] per open call
+        self.active = {} # name -> calls of it open on the stack, so recursion is only counted once inclusively
+        self.seconds = 0.0
+
+    @property
+    def enabled(self):
+        return bool(self.originals)
+
+    def enable(self):
+        if self.enabled:
+            return
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.startedTracing = True
+        else:
+            self.startedTracing = False
+        for owner, attribute in self.targets:
+            original = vars(owner)[attribute]
+            self.originals.append((owner, attribute, original))
+            setattr(owner, attribute, self.wrap(targetName(owner, attribute), original))
+        self.enabledAt = time.perf_counter()
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.seconds += time.perf_counter() - self.enabledAt
+        for owner, attribute, original in reversed(self.originals):
+            setattr(owner, attribute, original)
+        self.originals = []
+        for gs in self.attached: # back to the plain generators
+            self.rebind(gs)
+        self.attached = []
+        if self.startedTracing:
+            tracemalloc.stop()
+
+    # a GameState binds its piece move generators once, in moveFunctions, when it is made; attach points those
+    # of a GameState made before enable() at the wrappers, and disable() points them back
+    def attach(self, gs):
+        self.rebind(gs)
+        self.attached.append(gs)
+
+    def rebind(self, gs):
+        gs.moveFunctions = {piece: getattr(gs, method.__name__) for piece, method in gs.moveFunctions.items()}
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def wrap(self, name, function):
+        stats = self.stats.setdefault(name, [0, 0.0, 0.0, 0])
+        frames = self.frames
+        active = self.active
+        clock = time.perf_counter
+        memory = tracemalloc.get_traced_memory if self.allocations else None
+
+        def wrapper(*args, **kwargs):
+            # a function calling itself is folded into one frame, so negamax depth does not multiply the stacks
+            if not frames:
+                stack = name
+            elif frames[-1][0] == name:
+                stack = frames[-1][1]
+            else:
+                stack = frames[-1][1] + ";" + name
+            frame = [name, stack, 0.0]
+            frames.append(frame)
+            active[name] = active.get(name, 0) + 1
+            before = memory()[0] if memory else 0
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                frames.pop()
+                active[name] -= 1
+                own = elapsed - frame[2]
+                stats[0] += 1
+                if not active[name]:
+                    stats[1] += elapsed
+                stats[2] += own
+                if memory:
+                    stats[3] += memory()[0] - before
+                self.stacks[stack] = self.stacks.get(stack, 0.0) + own
+                if frames:
+                    frames[-1][2] += elapsed
+        wrapper.__wrapped__ = function
+        wrapper.__name__ = getattr(function, "__name__", name)
+        return wrapper
+
+    # [(name, calls, inclusive seconds, own seconds, bytes)], the most own time first, uncalled functions left out
+    def rows(self):
+        rows = [(name, calls, total, own, allocated) for name, (calls, total, own, allocated) in self.stats.items()
+                if calls]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows
+
+    def report(self, out=sys.stdout):
+        out.write("%-36s %10s %10s %10s %8s%s\n" % ("function", "calls", "total ms", "own ms", "own %",
+                                                    " %12s" % "bytes" if self.allocations else ""))
+        ownTotal = sum(row[3] for row in self.rows()) or 1.0
+        for name, calls, total, own, allocated in self.rows():
+            out.write("%-36s %10d %10.1f %10.1f %7.1f%%%s\n" % (
+                name, calls, 1000 * total, 1000 * own, 100 * own / ownTotal,
+                " %12d" % allocated if self.allocations else ""))
+
+    # everything as one JSON-ready dict; metadata (a release name, a commit, the position) is stored alongside
+    def toDict(self, metadata=None):
+        return {
+            "metadata": dict(metadata or {}),
+            "python": platform.python_version(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seconds": self.seconds,
+            "allocations": self.allocations,
+            "functions": {name: {"calls": calls, "seconds": total, "ownSeconds": own, "bytes": allocated}
+                          for name, calls, total, own, allocated in self.rows()},
+        }
+
+    def writeJSON(self, out, metadata=None):
+        json.dump(self.toDict(metadata), out, indent=2, sort_keys=True)
+        out.write("\n")
+
+    # "frame;frame;frame count" lines, counts in microseconds of own time, for flamegraph.pl or speedscope
+    def writeCollapsed(self, out):
+        for stack, seconds in sorted(self.stacks.items()):
+            micros = int(seconds * 1e6)
+            if micros:
+                out.write("%s %d\n" % (stack, micros))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="chess_profile", description="profile a search or a perft run")
+    parser.add_argument("--fen", default=None, help="position (default: the start position)")
+    parser.add_argument("--depth", type=int, default=4, help="search depth")
+    parser.add_argument("--perft", type=int, default=None, help="profile perft to this depth instead of a search")
+    parser.add_argument("--allocations", action="store_true", help="also trace memory allocated per function")
+    parser.add_argument("--json", default=None, help="write the stats here as JSON")
+    parser.add_argument("--collapsed", default=None, help="write collapsed stacks here for a flame graph")
+    parser.add_argument("--release", default=None, help="release name stored in the JSON metadata")
+    args = parser.parse_args(argv)
+
+    gs = chess_engine.GameState.from_fen(args.fen) if args.fen else chess_engine.GameState()
+    profiler = Profiler(allocations=args.allocations)
+    with profiler:
+        profiler.attach(gs)
+        if args.perft is not None:
+            result = "perft %d: %d nodes" % (args.perft, chess_perft.perft(gs, args.perft))
+        else:
+            result = repr(chess_search.Searcher().search(gs, args.depth))
+    print(result)
+    print("%.3fs profiled" % profiler.seconds)
+    profiler.report()
+    metadata = {"fen": gs.startFEN, "depth": args.depth, "perft": args.perft}
+    if args.release:
+        metadata["release"] = args.release
+    if args.json:
+        with open(args.json, "w") as out:
+            profiler.writeJSON(out, metadata)
+    if args.collapsed:
+        with open(args.collapsed, "w") as out:
+            profiler.writeCollapsed(out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
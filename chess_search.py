@@ -0,0 +1,296 @@
+#Chess Search
+
+'''Finds the best move for the side to move in a GameState'''
+'''Negamax alpha-beta with iterative deepening and quiescence search, a transposition table,'''
+'''and MVV-LVA, killer move and history heuristic move ordering, all within a time budget'''
+'''With a chess_tablebase.Tablebase, positions the tables cover are scored exactly instead of searched'''
+
+import time
+
+from chess_engine import CAPTURE_SCORES, MOVE_QUIET, MOVE_QUIET_MASK, historyKey
+from chess_evaluation import evaluate
+from chess_zobrist import TranspositionTable
+
+CHECKMATE = 100000
+MAX_PLY = 64
+INFINITE = CHECKMATE + 1
+EXACT, LOWERBOUND, UPPERBOUND = 0, 1, 2 # transposition table score types
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchResult():
+    def __init__(self, bestMove, score, depth, nodes, seconds, pv):
+        self.bestMove = bestMove
+        self.score = score # centipawns for the side to move
+        self.depth = depth # last fully searched depth
+        self.nodes = nodes
+        self.seconds = seconds
+        self.nps = int(nodes / seconds) if seconds > 0 else nodes
+        self.pv = pv # principal variation, a list of Move
+
+    def __repr__(self):
+        return "SearchResult(move=%s, score=%d, depth=%d, nodes=%d, nps=%d, pv=%s)" % (
+            self.bestMove.getChessNotation() if self.bestMove else None, self.score, self.depth,
+            self.nodes, self.nps, " ".join(move.getChessNotation() for move in self.pv))
+
+
+# mate scores count plies from the root, the table stores them counted from the node instead
+def scoreToTable(score, ply):
+    if score > CHECKMATE - MAX_PLY:
+        return score + ply
+    if score < -CHECKMATE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    if score > CHECKMATE - MAX_PLY:
+        return score - ply
+    if score < -CHECKMATE + MAX_PLY:
+        return score + ply
+    return score
+
+
+# score of a tablebase result (1 win, -1 loss, 0 draw for the side to move, plies to mate) at ply
+# a mate further away than MAX_PLY still scores above any evaluation, it just is not reported as a mate
+def tablebaseScore(outcome, plies, ply):
+    if outcome > 0:
+        return CHECKMATE - ply - plies
+    if outcome < 0:
+        return -CHECKMATE + ply + plies
+    return 0
+
+
+class Searcher():
+    # keeps its transposition table, killers and history between searches of the same game
+    def __init__(self, ttSize=1 << 18, tablebase=None):
+        self.tt = TranspositionTable(ttSize)
+        self.tablebase = tablebase
+        self.history = {} # historyKey (piece and end square) -> how often that quiet move caused a cutoff
+        self.stopped = False
+        self.rootMoveIDs = None
+        self.resetStats()
+
+    def resetStats(self):
+        self.nodes = 0
+        self.killers = [[None, None] for ply in range(MAX_PLY + 1)] # move IDs of quiet cutoff moves
+        self.pvTable = [[] for ply in range(MAX_PLY + 1)]
+
+    # asks a running search to return the best move found so far
+    def stop(self):
+        self.stopped = True
+
+    # a score the root must beat at this iteration depth for its result to matter, -INFINITE when nothing
+    # else is searching (chess_parallel's workers return the best root move score any share has at that depth)
+    def rootBound(self, depth):
+        return -INFINITE
+
+    # called with the exact score of every root move that raises alpha, for rootBound elsewhere
+    def postRootScore(self, depth, score):
+        pass
+
+    # iterative deepening: depth 1, 2, 3 ... until maxDepth, the time limit or the node limit runs out
+    # onIteration(result) is called after every completed depth
+    # rootMoves limits the search to some of the legal moves at the root (used to split the root between processes)
+    def search(self, gs, maxDepth=MAX_PLY, timeLimit=None, nodeLimit=None, onIteration=None, rootMoves=None):
+        self.resetStats()
+        self.stopped = False
+        self.startTime = time.perf_counter()
+        self.deadline = self.startTime + timeLimit if timeLimit else None
+        self.nodeLimit = nodeLimit
+        rootLength = len(gs.moveLog)
+        result = SearchResult(None, 0, 0, 0, 0.0, [])
+        if rootMoves is None:
+            self.rootMoveIDs = None
+            rootMoves = gs.legal_moves()
+        else:
+            self.rootMoveIDs = set(move.moveID for move in rootMoves)
+        if rootMoves:
+            result.bestMove = rootMoves[0] # something to play even if depth 1 does not finish
+        if self.tablebase is not None and self.rootMoveIDs is None:
+            ranked = self.tablebase.rankMoves(gs)
+            if ranked: # the tables know the answer, nothing to search
+                outcome, plies, move = ranked[0]
+                seconds = time.perf_counter() - self.startTime
+                result = SearchResult(move, tablebaseScore(outcome, plies, 0), 1, 0, seconds, [move])
+                if onIteration is not None:
+                    onIteration(result)
+                return result
+        for depth in range(1, min(maxDepth, MAX_PLY) + 1):
+            self.rootDepth = depth
+            try:
+                score = self.negamax(gs, depth, -INFINITE, INFINITE, 0)
+            except SearchTimeout:
+                while len(gs.moveLog) > rootLength: # unwind the moves the aborted search was in
+                    gs.undoMove()
+                break
+            seconds = time.perf_counter() - self.startTime
+            pv = list(self.pvTable[0])
+            result = SearchResult(pv[0] if pv else result.bestMove, score, depth, self.nodes, seconds, pv)
+            if onIteration is not None:
+                onIteration(result)
+            if not rootMoves or abs(score) > CHECKMATE - MAX_PLY: # no moves, or a forced mate found
+                break
+            # the next depth would take several times longer, don't start what cannot finish
+            if self.deadline and time.perf_counter() + 2 * seconds > self.deadline:
+                break
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - self.startTime
+        result.nps = int(result.nodes / result.seconds) if result.seconds > 0 else result.nodes
+        gs.legal_moves() # puts the root's check/mate flags back
+        return result
+
+    def checkLimits(self):
+        if self.stopped or (self.deadline and time.perf_counter() > self.deadline) or (
+                self.nodeLimit and self.nodes >= self.nodeLimit):
+            raise SearchTimeout()
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkLimits()
+        self.pvTable[ply] = []
+        if ply > 0 and gs.repetitionCounts.get(gs.zobristKey, 0) > 1:
+            return 0 # a repeated position is a draw as far as the search is concerned
+        # 100 plies without a capture or pawn move is a draw too, unless the last of them gave mate
+        if ply > 0 and gs.halfmoveClock >= 100 and not (gs.inCheck and not gs.hasLegalMove()):
+            return 0
+        if ply >= MAX_PLY:
+            return evaluate(gs)
+        if self.tablebase is not None and ply > 0:
+            found = self.tablebase.probe(gs)
+            if found is not None:
+                return tablebaseScore(found[0], found[1], ply)
+
+        # look deeper when in check, so checks near the horizon are never misjudged
+        inCheck = gs.inCheck # kept up to date by every makeMove and undoMove
+        if inCheck:
+            depth += 1
+        if depth <= 0:
+            return self.quiescence(gs, alpha, beta, ply)
+
+        hashID = None
+        entry = self.tt.probe(gs.zobristKey)
+        if entry is not None:
+            entryDepth, entryScore, entryType, hashID = entry
+            if ply > 0 and entryDepth >= depth:
+                entryScore = scoreFromTable(entryScore, ply)
+                if entryType == EXACT or (entryType == LOWERBOUND and entryScore >= beta) or (
+                        entryType == UPPERBOUND and entryScore <= alpha):
+                    return entryScore
+
+        if ply == 0: # the root is visited once an iteration, its moves are all generated and filtered
+            moves = gs.legal_moves()
+            if self.rootMoveIDs is not None:
+                moves = [move for move in moves if move.moveID in self.rootMoveIDs]
+            moves = self.orderMoves(gs, moves, hashID, ply)
+        else: # stage by stage, a cutoff before the quiet moves never generates them
+            moves = gs.orderedMoves(hashID, self.killers[ply], self.history)
+
+        originalAlpha = alpha
+        bestScore = -INFINITE
+        bestMove = None
+        for move in moves:
+            if ply == 0: # moves that cannot beat the bound fail low fast, the root then returns no pv
+                bound = self.rootBound(self.rootDepth)
+                if bound > alpha:
+                    alpha = originalAlpha = bound
+                    self.pvTable[0] = []
+            gs.makeMove(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+                    if ply == 0:
+                        self.postRootScore(self.rootDepth, score)
+                    if alpha >= beta:
+                        if move.code & MOVE_QUIET_MASK == MOVE_QUIET:
+                            self.storeKiller(move, ply)
+                            key = historyKey(move)
+                            self.history[key] = self.history.get(key, 0) + depth * depth
+                        break
+        if bestMove is None:
+            return -CHECKMATE + ply if inCheck else 0 # checkmate or stalemate
+
+        if bestScore <= originalAlpha:
+            entryType = UPPERBOUND
+        elif bestScore >= beta:
+            entryType = LOWERBOUND
+        else:
+            entryType = EXACT
+        # the best move goes in as its packed moveID, the table does not keep Move objects alive
+        self.tt.store(gs.zobristKey, (depth, scoreToTable(bestScore, ply), entryType, bestMove.moveID), depth)
+        return bestScore
+
+    # only captures and promotions are searched past the horizon, until the position is quiet
+    def quiescence(self, gs, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkLimits()
+        if ply >= MAX_PLY:
+            return evaluate(gs)
+        inCheck = gs.inCheck # kept up to date by every makeMove and undoMove
+        if not inCheck: # the side to move can usually do at least as well as standing still
+            standPat = evaluate(gs)
+            if standPat >= beta:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+        # every evasion has to be looked at when in check, standing still is not an option; otherwise only
+        # captures and promotions are generated, and the quiet moves only when there are none of those
+        searched = False
+        for move in gs.orderedMoves(quiets=inCheck):
+            searched = True
+            gs.makeMove(move)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        if not searched:
+            if inCheck:
+                return -CHECKMATE + ply
+            if not gs.hasLegalMove(): # not even a quiet move: stalemate
+                return 0
+        return alpha
+
+    def storeKiller(self, move, ply):
+        killers = self.killers[ply]
+        if killers[0] != move.moveID:
+            killers[1] = killers[0]
+            killers[0] = move.moveID
+
+    # hash move first, then captures by MVV-LVA (most valuable victim, least valuable attacker),
+    # promotions, the two killer moves of this ply, and the rest by history score
+    def orderMoves(self, gs, moves, hashID, ply):
+        killers = self.killers[ply]
+        history = self.history
+        scored = []
+        for move in moves:
+            code = move.code
+            if move.moveID == hashID:
+                score = 10000000
+            elif code & MOVE_QUIET_MASK != MOVE_QUIET: # captures, then promotions
+                score = CAPTURE_SCORES[(code >> 12) & 0x3FF]
+            elif move.moveID == killers[0]:
+                score = 800002
+            elif move.moveID == killers[1]:
+                score = 800001
+            else:
+                score = history.get(historyKey(move), 0)
+            scored.append((score, move))
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        return [move for score, move in scored]
+
+
+# one-off search with a fresh Searcher
+def findBestMove(gs, maxDepth=MAX_PLY, timeLimit=1.0, nodeLimit=None):
+    return Searcher().search(gs, maxDepth, timeLimit, nodeLimit)
@@ -0,0 +1,424 @@
+#Chess Server
+
+'''Hosts many games at once from one asyncio process, over a local TCP socket or stdin/stdout'''
+'''The protocol is one JSON object per line: requests carry "cmd" and an "id" that the response echoes,'''
+'''and engine replies are pushed as {"event": "reply"} once they are ready; they are computed in an executor'''
+'''so the event loop keeps serving every other session meanwhile'''
+'''usage: python -m chess_server serve [--port N | --stdio] [--workers N] [--executor process|thread]'''
+'''       python -m chess_server loadtest [--port N] [--sessions N] [--moves N] [--depth N]'''
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import chess_engine
+import chess_search
+
+DEFAULT_PORT = 8765
+SESSION_MOVE_CACHE = 64 # move-cache slots per session GameState, a game rarely revisits many positions
+MAX_SESSIONS = 10000
+MAX_DEPTH = 6 # deepest engine search a session may ask for
+MAX_TIME = 10.0 # and the longest, in seconds
+ENGINE_TT_SIZE = 1 << 16
+
+_engine = threading.local() # each executor worker (process or thread) keeps its own Searcher and GameState
+
+
+# runs in the executor: the engine's move for the position of a GameState.snapshot()
+def _engineReply(snapshot, depth, timeLimit):
+    searcher = getattr(_engine, "searcher", None)
+    if searcher is None:
+        searcher = _engine.searcher = chess_search.Searcher(ENGINE_TT_SIZE)
+    gs = getattr(_engine, "gs", None)
+    if gs is None:
+        gs = _engine.gs = chess_engine.GameState()
+    gs.loadSnapshot(snapshot) # reloading one GameState is cheaper than building one per reply
+    result = searcher.search(gs, depth, timeLimit)
+    return result.bestMove.getChessNotation() if result.bestMove else None
+
+
+# bytes held by the containers and moves of obj, each counted once; strings, numbers and bound methods
+# are shared between sessions (or belong to the class) and are left out
+def _ownedBytes(obj, seen):
+    if id(obj) in seen or obj is None or isinstance(obj, (str, int, float, bool, type)) or callable(obj):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_ownedBytes(key, seen) + _ownedBytes(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_ownedBytes(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += _ownedBytes(obj.__dict__, seen)
+    elif hasattr(obj, "__slots__"):
+        size += sum(_ownedBytes(getattr(obj, name, None), seen) for name in obj.__slots__)
+    return size
+
+
+class Session():
+    def __init__(self, sessionID, fen, engineSide, depth, timeLimit):
+        self.id = sessionID
+        self.gs = chess_engine.GameState.from_fen(fen, moveCacheSize=SESSION_MOVE_CACHE)
+        self.engineSide = engineSide # 'w', 'b' or None for two human players
+        self.depth = depth
+        self.timeLimit = timeLimit
+        self.thinking = False # an engine reply is being computed
+        self.memory = None # memoryBytes() as of the last stats, None once the game has changed since
+
+    # walks the session's whole object graph, which grows with the game, so only stats asks for it
+    def memoryBytes(self):
+        if self.memory is None:
+            self.memory = _ownedBytes(self, set())
+        return self.memory
+
+    def engineToMove(self):
+        return self.engineSide == ('w' if self.gs.whiteToMove else 'b') and self.status() == "active"
+
+    def status(self):
+        moves = self.gs.legal_moves()
+        if self.gs.checkmate:
+            return "checkmate"
+        if self.gs.stalemate:
+            return "stalemate"
+        if self.gs.isThreefoldRepetition():
+            return "repetition"
+        if self.gs.halfmoveClock >= 100:
+            return "50 moves"
+        return "active" if moves else "over"
+
+    # what the client needs after every change: the position, whose turn, the legal moves and the game status
+    def state(self):
+        return {"session": self.id, "fen": self.gs.to_fen(), "status": self.status(),
+                "legal": [move.getChessNotation() for move in self.gs.legal_moves()]}
+
+
+class ChessServer():
+    def __init__(self, workers=None, executor="process", maxSessions=MAX_SESSIONS):
+        if executor == "process":
+            self.executor = ProcessPoolExecutor(workers)
+        else:
+            self.executor = ThreadPoolExecutor(workers)
+        self.maxSessions = maxSessions
+        self.sessions = {}
+        self.sessionIDs = itertools.count(1)
+        self.movesServed = 0
+        self.startTime = time.perf_counter()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    # one connection, a JSON request per line; send(obj) writes one JSON line back
+    async def serveConnection(self, reader, send):
+        owned = [] # sessions created on this connection are closed with it
+        pending = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = None
+                try:
+                    request = json.loads(line)
+                    response = self.handle(request, send, owned, pending)
+                except (ValueError, KeyError, TypeError) as error:
+                    response = {"ok": False, "error": str(error)}
+                    if isinstance(request, dict):
+                        response["id"] = request.get("id")
+                send(response)
+        finally:
+            for task in pending:
+                task.cancel()
+            for sessionID in owned:
+                self.sessions.pop(sessionID, None)
+
+    def handle(self, request, send, owned, pending):
+        command = request["cmd"]
+        response = {"id": request.get("id"), "ok": True}
+        if command == "new":
+            if len(self.sessions) >= self.maxSessions:
+                raise ValueError("server full, %d sessions" % len(self.sessions))
+            engineSide = request.get("engine")
+            if engineSide not in (None, 'w', 'b'):
+                raise ValueError("engine must be 'w', 'b' or null")
+            fen = request.get("fen", chess_engine.GameState().startFEN)
+            chess_engine.checkFEN(fen)
+            depth = request.get("depth", 2)
+            if isinstance(depth, bool) or not isinstance(depth, int) or depth < 1:
+                raise ValueError("depth must be a whole number of plies, at least 1")
+            timeLimit = request.get("time")
+            if timeLimit is not None and (isinstance(timeLimit, bool) or not isinstance(timeLimit, (int, float))
+                                          or not 0 < timeLimit <= MAX_TIME):
+                raise ValueError("time must be a number of seconds above 0 and at most %g" % MAX_TIME)
+            session = Session(next(self.sessionIDs), fen, engineSide, min(depth, MAX_DEPTH), timeLimit)
+            self.sessions[session.id] = session
+            owned.append(session.id)
+            response.update(session.state())
+            self.startEngine(session, send, pending)
+        elif command == "move":
+            session = self.session(request)
+            if session.thinking or session.engineToMove():
+                raise ValueError("not your move")
+            move = session.gs.moveFromNotation(request["move"])
+            if move is None:
+                raise ValueError("illegal move %s" % request["move"])
+            session.gs.makeMove(move)
+            self.movesServed += 1
+            session.memory = None
+            response.update(session.state())
+            self.startEngine(session, send, pending)
+        elif command == "state":
+            response.update(self.session(request).state())
+        elif command == "undo":
+            session = self.session(request)
+            if session.thinking:
+                raise ValueError("engine is thinking")
+            session.gs.undoMove()
+            # the move taken back was the engine's reply: take back the player's move before it too
+            if session.engineSide == ('w' if session.gs.whiteToMove else 'b') and session.gs.moveLog:
+                session.gs.undoMove()
+            session.memory = None
+            response.update(session.state())
+            self.startEngine(session, send, pending) # back at the engine's first move when it plays white
+        elif command == "close":
+            session = self.session(request)
+            del self.sessions[session.id]
+            if session.id in owned:
+                owned.remove(session.id)
+        elif command == "stats":
+            response.update(self.stats())
+        else:
+            raise ValueError("unknown command %s" % command)
+        return response
+
+    def session(self, request):
+        session = self.sessions.get(request["session"])
+        if session is None:
+            raise ValueError("no session %s" % request["session"])
+        return session
+
+    # memory is counted here, not after every move, and only for the sessions that changed since the last stats
+    def stats(self):
+        sizes = [session.memoryBytes() for session in self.sessions.values()]
+        seconds = time.perf_counter() - self.startTime
+        return {"sessions": len(sizes), "memory": sum(sizes), "memoryPerSession": sum(sizes) // len(sizes) if sizes else 0,
+                "maxSessionMemory": max(sizes, default=0), "moves": self.movesServed,
+                "movesPerSecond": self.movesServed / seconds if seconds else 0}
+
+    def startEngine(self, session, send, pending):
+        if session.engineToMove():
+            session.thinking = True
+            task = asyncio.ensure_future(self.engineMove(session, send))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+    # asks the executor for the engine's move and pushes it to the client when it is ready
+    # a search that fails is pushed as {"event": "error"} instead, so the client is not left waiting for the reply
+    async def engineMove(self, session, send):
+        snapshot = session.gs.snapshot()
+        loop = asyncio.get_running_loop()
+        try:
+            notation = await loop.run_in_executor(self.executor, _engineReply, snapshot, session.depth,
+                                                  session.timeLimit)
+        except Exception as error:
+            if session.id in self.sessions:
+                send({"event": "error", "session": session.id, "error": "engine failed: %r" % error})
+            return
+        finally:
+            session.thinking = False
+        if session.id not in self.sessions:
+            return
+        move = session.gs.moveFromNotation(notation) if notation else None
+        if move is not None:
+            session.gs.makeMove(move)
+            self.movesServed += 1
+            session.memory = None
+        event = {"event": "reply", "move": notation}
+        event.update(session.state())
+        send(event)
+
+    async def serveTCP(self, host, port):
+        async def onConnection(reader, writer):
+            def send(obj):
+                writer.write((json.dumps(obj) + "\n").encode())
+            try:
+                await self.serveConnection(reader, send)
+            finally:
+                writer.close()
+        server = await asyncio.start_server(onConnection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def serveStdio(self):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        def send(obj):
+            sys.stdout.write(json.dumps(obj) + "\n")
+            sys.stdout.flush()
+        await self.serveConnection(reader, send)
+
+
+class Client():
+    # a connection to the server; request() waits for the response with the same id, engine replies (and engine
+    # errors) resolve the future expectReply() returned for their session
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.requestIDs = itertools.count(1)
+        self.responses = {}
+        self.replies = {} # session -> future of its next engine reply
+        self.listener = asyncio.ensure_future(self.listen())
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=DEFAULT_PORT):
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+        return cls(reader, writer)
+
+    async def listen(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message.get("event") in ("reply", "error"):
+                future = self.replies.pop(message["session"], None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+            else:
+                future = self.responses.pop(message.get("id"), None)
+                if future is not None:
+                    future.set_result(message)
+
+    async def request(self, command, **fields):
+        fields["cmd"] = command
+        fields["id"] = next(self.requestIDs)
+        future = asyncio.get_running_loop().create_future()
+        self.responses[fields["id"]] = future
+        self.writer.write((json.dumps(fields) + "\n").encode())
+        return await future
+
+    def expectReply(self, session):
+        future = asyncio.get_running_loop().create_future()
+        self.replies[session] = future
+        return future
+
+    async def close(self):
+        self.listener.cancel()
+        self.writer.close()
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+# plays `sessions` games at once against the server's engine, random legal moves for the client side,
+# and reports moves per second (client move plus engine reply) and the latency from sending a move to the reply
+async def loadTest(host="127.0.0.1", port=DEFAULT_PORT, sessions=100, moves=20, depth=1, connections=4,
+                   out=sys.stdout):
+    clients = [await Client.connect(host, port) for i in range(connections)]
+    latencies = []
+    errors = []
+    started = 0
+    allStarted = asyncio.Event() # every "new" has been answered
+    statsTaken = asyncio.Event() # the server's stats are sampled, sessions may close
+
+    async def play(client, rng):
+        nonlocal started
+        state = await client.request("new", engine='b', depth=depth)
+        started += 1
+        if started == sessions:
+            allStarted.set()
+        if not state["ok"]:
+            errors.append(state["error"])
+            return
+        session = state["session"]
+        for i in range(moves):
+            if state["status"] != "active":
+                break
+            reply = client.expectReply(session)
+            start = time.perf_counter()
+            response = await client.request("move", session=session, move=rng.choice(state["legal"]))
+            if not response["ok"]:
+                errors.append(response["error"])
+                break
+            if response["status"] != "active":
+                break
+            state = await reply
+            if state.get("event") == "error":
+                errors.append(state["error"])
+                break
+            latencies.append(time.perf_counter() - start)
+        await statsTaken.wait()
+        await client.request("close", session=session)
+
+    start = time.perf_counter()
+    statsBefore = (await clients[0].request("stats"))
+    games = [play(clients[i % connections], random.Random(i)) for i in range(sessions)]
+    # the server's view once every session has been created and before any is closed
+    async def sample():
+        if sessions > 0:
+            await allStarted.wait()
+        stats = await clients[0].request("stats")
+        statsTaken.set()
+        return stats
+    sampled = asyncio.ensure_future(sample())
+    await asyncio.gather(*games)
+    seconds = time.perf_counter() - start
+    during = await sampled
+    for client in clients:
+        await client.close()
+
+    played = 2 * len(latencies)
+    out.write("%d sessions, %d moves (client + engine) in %.2fs: %.1f moves/s\n" % (
+        sessions, played, seconds, played / seconds if seconds else 0))
+    out.write("latency move->reply  p50 %.1fms  p99 %.1fms  max %.1fms\n" % (
+        1000 * _percentile(latencies, 0.5), 1000 * _percentile(latencies, 0.99), 1000 * max(latencies, default=0)))
+    out.write("server: %d sessions open, %d bytes, %d bytes per session (sampled with every session open)\n" % (
+        during["sessions"], during["memory"], during["memoryPerSession"]))
+    if errors:
+        out.write("%d errors, first: %s\n" % (len(errors), errors[0]))
+    return {"moves": played, "seconds": seconds, "p50": _percentile(latencies, 0.5),
+            "p99": _percentile(latencies, 0.99), "errors": len(errors), "statsBefore": statsBefore, "stats": during}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="chess_server", description="asyncio chess game server")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    serve = sub.add_parser("serve", help="run the server")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("--stdio", action="store_true", help="speak the protocol on stdin/stdout instead of TCP")
+    serve.add_argument("--workers", type=int, default=None, help="engine workers (default: one per CPU)")
+    serve.add_argument("--executor", choices=("process", "thread"), default="process")
+    serve.add_argument("--max-sessions", dest="maxSessions", type=int, default=MAX_SESSIONS)
+    load = sub.add_parser("loadtest", help="play many games against a running server")
+    load.add_argument("--host", default="127.0.0.1")
+    load.add_argument("--port", type=int, default=DEFAULT_PORT)
+    load.add_argument("--sessions", type=int, default=100)
+    load.add_argument("--moves", type=int, default=20, help="client moves per session")
+    load.add_argument("--depth", type=int, default=1, help="engine search depth")
+    load.add_argument("--connections", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    if args.mode == "loadtest":
+        result = asyncio.run(loadTest(args.host, args.port, args.sessions, args.moves, args.depth, args.connections))
+        return 1 if result["errors"] else 0
+    server = ChessServer(args.workers, args.executor, args.maxSessions)
+    try:
+        asyncio.run(server.serveStdio() if args.stdio else server.serveTCP(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
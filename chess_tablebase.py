@@ -0,0 +1,367 @@
+#Chess Tablebases
+
+'''Endgame tablebases for king and queen, king and rook, and king and pawn against a lone king'''
+'''Each table holds, for every placement of the three pieces and side to move, the distance to mate in plies,'''
+'''found by retrograde analysis: from the mates backwards, one ply at a time, with the engine's bitboard attacks'''
+'''Tables are stored as zlib-compressed blocks and probed through an LRU cache of decoded blocks,'''
+'''so a probe costs one dictionary lookup once the block is warm'''
+'''usage: python -m chess_tablebase generate [--dir DIR]'''
+'''       python -m chess_tablebase probe --fen FEN [--dir DIR]'''
+
+import argparse
+import collections
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+from chess_bitboard import KING_ATTACKS, PAWN_ATTACKS, PIECE_INDEX, WHITE, bishopAttacks, rookAttacks
+
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+TABLES = ("KQK", "KRK", "KPK") # in generation order, KPK promotes into the other two
+ENTRIES = 2 * 64 * 64 * 64 # side to move, strong king, weak king, strong piece
+BLOCK_ENTRIES = 4096
+CACHE_BLOCKS = 64
+MAGIC = b"CTB1"
+HEADER = struct.Struct(">4s4sIII") # magic, table name, entries, entries per block, blocks
+
+# entry values: 0 is a draw, 255 an impossible placement, anything else is 1 + plies to mate,
+# a win for the side to move when the plies are odd and a loss when they are even (0 plies: checkmated)
+DRAW = 0
+ILLEGAL = 255
+WIN, LOSS = 1, -1
+
+
+# index of a placement, stm 0 when the side with the extra piece is to move
+def positionIndex(stm, strongKing, weakKing, piece):
+    return ((stm * 64 + strongKing) * 64 + weakKing) * 64 + piece
+
+
+def decodeIndex(index):
+    return index >> 18, (index >> 12) & 63, (index >> 6) & 63, index & 63
+
+
+# (WIN, LOSS or DRAW, plies to mate) for the side to move from an entry value, None for ILLEGAL
+def decodeValue(value):
+    if value == ILLEGAL:
+        return None
+    if value == DRAW:
+        return DRAW, 0
+    plies = value - 1
+    return (LOSS if plies % 2 == 0 else WIN), plies
+
+
+# squares the strong piece attacks, a pawn is always white and moves up the board (towards row 0)
+def pieceAttacks(kind, sq, occupied):
+    if kind == 'Q':
+        return rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+    if kind == 'R':
+        return rookAttacks(sq, occupied)
+    return PAWN_ATTACKS[WHITE][sq]
+
+
+def isLegal(stm, strongKing, weakKing, piece, kind):
+    if strongKing == weakKing or piece == strongKing or piece == weakKing:
+        return False
+    if KING_ATTACKS[strongKing] >> weakKing & 1:
+        return False
+    if kind == 'P' and (piece >> 3 == 0 or piece >> 3 == 7):
+        return False
+    occupied = 1 << strongKing | 1 << weakKing | 1 << piece
+    # with the strong side to move, the weak king must not already be in check
+    return not (stm == 0 and pieceAttacks(kind, piece, occupied) >> weakKing & 1)
+
+
+# builds one table; tables maps the names of the tables already built to their values, for promotions
+# returns a bytearray of ENTRIES values
+def generate(name, tables=None, out=None):
+    kind = name[1]
+    table = bytearray(ENTRIES)
+    counts = array('B', bytes(ENTRIES)) # legal moves of each position not yet known to lead to a win for the opponent
+    levels = collections.defaultdict(list) # plies -> positions decided at that distance, to be propagated back
+    exits = collections.defaultdict(list) # plies -> (position, opponent's outcome) for moves that leave the table
+
+    # forward pass: which placements are legal, how many moves each has, and the mates
+    for index in range(ENTRIES):
+        stm, strongKing, weakKing, piece = decodeIndex(index)
+        if not isLegal(stm, strongKing, weakKing, piece, kind):
+            table[index] = ILLEGAL
+            continue
+        occupied = 1 << strongKing | 1 << weakKing | 1 << piece
+        count = 0
+        if stm == 0:
+            kingTargets = KING_ATTACKS[strongKing] & ~occupied & ~KING_ATTACKS[weakKing]
+            count += bin(kingTargets).count("1")
+            if kind == 'P':
+                ahead = piece - 8
+                if not occupied >> ahead & 1:
+                    if ahead >> 3 == 0: # promotion: to a queen or rook the game goes on in that table
+                        count += 4
+                        for promoted in ("KQK", "KRK"):
+                            value = tables[promoted][positionIndex(1, strongKing, weakKing, ahead)]
+                            if value != DRAW:
+                                exits[value - 1].append((index, decodeValue(value)[0]))
+                    else:
+                        count += 1
+                        if piece >> 3 == 6 and not occupied >> (piece - 16) & 1:
+                            count += 1
+            else:
+                count += bin(pieceAttacks(kind, piece, occupied) & ~occupied).count("1")
+        else:
+            attacked = KING_ATTACKS[strongKing] | pieceAttacks(kind, piece, occupied & ~(1 << weakKing))
+            kingTargets = KING_ATTACKS[weakKing] & ~attacked & ~(1 << strongKing)
+            count = bin(kingTargets).count("1") # taking the piece draws, it stays counted and never resolves
+            if count == 0 and pieceAttacks(kind, piece, occupied) >> weakKing & 1:
+                table[index] = 1 # checkmated
+                levels[0].append(index)
+        counts[index] = count
+
+    # backward pass: a position is won at n + 1 plies once one move reaches a loss at n,
+    # and lost at n + 1 once the last of its moves is found to reach a win, the longest one being n
+    plies = 0
+    while plies in levels or any(level >= plies for level in exits):
+        decided = [(index, decodeValue(table[index])[0]) for index in levels.pop(plies, ())]
+        for index, outcome in exits.pop(plies, ()):
+            resolve(table, counts, levels, index, outcome, plies)
+        for index, outcome in decided:
+            for previous in predecessors(index, kind):
+                if table[previous] != ILLEGAL:
+                    resolve(table, counts, levels, previous, outcome, plies)
+        plies += 1
+        if out is not None and plies % 8 == 0:
+            out.write("%s: %d plies\n" % (name, plies))
+    return table
+
+
+# one move of the undecided position index reaches a position with outcome for the opponent at plies
+def resolve(table, counts, levels, index, outcome, plies):
+    if table[index] != DRAW:
+        return
+    if outcome == LOSS:
+        table[index] = plies + 2
+        levels[plies + 1].append(index)
+    else:
+        counts[index] -= 1
+        if counts[index] == 0:
+            table[index] = plies + 2
+            levels[plies + 1].append(index)
+
+
+# positions one move before index within the same table: the side that is not to move takes its move back
+def predecessors(index, kind):
+    stm, strongKing, weakKing, piece = decodeIndex(index)
+    occupied = 1 << strongKing | 1 << weakKing | 1 << piece
+    found = []
+    if stm == 1: # the strong side moved last
+        for sq in _squares(KING_ATTACKS[strongKing] & ~occupied):
+            found.append(positionIndex(0, sq, weakKing, piece))
+        if kind == 'P':
+            behind = piece + 8
+            if behind >> 3 <= 6 and not occupied >> behind & 1:
+                found.append(positionIndex(0, strongKing, weakKing, behind))
+                if piece >> 3 == 4 and not occupied >> (piece + 16) & 1:
+                    found.append(positionIndex(0, strongKing, weakKing, piece + 16))
+        else:
+            for sq in _squares(pieceAttacks(kind, piece, occupied) & ~occupied):
+                found.append(positionIndex(0, strongKing, weakKing, sq))
+    else:
+        for sq in _squares(KING_ATTACKS[weakKing] & ~occupied):
+            found.append(positionIndex(1, strongKing, sq, piece))
+    return found
+
+
+def _squares(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def tablePath(directory, name):
+    return os.path.join(directory, name + ".ctb")
+
+
+# compressed file: header, block offsets, then each block of BLOCK_ENTRIES values deflated on its own
+def writeTable(path, name, table):
+    blocks = [zlib.compress(bytes(table[i:i + BLOCK_ENTRIES]), 9) for i in range(0, len(table), BLOCK_ENTRIES)]
+    offsets = [0]
+    for block in blocks:
+        offsets.append(offsets[-1] + len(block))
+    with open(path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, name.encode().ljust(4), len(table), BLOCK_ENTRIES, len(blocks)))
+        out.write(struct.pack(">%dI" % len(offsets), *offsets))
+        for block in blocks:
+            out.write(block)
+
+
+def generateAll(directory=DEFAULT_DIRECTORY, out=sys.stderr):
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    for name in TABLES:
+        start = time.perf_counter()
+        tables[name] = generate(name, tables, out)
+        writeTable(tablePath(directory, name), name, tables[name])
+        wins = sum(1 for value in tables[name] if value not in (DRAW, ILLEGAL) and value % 2 == 0)
+        longest = max(value - 1 for value in tables[name] if value != ILLEGAL)
+        out.write("%s: %d wins for the side to move, longest mate %d plies, %.1fs, %d bytes\n" % (
+            name, wins, longest, time.perf_counter() - start, os.path.getsize(tablePath(directory, name))))
+
+
+class TableFile():
+    # an open table file, blocks are read and decompressed on demand
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        magic, name, self.entries, self.blockEntries, blocks = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC:
+            self.file.close()
+            raise ValueError("%s is not a tablebase file" % path)
+        self.name = name.decode().strip()
+        self.offsets = struct.unpack(">%dI" % (blocks + 1), self.file.read(4 * (blocks + 1)))
+        self.dataStart = self.file.tell()
+
+    def readBlock(self, block):
+        self.file.seek(self.dataStart + self.offsets[block])
+        return zlib.decompress(self.file.read(self.offsets[block + 1] - self.offsets[block]))
+
+    def close(self):
+        self.file.close()
+
+
+class Tablebase():
+    # the tables found in directory; at most cacheBlocks decoded blocks are kept, least recently used dropped first
+    def __init__(self, directory=DEFAULT_DIRECTORY, cacheBlocks=CACHE_BLOCKS):
+        self.files = {}
+        for name in TABLES:
+            if os.path.exists(tablePath(directory, name)):
+                self.files[name] = TableFile(tablePath(directory, name))
+        self.cacheBlocks = cacheBlocks
+        self.cache = collections.OrderedDict() # (table, block) -> bytes
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        for tableFile in self.files.values():
+            tableFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def value(self, name, index):
+        tableFile = self.files[name]
+        key = (name, index // tableFile.blockEntries)
+        block = self.cache.get(key)
+        if block is None:
+            self.misses += 1
+            block = tableFile.readBlock(key[1])
+            self.cache[key] = block
+            if len(self.cache) > self.cacheBlocks:
+                self.cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self.cache.move_to_end(key)
+        return block[index % tableFile.blockEntries]
+
+    # (table name, index) of the position in gs, None when no table covers it
+    # a position where black has the extra piece is looked up with the board turned round and the colours swapped
+    def locate(self, gs):
+        if bin(gs.occupied).count("1") != 3:
+            return None
+        boards = gs.pieceBoards
+        for strong, weak in ((0, 6), (6, 0)):
+            for kind in "QRP":
+                name = "K%sK" % kind
+                pieceBoard = boards[strong + PIECE_INDEX['w' + kind]]
+                if pieceBoard and name in self.files:
+                    strongKing = boards[strong + PIECE_INDEX['wK']].bit_length() - 1
+                    weakKing = boards[weak + PIECE_INDEX['wK']].bit_length() - 1
+                    piece = pieceBoard.bit_length() - 1
+                    stm = 0 if gs.whiteToMove == (strong == 0) else 1
+                    if strong == 6:
+                        strongKing, weakKing, piece = strongKing ^ 56, weakKing ^ 56, piece ^ 56
+                    return name, positionIndex(stm, strongKing, weakKing, piece)
+        return None
+
+    # (WIN, LOSS or DRAW, plies to mate) for the side to move in gs, None when no table covers it
+    # a lone king against a lone king, knight or bishop is a draw without a table
+    def probe(self, gs):
+        pieces = bin(gs.occupied).count("1")
+        if pieces > 3:
+            return None
+        if self.isBareDraw(gs):
+            return DRAW, 0
+        found = self.locate(gs)
+        if found is None:
+            return None
+        return decodeValue(self.value(*found))
+
+    def isBareDraw(self, gs):
+        boards = gs.pieceBoards
+        for i in (PIECE_INDEX['wP'], PIECE_INDEX['wR'], PIECE_INDEX['wQ']):
+            if boards[i] or boards[i + 6]:
+                return False
+        return True
+
+    # every legal move of gs with the outcome for the side to move and the plies to mate after it, best first:
+    # the quickest win, then draws, then the slowest loss; None when the position is not in the tables
+    def rankMoves(self, gs):
+        if self.probe(gs) is None:
+            return None
+        ranked = []
+        for move in gs.legal_moves():
+            gs.makeMove(move)
+            reply = self.probe(gs)
+            gs.undoMove()
+            if reply is None: # cannot happen with all three tables present
+                continue
+            outcome, plies = reply
+            ranked.append((-outcome, plies + 1 if outcome != DRAW else 0, move))
+        ranked.sort(key=lambda item: (-item[0], item[1] if item[0] == WIN else -item[1]))
+        return ranked
+
+    # the move that keeps the best outcome by the shortest (or, losing, the longest) way, None outside the tables
+    def bestMove(self, gs):
+        ranked = self.rankMoves(gs)
+        return ranked[0][2] if ranked else None
+
+
+# a Tablebase of the tables in directory, None when none have been generated there
+def openDefault(directory=DEFAULT_DIRECTORY):
+    if not any(os.path.exists(tablePath(directory, name)) for name in TABLES):
+        return None
+    return Tablebase(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="chess_tablebase", description="generate and probe endgame tablebases")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    build = sub.add_parser("generate", help="build KQK, KRK and KPK")
+    build.add_argument("--dir", default=DEFAULT_DIRECTORY)
+    probe = sub.add_parser("probe", help="look up a position")
+    probe.add_argument("--fen", required=True)
+    probe.add_argument("--dir", default=DEFAULT_DIRECTORY)
+    args = parser.parse_args(argv)
+
+    if args.mode == "generate":
+        generateAll(args.dir)
+        return 0
+    import chess_engine
+    gs = chess_engine.GameState.from_fen(args.fen)
+    with Tablebase(args.dir) as tablebase:
+        found = tablebase.probe(gs)
+        if found is None:
+            print("not in the tables")
+            return 1
+        names = {WIN: "win", LOSS: "loss", DRAW: "draw"}
+        print("%s, mate in %d plies" % (names[found[0]], found[1]) if found[0] != DRAW else "draw")
+        for outcome, plies, move in tablebase.rankMoves(gs) or ():
+            print("%s %s %d" % (move.getChessNotation(), names[outcome], plies))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
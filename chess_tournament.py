@@ -0,0 +1,399 @@
+#Chess Tournament
+
+'''Headless self-play matches between two engines, many games at once in worker processes'''
+'''Every opening of a shuffled suite is played twice with the colours swapped; games are adjudicated on mate,'''
+'''stalemate, threefold repetition, the 50-move rule, bare kings and a ply limit, and the match ends with the'''
+'''Elo difference, its 95% error bars, an SPRT verdict and games per hour'''
+'''An engine is "internal" (this tree's Searcher, in the worker process), "uci:DIR" (python -m chess_engine uci'''
+'''run in another checkout, for testing one version against another) or "cmd:COMMAND" (any UCI engine)'''
+'''usage: python -m chess_tournament [--engine-a SPEC] [--engine-b SPEC] [--games N] [--workers N]'''
+'''       [--nodes N | --time SECONDS | --depth N] [--openings FILE] [--sprt ELO0 ELO1] [--pgn FILE]'''
+
+import argparse
+import atexit
+import math
+import os
+import queue
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import chess_engine
+import chess_epd
+import chess_search
+
+# a few main lines, in UCI notation from the start position, when no opening file is given
+DEFAULT_OPENINGS = (
+    "e2e4 e7e5 g1f3 b8c6", "e2e4 c7c5 g1f3 d7d6", "e2e4 e7e6 d2d4 d7d5", "e2e4 c7c6 d2d4 d7d5",
+    "d2d4 d7d5 c2c4 e7e6", "d2d4 g8f6 c2c4 e7e6", "d2d4 g8f6 c2c4 g7g6", "c2c4 e7e5 b1c3 g8f6",
+    "g1f3 d7d5 g2g3 g8f6", "e2e4 e7e5 f1c4 g8f6", "e2e4 d7d5 e4d5 d8d5", "d2d4 d7d5 g1f3 g8f6",
+)
+MAX_PLIES = 300 # a game still going after this many plies is a draw
+TT_SIZE = 1 << 16
+UCI_TIMEOUT = 60.0 # seconds an external engine may take to answer, on top of the move time, before it forfeits
+
+
+# an external engine that did not answer within UCI_TIMEOUT
+class UCITimeout(RuntimeError):
+    pass
+
+
+# an external engine whose process ended, or never started
+class UCIExited(RuntimeError):
+    pass
+
+
+# the openings as FENs: every position of an EPD/FEN file, or DEFAULT_OPENINGS played out
+def loadOpenings(path=None):
+    if path is not None:
+        return [fen for fen, operations in chess_epd.readPositions(path)]
+    openings = []
+    for line in DEFAULT_OPENINGS:
+        gs = chess_engine.GameState()
+        for notation in line.split():
+            gs.makeMove(gs.moveFromNotation(notation))
+        openings.append(gs.to_fen())
+    return openings
+
+
+# the reason the game is over, None while it goes on
+def adjudicate(gs, maxPlies=MAX_PLIES):
+    moves = gs.legal_moves()
+    if not moves:
+        return "checkmate" if gs.checkmate else "stalemate"
+    if gs.isThreefoldRepetition():
+        return "repetition"
+    if gs.halfmoveClock >= 100:
+        return "50 moves"
+    if bin(gs.occupied).count("1") <= 3 and not any(
+            gs.pieceBoards[i] for i in (0, 3, 4, 6, 9, 10)): # no pawn, rook or queen: nobody can mate
+        return "insufficient material"
+    if len(gs.moveLog) >= maxPlies:
+        return "ply limit"
+    return None
+
+
+class InternalPlayer():
+    # this tree's engine, with a fresh transposition table every game
+    def __init__(self, spec):
+        self.spec = spec
+
+    def newGame(self):
+        self.searcher = chess_search.Searcher(TT_SIZE)
+
+    def bestMove(self, gs, limits):
+        result = self.searcher.search(gs, limits.get("depth", chess_search.MAX_PLY), limits.get("time"),
+                                      limits.get("nodes"))
+        return result.bestMove
+
+    def close(self):
+        pass
+
+
+class UCIPlayer():
+    # an engine in a subprocess, spoken to over UCI
+    # its output is read on a thread into a queue, so waiting for an answer can give up after a timeout
+    def __init__(self, spec, command, cwd=None):
+        self.spec = spec
+        try:
+            self.process = subprocess.Popen(command, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        except OSError as error:
+            raise UCIExited("engine %s could not start: %s" % (spec, error))
+        self.lines = queue.Queue()
+        threading.Thread(target=self.readLines, daemon=True).start()
+        try:
+            self.send("uci")
+            self.waitFor("uciok")
+        except RuntimeError: # UCIExited or UCITimeout
+            self.kill()
+            raise
+
+    def send(self, line):
+        try:
+            self.process.stdin.write(line + "\n")
+            self.process.stdin.flush()
+        except OSError: # the pipe broke because the engine exited
+            raise UCIExited("engine %s exited" % self.spec)
+
+    def readLines(self):
+        for line in self.process.stdout:
+            self.lines.put(line)
+        self.lines.put("") # the engine exited
+
+    # the first line starting with prefix; a dead engine raises UCIExited, one silent for timeout seconds
+    # (UCI_TIMEOUT by default) raises UCITimeout
+    def waitFor(self, prefix, timeout=None):
+        timeout = UCI_TIMEOUT if timeout is None else timeout
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                line = self.lines.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                raise UCITimeout("engine %s sent no %s within %gs" % (self.spec, prefix, timeout))
+            if not line:
+                raise UCIExited("engine %s exited" % self.spec)
+            if line.startswith(prefix):
+                return line.split()
+
+    def newGame(self):
+        self.send("ucinewgame")
+        self.send("isready")
+        self.waitFor("readyok")
+
+    def bestMove(self, gs, limits):
+        fen, notations = gs.startFEN, [move.getChessNotation() for move in gs.moveLog]
+        self.send("position fen %s%s" % (fen, " moves " + " ".join(notations) if notations else ""))
+        if "nodes" in limits:
+            self.send("go nodes %d" % limits["nodes"])
+        elif "time" in limits:
+            self.send("go movetime %d" % (1000 * limits["time"]))
+        else:
+            self.send("go depth %d" % limits.get("depth", 4))
+        words = self.waitFor("bestmove", UCI_TIMEOUT + limits.get("time", 0))
+        return gs.moveFromNotation(words[1]) if len(words) > 1 else None
+
+    def close(self):
+        try:
+            self.send("quit")
+            self.process.wait(UCI_TIMEOUT)
+        except (UCIExited, subprocess.TimeoutExpired):
+            self.kill()
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+
+def makePlayer(spec):
+    if spec == "internal":
+        return InternalPlayer(spec)
+    if spec.startswith("uci:"):
+        return UCIPlayer(spec, [sys.executable, "-m", "chess_engine", "uci"], cwd=os.path.expanduser(spec[4:]))
+    if spec.startswith("cmd:"):
+        command = shlex.split(spec[4:])
+        if not command:
+            raise ValueError("engine cmd: needs a command")
+        return UCIPlayer(spec, command)
+    raise ValueError("engine must be internal, uci:DIR or cmd:COMMAND, not %r" % spec)
+
+
+_players = {} # spec -> player, one of each per worker process
+
+
+def _player(spec):
+    if spec not in _players:
+        _players[spec] = makePlayer(spec)
+        atexit.register(_players[spec].close)
+    return _players[spec]
+
+
+# kills a hung or dead engine; the next game played with spec starts a fresh one
+def _dropPlayer(spec):
+    player = _players.pop(spec, None)
+    if player is not None:
+        atexit.unregister(player.close)
+        player.kill()
+
+
+# plays one game in a worker: (game number, white spec, result "1-0"/"0-1"/"1/2-1/2", reason, opening fen, moves)
+# an engine that does not answer in time loses the game on time, one that exits (or fails to start) loses it
+# by forfeit, and either is restarted for the next game
+def playGame(number, fen, white, black, limits, maxPlies=MAX_PLIES):
+    gs = chess_engine.GameState.from_fen(fen)
+    players = {}
+    side = True # the side whose engine is being waited on
+    try:
+        for side, spec in ((True, white), (False, black)):
+            players[side] = _player(spec)
+            if side or players[False] is not players[True]: # an engine playing both sides starts once
+                players[side].newGame()
+        while True:
+            reason = adjudicate(gs, maxPlies)
+            if reason is not None:
+                break
+            side = gs.whiteToMove
+            move = players[side].bestMove(gs, limits)
+            if move is None: # an engine that answers nothing playable loses
+                reason = "illegal move"
+                result = "0-1" if gs.whiteToMove else "1-0"
+                return number, white, result, reason, fen, [move.getChessNotation() for move in gs.moveLog]
+            gs.makeMove(move)
+    except (UCITimeout, UCIExited) as error:
+        _dropPlayer(white if side else black)
+        result = "0-1" if side else "1-0"
+        reason = "time forfeit" if isinstance(error, UCITimeout) else "engine exited"
+        return number, white, result, reason, fen, [move.getChessNotation() for move in gs.moveLog]
+    if reason == "checkmate":
+        result = "0-1" if gs.whiteToMove else "1-0"
+    else:
+        result = "1/2-1/2"
+    return number, white, result, reason, fen, [move.getChessNotation() for move in gs.moveLog]
+
+
+# Elo difference for an average score between 0 and 1
+def eloFromScore(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return 400 * math.log10(score / (1 - score))
+
+
+# (elo, lower, upper): the Elo difference and its 95% confidence interval from wins, draws and losses
+def eloInterval(wins, draws, losses):
+    games = wins + draws + losses
+    if not games:
+        return 0.0, -math.inf, math.inf
+    score = (wins + 0.5 * draws) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    return eloFromScore(score), eloFromScore(score - margin), eloFromScore(score + margin)
+
+
+# sequential probability ratio test of H0: elo = elo0 against H1: elo = elo1, on the normal approximation
+# of the per-game scores; returns (log likelihood ratio, lower bound, upper bound, verdict)
+def sprt(wins, draws, losses, elo0=0.0, elo1=5.0, alpha=0.05, beta=0.05):
+    lower, upper = math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+    games = wins + draws + losses
+    if not games:
+        return 0.0, lower, upper, "continue"
+    score = (wins + 0.5 * draws) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    if variance == 0:
+        return 0.0, lower, upper, "continue"
+    s0 = 1 / (1 + 10 ** (-elo0 / 400))
+    s1 = 1 / (1 + 10 ** (-elo1 / 400))
+    llr = games * (s1 - s0) * (2 * score - s0 - s1) / (2 * variance)
+    if llr >= upper:
+        verdict = "H1 accepted (elo >= %g)" % elo1
+    elif llr <= lower:
+        verdict = "H0 accepted (elo <= %g)" % elo0
+    else:
+        verdict = "continue"
+    return llr, lower, upper, verdict
+
+
+class Match():
+    # engine A against engine B over games games, results from A's point of view
+    def __init__(self, engineA="internal", engineB="internal", games=24, workers=None, limits=None,
+                 openings=None, seed=None, maxPlies=MAX_PLIES, sprtBounds=(0.0, 5.0)):
+        self.engineA = engineA
+        self.engineB = engineB
+        self.games = games
+        self.workers = workers or os.cpu_count() or 1
+        self.limits = limits or {"nodes": 2000}
+        self.openings = list(openings or loadOpenings())
+        random.Random(seed).shuffle(self.openings)
+        self.maxPlies = maxPlies
+        self.sprtBounds = sprtBounds
+        self.wins = self.draws = self.losses = 0
+        self.reasons = {}
+        self.records = []
+        self.seconds = 0.0
+
+    # game 2k and 2k+1 play the same opening, A white in the first and black in the second
+    def tasks(self):
+        for number in range(self.games):
+            fen = self.openings[(number // 2) % len(self.openings)]
+            white, black = (self.engineA, self.engineB) if number % 2 == 0 else (self.engineB, self.engineA)
+            yield number, fen, white, black, self.limits, self.maxPlies
+
+    def record(self, number, white, result, reason, fen, moves):
+        aWhite = number % 2 == 0
+        if result == "1/2-1/2":
+            self.draws += 1
+        elif (result == "1-0") == aWhite:
+            self.wins += 1
+        else:
+            self.losses += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        self.records.append((number, white, result, reason, fen, moves))
+
+    def run(self, out=sys.stdout):
+        start = time.perf_counter()
+        with ProcessPoolExecutor(self.workers) as pool:
+            futures = [pool.submit(playGame, *task) for task in self.tasks()]
+            for done, future in enumerate(as_completed(futures), 1):
+                self.record(*future.result())
+                if out is not None:
+                    elo, low, high = eloInterval(self.wins, self.draws, self.losses)
+                    out.write("game %d/%d  +%d =%d -%d  elo %+.1f\n" % (
+                        done, self.games, self.wins, self.draws, self.losses, elo))
+        self.seconds = time.perf_counter() - start
+        self.records.sort()
+        return self
+
+    def report(self, out=sys.stdout):
+        games = self.wins + self.draws + self.losses
+        elo, low, high = eloInterval(self.wins, self.draws, self.losses)
+        llr, lower, upper, verdict = sprt(self.wins, self.draws, self.losses, *self.sprtBounds)
+        out.write("%s vs %s, %s per move\n" % (self.engineA, self.engineB,
+                                               ", ".join("%s %s" % item for item in self.limits.items())))
+        out.write("games %d: +%d =%d -%d, score %.1f%%\n" % (
+            games, self.wins, self.draws, self.losses, 100 * (self.wins + 0.5 * self.draws) / games if games else 0))
+        out.write("elo %+.1f, 95%% interval [%+.1f, %+.1f]\n" % (elo, low, high))
+        out.write("sprt elo0 %g elo1 %g: llr %.2f (bounds %.2f, %.2f), %s\n" % (
+            self.sprtBounds[0], self.sprtBounds[1], llr, lower, upper, verdict))
+        out.write("endings: %s\n" % ", ".join("%s %d" % item for item in sorted(self.reasons.items())))
+        out.write("%.1fs with %d workers: %.0f games per hour\n" % (
+            self.seconds, self.workers, 3600 * games / self.seconds if self.seconds else 0))
+
+    def writePGN(self, out):
+        import chess_pgn # only needed for SAN
+        for number, white, result, reason, fen, moves in self.records:
+            black = self.engineB if number % 2 == 0 else self.engineA
+            out.write('[Event "chess_tournament"]\n[Round "%d"]\n[White "%s"]\n[Black "%s"]\n[Result "%s"]\n'
+                      '[Termination "%s"]\n[FEN "%s"]\n[SetUp "1"]\n\n' % (number + 1, white, black, result,
+                                                                          reason, fen))
+            gs = chess_engine.GameState.from_fen(fen)
+            words = []
+            for notation in moves:
+                move = gs.moveFromNotation(notation)
+                if gs.whiteToMove:
+                    words.append("%d." % ((gs.startPly + len(gs.moveLog)) // 2 + 1))
+                words.append(chess_pgn.toSAN(gs, move))
+                gs.makeMove(move)
+            words.append(result)
+            out.write(" ".join(words) + "\n\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="chess_tournament", description="self-play match with Elo and SPRT")
+    parser.add_argument("--engine-a", dest="engineA", default="internal", help="internal, uci:DIR or cmd:COMMAND")
+    parser.add_argument("--engine-b", dest="engineB", default="internal")
+    parser.add_argument("--games", type=int, default=24)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    limit = parser.add_mutually_exclusive_group()
+    limit.add_argument("--nodes", type=int, default=None, help="nodes per move (default 2000)")
+    limit.add_argument("--time", type=float, default=None, help="seconds per move")
+    limit.add_argument("--depth", type=int, default=None, help="search depth per move")
+    parser.add_argument("--openings", default=None, help="EPD/FEN file of starting positions")
+    parser.add_argument("--seed", type=int, default=None, help="seed for shuffling the openings")
+    parser.add_argument("--max-plies", dest="maxPlies", type=int, default=MAX_PLIES)
+    parser.add_argument("--sprt", nargs=2, type=float, default=(0.0, 5.0), metavar=("ELO0", "ELO1"))
+    parser.add_argument("--pgn", default=None, help="write the games here")
+    args = parser.parse_args(argv)
+
+    if args.time is not None:
+        limits = {"time": args.time}
+    elif args.depth is not None:
+        limits = {"depth": args.depth}
+    else:
+        limits = {"nodes": args.nodes or 2000}
+    match = Match(args.engineA, args.engineB, args.games, args.workers, limits,
+                  loadOpenings(args.openings), args.seed, args.maxPlies, tuple(args.sprt))
+    match.run()
+    match.report()
+    if args.pgn:
+        with open(args.pgn, "w") as out:
+            match.writePGN(out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+#Chess UCI
+
+'''Universal Chess Interface front end, so the engine runs headless as a subprocess of a GUI or a server'''
+'''Commands are read on the main thread while "go" searches on a background thread, so "stop" and "isready"'''
+'''are answered during a search; nothing graphical is imported'''
+'''usage: python -m chess_engine uci   (or python -m chess_uci)'''
+
+import sys
+import threading
+
+import chess_engine
+import chess_search
+
+ENGINE_NAME = "Chess_Game"
+ENGINE_AUTHOR = "kushaltamang"
+DEFAULT_HASH_MB = 16
+MAX_HASH_MB = 1024
+MAX_THREADS = 64
+TT_ENTRY_BYTES = 160 # rough size of one transposition table slot with its key, depth and entry tuple
+MOVE_OVERHEAD = 0.05 # seconds kept back from every clock budget for the GUI and the pipe
+
+
+# UCI "score" field for a search score: centipawns, or mate in n moves (negative when being mated)
+def formatScore(score):
+    if score > chess_search.CHECKMATE - chess_search.MAX_PLY:
+        return "mate %d" % ((chess_search.CHECKMATE - score + 1) // 2)
+    if score < -chess_search.CHECKMATE + chess_search.MAX_PLY:
+        return "mate %d" % -((chess_search.CHECKMATE + score) // 2)
+    return "cp %d" % score
+
+
+# seconds to spend on this move from the go parameters, None for no time limit
+def timeBudget(params, whiteToMove):
+    if "movetime" in params:
+        return max(params["movetime"] / 1000.0 - MOVE_OVERHEAD, 0.01)
+    clock = params.get("wtime" if whiteToMove else "btime")
+    if clock is None:
+        return None
+    increment = params.get("winc" if whiteToMove else "binc", 0) / 1000.0
+    movesToGo = params.get("movestogo", 30)
+    clock /= 1000.0
+    budget = clock / max(movesToGo, 1) + 0.75 * increment
+    return max(min(budget, clock / 2) - MOVE_OVERHEAD, 0.01)
+
+
+class UCIEngine():
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.outLock = threading.Lock() # the search thread and the reader thread both write
+        self.hashMB = DEFAULT_HASH_MB
+        self.threads = 1
+        self.searcher = chess_search.Searcher(self.ttSize())
+        self.parallel = None # chess_parallel.ParallelSearcher, started once Threads is above 1
+        self.searchNumber = 0 # self.parallel's number for the last search handed to it, 0 for none
+        self.gs = chess_engine.GameState()
+        self.searchThread = None
+        self.stopRequested = False
+        self.infinite = False
+        self.book = None # chess_book.OpeningBook, opened by the BookFile option
+        self.tablebase = None # chess_tablebase.Tablebase, opened by the TablebasePath option
+
+    def ttSize(self):
+        return max(self.hashMB * (1 << 20) // TT_ENTRY_BYTES, 1024)
+
+    def send(self, line):
+        with self.outLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    # handles one command line, returns False once the engine should exit
+    def handle(self, line):
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        if command == "uci":
+            self.send("id name %s" % ENGINE_NAME)
+            self.send("id author %s" % ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max %d" % (DEFAULT_HASH_MB, MAX_HASH_MB))
+            self.send("option name Threads type spin default 1 min 1 max %d" % MAX_THREADS)
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.waitForSearch()
+            self.setOption(args)
+        elif command == "ucinewgame":
+            self.waitForSearch()
+            self.searcher = chess_search.Searcher(self.ttSize(), self.tablebase)
+            self.gs = chess_engine.GameState()
+        elif command == "position":
+            self.waitForSearch()
+            self.setPosition(args)
+        elif command == "go":
+            self.waitForSearch()
+            self.go(args)
+        elif command == "stop":
+            self.stopSearch()
+            self.waitForSearch()
+        elif command == "quit":
+            self.stopSearch()
+            self.waitForSearch()
+            if self.parallel is not None:
+                self.parallel.close()
+            if self.book is not None:
+                self.book.close()
+            if self.tablebase is not None:
+                self.tablebase.close()
+            return False
+        return True # unknown commands are ignored, as the protocol asks
+
+    # "setoption name Hash value 64"
+    def setOption(self, args):
+        if "name" not in args or "value" not in args:
+            return
+        name = " ".join(args[args.index("name") + 1:args.index("value")]).lower()
+        value = " ".join(args[args.index("value") + 1:])
+        if name == "bookfile":
+            self.setBook(value)
+            return
+        if name == "tablebasepath":
+            self.setTablebase(value)
+            return
+        try:
+            number = int(value)
+        except ValueError:
+            return
+        if name == "hash":
+            self.hashMB = min(max(number, 1), MAX_HASH_MB)
+            self.searcher = chess_search.Searcher(self.ttSize(), self.tablebase)
+        elif name == "threads":
+            self.threads = min(max(number, 1), MAX_THREADS)
+            if self.parallel is not None:
+                self.parallel.close()
+                self.parallel = None
+                self.searchNumber = 0
+
+    def setBook(self, path):
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+        if path and path != "<empty>":
+            import chess_book
+            try:
+                self.book = chess_book.OpeningBook(path)
+            except (OSError, ValueError) as error:
+                self.send("info string cannot open book: %s" % error)
+
+    def setTablebase(self, path):
+        if self.tablebase is not None:
+            self.tablebase.close()
+            self.tablebase = None
+        if path and path != "<empty>":
+            import chess_tablebase
+            try:
+                self.tablebase = chess_tablebase.openDefault(path)
+            except (OSError, ValueError) as error:
+                self.send("info string cannot open tablebases: %s" % error)
+            if self.tablebase is None:
+                self.send("info string no tablebases in %s" % path)
+        self.searcher = chess_search.Searcher(self.ttSize(), self.tablebase)
+
+    # "position startpos moves e2e4 e7e5" or "position fen <6 fields> moves ..."
+    # a FEN that does not load is reported and the previous position kept
+    def setPosition(self, args):
+        if not args:
+            return
+        movesAt = args.index("moves") if "moves" in args else len(args)
+        if args[0] == "fen":
+            try:
+                gs = chess_engine.GameState.from_fen(" ".join(args[1:movesAt]))
+            except ValueError as error:
+                self.send("info string invalid fen: %s" % error)
+                return
+        else:
+            gs = chess_engine.GameState()
+        for notation in args[movesAt + 1:]:
+            move = gs.moveFromNotation(notation)
+            if move is None:
+                self.send("info string illegal move %s" % notation)
+                break
+            gs.makeMove(move)
+        self.gs = gs
+
+    # "go depth 6", "go movetime 1000", "go wtime 60000 btime 60000 winc 0 binc 0", "go infinite", "go nodes 50000"
+    def go(self, args):
+        params = {}
+        for i, word in enumerate(args[:-1]):
+            if word in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo", "nodes"):
+                try:
+                    params[word] = int(args[i + 1])
+                except ValueError:
+                    pass
+        maxDepth = params.get("depth", chess_search.MAX_PLY)
+        timeLimit = None if "infinite" in args else timeBudget(params, self.gs.whiteToMove)
+        nodeLimit = params.get("nodes")
+        self.infinite = timeLimit is None and nodeLimit is None and maxDepth == chess_search.MAX_PLY
+        self.stopRequested = False
+        if self.book is not None and not self.infinite:
+            move = self.book.chooseMove(self.gs)
+            if move is not None: # still in book, no search needed
+                self.send("info string book move")
+                self.send("bestmove %s" % move.getChessNotation())
+                return
+        self.searchThread = threading.Thread(target=self.search, args=(maxDepth, timeLimit, nodeLimit), daemon=True)
+        self.searchThread.start()
+
+    # runs on the search thread
+    def search(self, maxDepth, timeLimit, nodeLimit):
+        gs = self.gs
+        if self.threads > 1 and (timeLimit is not None or maxDepth < chess_search.MAX_PLY):
+            # an infinite search stays on the single searcher, which reports every depth as it finishes
+            if self.parallel is None:
+                import chess_parallel
+                self.parallel = chess_parallel.ParallelSearcher(self.threads, self.ttSize())
+            self.searchNumber = self.parallel.nextSearch()
+            if self.stopRequested: # a stop that came in before the search had a number
+                self.parallel.stop(self.searchNumber)
+            result = self.parallel.search(gs, maxDepth, timeLimit, nodeLimit, self.searchNumber)
+            self.sendInfo(result)
+        else:
+            result = self.searcher.search(gs, maxDepth, timeLimit, nodeLimit, self.onIteration)
+        self.send("bestmove %s" % (result.bestMove.getChessNotation() if result.bestMove else "(none)"))
+
+    def onIteration(self, result):
+        self.sendInfo(result)
+        if self.stopRequested: # a stop that came in before the search had started
+            self.searcher.stop()
+
+    def sendInfo(self, result):
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s" % (
+            result.depth, formatScore(result.score), result.nodes, result.nps, int(result.seconds * 1000),
+            " ".join(move.getChessNotation() for move in result.pv)))
+
+    def stopSearch(self):
+        self.stopRequested = True
+        self.searcher.stop()
+        if self.parallel is not None and self.searchNumber:
+            self.parallel.stop(self.searchNumber)
+
+    def waitForSearch(self):
+        if self.searchThread is not None:
+            self.searchThread.join()
+            self.searchThread = None
+
+
+def main(inp=sys.stdin, out=sys.stdout):
+    engine = UCIEngine(out)
+    for line in inp:
+        if not engine.handle(line):
+            break
+    else: # end of input: a search with a limit may finish and report, an infinite one is stopped
+        if engine.infinite:
+            engine.stopSearch()
+        engine.waitForSearch()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+#Chess Zobrist Hashing
+
+'''64-bit Zobrist keys that identify a position, and a bounded transposition table keyed on them'''
+'''The keys come from a fixed seed so the same position hashes the same in every process'''
+
+import random
+
+_rng = random.Random(0x5EED_C0DE)
+
+# PIECE_KEYS[piece index][square], piece index as in chess_bitboard.PIECE_INDEX
+PIECE_KEYS = [[_rng.getrandbits(64) for sq in range(64)] for piece in range(12)]
+SIDE_KEY = _rng.getrandbits(64) # xored in when black is to move
+# one key per 4-bit castling rights value, CASTLE_KEYS[0] is 0 so no rights hash to nothing
+CASTLE_KEYS = [0] + [_rng.getrandbits(64) for rights in range(1, 16)]
+# one key per en passant file
+ENPASSANT_KEYS = [_rng.getrandbits(64) for col in range(8)]
+
+
+class TranspositionTable():
+    # fixed number of slots, a key always maps to slot key % size
+    # a slot is overwritten when it is empty, holds the same key, or holds a shallower entry
+    def __init__(self, size=1 << 16):
+        self.size = size
+        self.keys = [None] * size
+        self.depths = [0] * size
+        self.entries = [None] * size
+        self.hits = 0
+        self.misses = 0
+
+    def probe(self, key):
+        i = key % self.size
+        if self.keys[i] == key:
+            self.hits += 1
+            return self.entries[i]
+        self.misses += 1
+        return None
+
+    def store(self, key, entry, depth=0):
+        i = key % self.size
+        if self.keys[i] is None or self.keys[i] == key or depth >= self.depths[i]:
+            self.keys[i] = key
+            self.depths[i] = depth
+            self.entries[i] = entry
+
+    def clear(self):
+        self.keys = [None] * self.size
+        self.depths = [0] * self.size
+        self.entries = [None] * self.size
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return self.size - self.keys.count(None)
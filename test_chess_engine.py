@@ -0,0 +1,131 @@
+#Chess Engine Tests
+
+'''Checks FEN loading, castling rights and snapshots of chess_engine.GameState'''
+'''usage: python -m unittest test_chess_engine'''
+
+import unittest
+
+import chess_engine
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+
+class LoadFENTest(unittest.TestCase):
+    # a castling right without its rook (or king) at home is dropped, so no castle is offered
+    def testCastlingRightWithoutRook(self):
+        gs = chess_engine.GameState.from_fen("4k3/8/8/8/8/8/8/4K3 w K - 0 1")
+        self.assertEqual(gs.castleRights, 0)
+        notations = [move.getChessNotation() for move in gs.legal_moves()]
+        self.assertNotIn("e1g1", notations)
+        self.assertEqual(gs.to_fen(), "4k3/8/8/8/8/8/8/4K3 w - - 0 1")
+
+    def testCastlingRightWithoutKing(self):
+        gs = chess_engine.GameState.from_fen("r3k2r/8/8/8/8/8/8/R2K3R w KQkq - 0 1")
+        self.assertEqual(gs.castleRights, chess_engine.BKS | chess_engine.BQS)
+
+    def testCastlingRightsKept(self):
+        gs = chess_engine.GameState.from_fen("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1")
+        notations = [move.getChessNotation() for move in gs.legal_moves()]
+        self.assertIn("e1g1", notations)
+        self.assertIn("e1c1", notations)
+
+    # canCastle itself also wants the rook, whatever the rights say
+    def testCanCastleNeedsRook(self):
+        gs = chess_engine.GameState.from_fen("4k3/8/8/8/8/8/8/4K2R w K - 0 1")
+        gs.removePiece(63)
+        self.assertFalse(gs.canCastle(*chess_engine.CASTLES[((7, 4), (7, 7))]))
+
+    def testBadFields(self):
+        for fen in ("4k3/8/8/8/8/8/8/4K3 w - e9 0 1", # en passant square off the board
+                    "4k3/8/8/8/8/8/8/4K3 w - e3 0 1", # en passant square on the wrong side's row
+                    "4k3/8/8/8/8/8/8/4K3 x - - 0 1", # side to move
+                    "8/8/8/8/8/8/8/8 w - - 0 1", # no kings
+                    "4k3/8/8/8/8/8/8/4KK2 w - - 0 1", # two white kings
+                    "4k3/8/8/8/8/8/8/4K3 w KX - 0 1", # castling
+                    "4k3/8/8/8/8/8/8/4K3 w - - -1 1", # halfmove clock
+                    "4k3/8/8/8/8/8/8/4K3 w - - 0 x", # fullmove number
+                    "4k3/8/8/8/8/8/4K3 w - - 0 1", # 7 ranks
+                    "4k3/8/8/8/8/8/8/4K4 w - - 0 1", # 9 files
+                    "4k3/8/8/8/8/8/8/4K2X w - - 0 1", # piece letter
+                    "P3k3/8/8/8/8/8/8/4K3 w - - 0 1", # pawn on the last rank
+                    ""):
+            with self.subTest(fen=fen):
+                with self.assertRaises(ValueError):
+                    chess_engine.GameState.from_fen(fen)
+
+    # a FEN that fails to load leaves the position as it was
+    def testBadFENKeepsPosition(self):
+        gs = chess_engine.GameState.from_fen(START_FEN)
+        with self.assertRaises(ValueError):
+            gs.loadFEN("4k3/8/8/8/8/8/8/4K3 w - e9 0 1")
+        self.assertEqual(gs.to_fen(), START_FEN)
+        self.assertEqual(len(gs.legal_moves()), 20)
+
+    def testEnpassantField(self):
+        gs = chess_engine.GameState.from_fen("rnbqkbnr/pppp1ppp/8/8/4pP2/8/PPPPP1PP/RNBQKBNR b KQkq f3 0 3")
+        self.assertIn("e4f3", [move.getChessNotation() for move in gs.legal_moves()])
+
+    # an en passant square no pawn just passed over is dropped, so the knight on e5 cannot be taken through it
+    def testEnpassantFieldWithoutPawn(self):
+        gs = chess_engine.GameState.from_fen("4k3/8/8/3Pn3/8/8/8/4K3 w - e6 0 1")
+        self.assertEqual(gs.enpassantPossible, ())
+        self.assertNotIn("d5e6", [move.getChessNotation() for move in gs.legal_moves()])
+        self.assertEqual(gs.to_fen(), "4k3/8/8/3Pn3/8/8/8/4K3 w - - 0 1")
+
+
+class HasLegalMoveTest(unittest.TestCase):
+    def testStalemate(self):
+        self.assertFalse(chess_engine.GameState.from_fen("k7/2Q5/1K6/8/8/8/8/8 b - - 0 1").hasLegalMove())
+
+    # the king is boxed in, only the pawn can move
+    def testPawnMoveOnly(self):
+        self.assertTrue(chess_engine.GameState.from_fen("k7/2Q5/1K6/7p/8/8/8/8 b - - 0 1").hasLegalMove())
+
+    def testCheckmate(self):
+        self.assertFalse(chess_engine.GameState.from_fen("k7/1Q6/1K6/8/8/8/8/8 b - - 0 1").hasLegalMove())
+
+
+class SnapshotTest(unittest.TestCase):
+    def play(self, gs, notations):
+        for notation in notations:
+            gs.makeMove(gs.moveFromNotation(notation))
+
+    def assertSamePosition(self, loaded, gs):
+        self.assertEqual(loaded.to_fen(), gs.to_fen())
+        self.assertEqual(loaded.zobristKey, gs.zobristKey)
+        self.assertEqual(loaded.zobristKey, loaded.computeZobristKey())
+        self.assertEqual(sorted(move.getChessNotation() for move in loaded.legal_moves()),
+                         sorted(move.getChessNotation() for move in gs.legal_moves()))
+        self.assertEqual(loaded.repetitionCounts, gs.repetitionCounts)
+
+    # the position after Nf3 comes round again, so its key is counted twice on both sides of the round trip
+    def testRoundTripKeepsRepetitions(self):
+        gs = chess_engine.GameState.from_fen(START_FEN)
+        self.play(gs, ["g1f3", "g8f6", "f3g1", "f6g8", "g1f3"])
+        self.assertEqual(gs.repetitionCounts[gs.zobristKey], 2)
+        data = gs.snapshot()
+        self.assertSamePosition(chess_engine.GameState.fromSnapshot(data), gs)
+        reused = chess_engine.GameState.from_fen("4k3/8/8/8/8/8/8/4K3 w - - 0 1")
+        reused.loadSnapshot(data)
+        self.assertSamePosition(reused, gs)
+
+    # the history the snapshot carries still counts toward a threefold repetition after it is loaded
+    def testRepetitionAfterLoad(self):
+        gs = chess_engine.GameState.from_fen(START_FEN)
+        self.play(gs, ["g1f3", "g8f6", "f3g1", "f6g8"])
+        loaded = chess_engine.GameState.fromSnapshot(gs.snapshot())
+        self.assertEqual(loaded.repetitionCounts[loaded.zobristKey], 2)
+        self.play(loaded, ["g1f3", "g8f6", "f3g1", "f6g8"])
+        self.assertEqual(loaded.repetitionCounts[loaded.zobristKey], 3)
+
+    # positions before the last pawn move or capture can never come back, so they are not carried
+    def testHistoryEndsAtPawnMove(self):
+        gs = chess_engine.GameState.from_fen(START_FEN)
+        self.play(gs, ["g1f3", "g8f6", "f3g1", "f6g8", "e2e4"])
+        loaded = chess_engine.GameState.fromSnapshot(gs.snapshot())
+        self.assertEqual(loaded.repetitionCounts, {gs.zobristKey: 1})
+        self.assertEqual(loaded.to_fen(), gs.to_fen())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+#Chess Parallel Search Tests
+
+'''Checks how chess_parallel.ParallelSearcher picks the move over its shares, and searches against Searcher'''
+'''usage: python -m unittest test_chess_parallel'''
+
+import unittest
+
+import chess_engine
+import chess_parallel
+import chess_search
+from chess_perft import POSITIONS
+
+MATE = chess_search.CHECKMATE - 1
+
+
+# an iteration as _searchShare returns it: (depth, best move, score, nodes, pv, failed low)
+def iteration(depth, move, score, failedLow=False):
+    return (depth, move, score, 100, [] if failedLow else [move], failedLow)
+
+
+class PickIterationTest(unittest.TestCase):
+    def pick(self, shareIterations):
+        return chess_parallel.ParallelSearcher.pickIteration(None, shareIterations)
+
+    # compared at the deepest depth both shares finished, the deeper one's extra depth is left out
+    def testDeepestCommonDepth(self):
+        depth, best, doubtful = self.pick([
+            [iteration(1, "e2e4", 30), iteration(2, "e2e4", 20)],
+            [iteration(1, "d2d4", 40), iteration(2, "d2d4", 25), iteration(3, "d2d4", 90)]])
+        self.assertEqual((depth, best[1], best[2], doubtful), (2, "d2d4", 25, {}))
+
+    # failing low under an exact score at the same depth puts that share out
+    def testFailedLowDominated(self):
+        depth, best, doubtful = self.pick([
+            [iteration(1, "e2e4", 30), iteration(2, "e2e4", 20)],
+            [iteration(1, "d2d4", 40), iteration(2, "d2d4", 10, True)]])
+        self.assertEqual((depth, best[1], best[2], doubtful), (2, "e2e4", 20, {}))
+
+    # a share that stopped at a forced mate neither holds the depth down nor drops out
+    def testDecidedShare(self):
+        depth, best, doubtful = self.pick([
+            [iteration(1, "h5f7", MATE)],
+            [iteration(1, "d2d4", 40), iteration(2, "d2d4", 25), iteration(3, "d2d4", 30)]])
+        self.assertEqual((depth, best[1], best[2], doubtful), (3, "h5f7", MATE, {}))
+
+    # every share decided: the deepest of their last iterations is the depth
+    def testAllDecided(self):
+        depth, best, doubtful = self.pick([
+            [iteration(1, "h5f7", MATE)],
+            [iteration(1, "d2d4", 40), iteration(2, "d1h5", -MATE)]])
+        self.assertEqual((depth, best[1], doubtful), (2, "h5f7", {}))
+
+    # an upper bound above every exact score says nothing: the depth before is compared, and the share is
+    # marked to be searched again at the deepest depth
+    def testUnresolvedFallsBack(self):
+        depth, best, doubtful = self.pick([
+            [iteration(1, "e2e4", 30), iteration(2, "e2e4", 20)],
+            [iteration(1, "d2d4", 40), iteration(2, "d2d4", 80, True)]])
+        self.assertEqual((depth, best[1], best[2], doubtful), (1, "d2d4", 40, {1: 2}))
+
+    # a share that did not finish depth 1 leaves nothing to compare
+    def testNoIterations(self):
+        self.assertEqual(self.pick([[], [iteration(1, "d2d4", 40)]]), (0, None, {}))
+        self.assertEqual(self.pick([[], []]), (0, None, {}))
+
+
+class ParallelSearchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.parallel = chess_parallel.ParallelSearcher(2, 1 << 12)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.parallel.close()
+
+    # splitting the root changes how the moves are searched, not the score of the best one at a fixed depth
+    def testSameScoreAsSingle(self):
+        for name, fen, counts in POSITIONS:
+            with self.subTest(position=name):
+                single = chess_search.Searcher(1 << 12).search(chess_engine.GameState.from_fen(fen), 3)
+                split = self.parallel.search(chess_engine.GameState.from_fen(fen), 3)
+                self.assertEqual((split.depth, split.score), (single.depth, single.score))
+
+    # a search stopped before it started gives up at once, and the stop does not carry over to the next one
+    def testStopBeforeStart(self):
+        gs = chess_engine.GameState.from_fen(POSITIONS[1][1])
+        number = self.parallel.nextSearch()
+        self.parallel.stop(number)
+        result = self.parallel.search(gs, chess_search.MAX_PLY, number=number)
+        self.assertEqual(result.depth, 0)
+        self.assertIn(result.bestMove.getChessNotation(), [move.getChessNotation() for move in gs.legal_moves()])
+        self.assertEqual(self.parallel.search(gs, 1).depth, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+#Chess Perft Tests
+
+'''Checks move generation against the perft suite and makeMove/undoMove against full recomputation'''
+'''usage: python -m unittest test_chess_perft'''
+
+import random
+import unittest
+
+import chess_engine
+from chess_perft import POSITIONS, perft
+
+
+# the published counts of the suite positions at depths 1-3
+class PerftSuiteTest(unittest.TestCase):
+    def testSuite(self):
+        for name, fen, counts in POSITIONS:
+            for depth in (1, 2, 3):
+                with self.subTest(position=name, depth=depth):
+                    self.assertEqual(perft(chess_engine.GameState.from_fen(fen), depth), counts[depth])
+
+    # the last ply played out, so makeMove and undoMove run at the leaves too
+    def testSuiteWithoutBulk(self):
+        for name, fen, counts in POSITIONS:
+            with self.subTest(position=name):
+                self.assertEqual(perft(chess_engine.GameState.from_fen(fen), 2, bulk=False), counts[2])
+
+
+# random games from every suite position: the incremental key and king rays match a full recount after each move,
+# and undoing the moves gives back the FEN, key and king rays of every position on the way
+class MakeUndoTest(unittest.TestCase):
+    def checkIncremental(self, gs):
+        self.assertEqual(gs.zobristKey, gs.computeZobristKey())
+        self.assertEqual(gs.kingRays, (gs.scanKingRays(chess_engine.WHITE), gs.scanKingRays(chess_engine.BLACK)))
+
+    def testRandomGames(self):
+        rng = random.Random(2024)
+        for name, fen, counts in POSITIONS:
+            for game in range(4):
+                with self.subTest(position=name, game=game):
+                    gs = chess_engine.GameState.from_fen(fen)
+                    history = []
+                    for ply in range(40):
+                        moves = gs.legal_moves()
+                        if not moves:
+                            break
+                        history.append((gs.to_fen(), gs.zobristKey, gs.kingRays))
+                        gs.makeMove(rng.choice(moves))
+                        self.checkIncremental(gs)
+                    while history:
+                        gs.undoMove()
+                        self.assertEqual((gs.to_fen(), gs.zobristKey, gs.kingRays), history.pop())
+                        self.checkIncremental(gs)
+
+
+if __name__ == "__main__":
+    unittest.main()
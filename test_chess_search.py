@@ -0,0 +1,45 @@
+#Chess Search Tests
+
+'''Checks how chess_search.Searcher scores positions without legal moves and fifty-move draws'''
+'''usage: python -m unittest test_chess_search'''
+
+import unittest
+
+import chess_engine
+import chess_search
+
+
+class QuiescenceTest(unittest.TestCase):
+    # no capture to search and no quiet move either: a draw, not black's lost material
+    def testStalemateIsDraw(self):
+        gs = chess_engine.GameState.from_fen("k7/2Q5/1K6/8/8/8/8/8 b - - 0 1")
+        self.assertEqual(chess_search.Searcher(1).quiescence(gs, -chess_search.INFINITE, chess_search.INFINITE, 0), 0)
+
+    # no capture either, but a pawn move, so the side to move stands pat
+    def testQuietMoveStandsPat(self):
+        gs = chess_engine.GameState.from_fen("k7/2Q5/1K6/7p/8/8/8/8 b - - 0 1")
+        score = chess_search.Searcher(1).quiescence(gs, -chess_search.INFINITE, chess_search.INFINITE, 0)
+        self.assertLess(score, -500)
+
+
+class FiftyMoveRuleTest(unittest.TestCase):
+    # every move white has reaches the 100th ply without a capture or pawn move, the extra rook wins nothing
+    def testDrawOnHundredthPly(self):
+        gs = chess_engine.GameState.from_fen("4k3/8/8/8/8/8/8/R3K3 w - - 99 80")
+        self.assertEqual(chess_search.Searcher(1 << 12).search(gs, 2).score, 0)
+
+    # a mate on the 100th ply is still a mate
+    def testMateOnHundredthPly(self):
+        gs = chess_engine.GameState.from_fen("7k/8/6K1/8/8/8/8/R7 w - - 99 80")
+        result = chess_search.Searcher(1 << 12).search(gs, 2)
+        self.assertEqual(result.bestMove.getChessNotation(), "a1a8")
+        self.assertGreater(result.score, chess_search.CHECKMATE - chess_search.MAX_PLY)
+
+    # with plies to spare the rook still counts
+    def testClockBelowHundred(self):
+        gs = chess_engine.GameState.from_fen("4k3/8/8/8/8/8/8/R3K3 w - - 90 80")
+        self.assertGreater(chess_search.Searcher(1 << 12).search(gs, 2).score, 300)
+
+
+if __name__ == "__main__":
+    unittest.main()
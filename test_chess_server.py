@@ -0,0 +1,82 @@
+#Chess Server Tests
+
+'''Checks the game status, memory accounting, request checks and undo of chess_server sessions'''
+'''usage: python -m unittest test_chess_server'''
+
+import unittest
+
+import chess_server
+
+
+class SessionTest(unittest.TestCase):
+    # 100 plies without a capture or pawn move is a draw, the engine no longer moves
+    def testFiftyMoveRule(self):
+        session = chess_server.Session(1, "4k3/8/8/8/8/8/8/R3K3 w - - 99 80", 'b', 1, None)
+        self.assertEqual(session.status(), "active")
+        session.gs.makeMove(session.gs.moveFromNotation("a1a2"))
+        self.assertEqual(session.state()["status"], "50 moves")
+        self.assertFalse(session.engineToMove())
+
+    # a mate on the 100th ply is still a mate
+    def testMateBeatsFiftyMoveRule(self):
+        session = chess_server.Session(1, "7k/8/6K1/8/8/8/8/R7 w - - 99 80", None, 1, None)
+        session.gs.makeMove(session.gs.moveFromNotation("a1a8"))
+        self.assertEqual(session.status(), "checkmate")
+
+    # moves only mark the accounting stale, stats counts it again
+    def testMemoryCountedByStats(self):
+        server = chess_server.ChessServer(1, "thread")
+        try:
+            response = server.handle({"cmd": "new", "id": 1}, None, [], set())
+            session = server.sessions[response["session"]]
+            self.assertIsNone(session.memory)
+            before = server.stats()["memory"]
+            self.assertEqual(session.memory, before)
+            server.handle({"cmd": "move", "id": 2, "session": session.id, "move": "e2e4"}, None, [], set())
+            self.assertIsNone(session.memory)
+            self.assertGreater(server.stats()["memory"], 0)
+        finally:
+            server.close()
+
+    def testBadDepth(self):
+        server = chess_server.ChessServer(1, "thread")
+        try:
+            for depth in (0, -1, True, 2.5, "3"):
+                with self.subTest(depth=depth):
+                    with self.assertRaises(ValueError):
+                        server.handle({"cmd": "new", "id": 1, "depth": depth}, None, [], set())
+            self.assertEqual(server.sessions, {})
+        finally:
+            server.close()
+
+
+class UndoTest(unittest.TestCase):
+    def play(self, fen, engineSide, notations):
+        self.server = chess_server.ChessServer(1, "thread")
+        self.addCleanup(self.server.close)
+        session = chess_server.Session(1, fen, engineSide, 1, None)
+        self.server.sessions[session.id] = session
+        for notation in notations:
+            session.gs.makeMove(session.gs.moveFromNotation(notation))
+        return session
+
+    def undo(self, session):
+        return self.server.handle({"cmd": "undo", "id": 1, "session": session.id}, None, [], set())
+
+    # the engine's reply goes along with the player's move
+    def testUndoTakesBackReply(self):
+        session = self.play(chess_server.chess_engine.GameState().startFEN, 'b', ["e2e4", "e7e5", "g1f3", "b8c6"])
+        self.assertEqual(len(self.undo(session)["legal"]), 29)
+        self.assertEqual([move.getChessNotation() for move in session.gs.moveLog], ["e2e4", "e7e5"])
+
+    # the player's move ended the game before the engine replied, only that move is taken back
+    def testUndoAfterPlayerMate(self):
+        session = self.play("7k/8/6K1/8/8/8/8/R7 w - - 0 1", 'b', ["a1a2", "h8g8", "a2a8"])
+        self.assertEqual(session.status(), "checkmate")
+        response = self.undo(session)
+        self.assertEqual(response["fen"], "6k1/8/6K1/8/8/8/R7/8 w - - 2 2")
+        self.assertEqual(len(session.gs.moveLog), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+#Chess Tournament Tests
+
+'''Plays single games of chess_tournament against stub engines that misbehave'''
+'''usage: python -m unittest test_chess_tournament'''
+
+import shlex
+import sys
+import unittest
+
+import chess_tournament
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+# a UCI engine that answers the handshake and its first go, then exits when asked for a second move
+EXITING_ENGINE = '''
+import sys
+moves = 0
+for line in sys.stdin:
+    words = line.split()
+    if words == ["uci"]:
+        print("uciok", flush=True)
+    elif words == ["isready"]:
+        print("readyok", flush=True)
+    elif words and words[0] == "go":
+        moves += 1
+        if moves > 1:
+            sys.exit(0)
+        print("bestmove e2e4", flush=True)
+'''
+EXITING_SPEC = "cmd:" + " ".join(shlex.quote(word) for word in (sys.executable, "-c", EXITING_ENGINE))
+
+
+class EngineExitTest(unittest.TestCase):
+    def tearDown(self):
+        chess_tournament._dropPlayer(EXITING_SPEC)
+
+    # white exits on its second move: it forfeits, and the next game starts a fresh engine
+    def testExitMidGame(self):
+        number, white, result, reason, fen, moves = chess_tournament.playGame(
+            0, START_FEN, EXITING_SPEC, "internal", {"depth": 1})
+        self.assertEqual((result, reason), ("0-1", "engine exited"))
+        self.assertEqual(len(moves), 2)
+        self.assertNotIn(EXITING_SPEC, chess_tournament._players)
+        number, white, result, reason, fen, moves = chess_tournament.playGame(
+            1, START_FEN, EXITING_SPEC, "internal", {"depth": 1})
+        self.assertEqual((result, reason, moves[0]), ("0-1", "engine exited", "e2e4"))
+
+    # an engine that cannot be started loses by forfeit instead of stopping the match
+    def testEngineFailsToStart(self):
+        number, white, result, reason, fen, moves = chess_tournament.playGame(
+            0, START_FEN, "internal", "cmd:/nonexistent/engine", {"depth": 1})
+        self.assertEqual((result, reason, moves), ("1-0", "engine exited", []))
+        self.assertNotIn("cmd:/nonexistent/engine", chess_tournament._players)
+
+
+if __name__ == "__main__":
+    unittest.main()
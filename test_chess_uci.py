@@ -0,0 +1,42 @@
+#Chess UCI Tests
+
+'''Drives chess_uci.main with a script of commands and checks its replies'''
+'''usage: python -m unittest test_chess_uci'''
+
+import io
+import unittest
+
+import chess_uci
+
+
+# the lines chess_uci.main writes for the given command lines
+def runUCI(*commands):
+    out = io.StringIO()
+    chess_uci.main(io.StringIO("".join(command + "\n" for command in commands)), out)
+    return out.getvalue().splitlines()
+
+
+class PositionTest(unittest.TestCase):
+    def testBadFENIsReported(self):
+        lines = runUCI("uci", "position fen 4k3/8/8/8/8/8/8/4K3 w - e9 0 1", "isready")
+        self.assertTrue(any(line.startswith("info string invalid fen:") for line in lines))
+        self.assertEqual(lines[-1], "readyok")
+
+    # the position from before the bad FEN is the one searched, not an empty or king-less board
+    def testBadFENKeepsPosition(self):
+        lines = runUCI("position startpos moves e2e4", "position fen 8/8/8/8/8/8/8/8 w - - 0 1", "isready",
+                       "go depth 1")
+        self.assertIn("info string invalid fen: fen needs one king a side", lines)
+        self.assertIn("readyok", lines)
+        bestmove = lines[-1].split()
+        self.assertEqual(bestmove[0], "bestmove")
+        self.assertIn(bestmove[1][1], "78") # black, to move after e2e4, moves from its own half
+
+    def testGoodFEN(self):
+        lines = runUCI("position fen 4k3/8/8/8/8/8/8/R3K3 w Q - 0 1 moves e1c1", "go depth 1")
+        self.assertFalse(any(line.startswith("info string") for line in lines))
+        self.assertTrue(lines[-1].startswith("bestmove e8"))
+
+
+if __name__ == "__main__":
+    unittest.main()